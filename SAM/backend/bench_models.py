@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+bench_models.py
+
+Compare SAM backbones / CPU runtimes on a fixed set of stored tiles: encoder
+and decoder latency, and IoU of the selected mask against a reference model
+(vit_h by default).
+
+The corpus is a directory with PNG tiles and a corpus.json:
+
+    {"tiles": [{"file": "tile_000.png", "points": [[320, 320], [410, 255]]}, ...]}
+
+Points are pixel coordinates of clicks on that tile.
+
+Usage:
+    python bench_models.py --corpus bench_corpus --models vit_b vit_b-int8 vit_l-int8 \
+        --out model_bench.json
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from farm_segment_google_sam import load_predictor, select_best_mask, _predictor_cache
+from model_registry import resolve_model
+
+
+def load_corpus(corpus_dir: str) -> List[Dict]:
+    """[{'name', 'image' (HxWx3 uint8), 'points' [[x, y], ...]}] from a corpus directory."""
+    with open(os.path.join(corpus_dir, "corpus.json"), encoding="utf-8") as f:
+        spec = json.load(f)
+    tiles = []
+    for entry in spec["tiles"]:
+        img = Image.open(os.path.join(corpus_dir, entry["file"])).convert("RGB")
+        tiles.append({"name": entry["file"], "image": np.array(img), "points": entry["points"]})
+    return tiles
+
+
+def percentile_summary(values: List[float]) -> Dict[str, float]:
+    arr = np.asarray(values, dtype=float)
+    if arr.size == 0:
+        return {}
+    return {
+        "n": int(arr.size),
+        "mean": round(float(arr.mean()), 4),
+        "p50": round(float(np.percentile(arr, 50)), 4),
+        "p95": round(float(np.percentile(arr, 95)), 4),
+        "p99": round(float(np.percentile(arr, 99)), 4),
+    }
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def run_model(name: str, corpus: List[Dict]):
+    """Masks selected for every (tile, point) plus per-stage timings."""
+    spec = resolve_model(name)
+    t0 = time.perf_counter()
+    predictor = load_predictor(spec)
+    load_s = time.perf_counter() - t0
+
+    encode_s, decode_s, masks = [], [], []
+    for tile in corpus:
+        t0 = time.perf_counter()
+        predictor.set_image(tile["image"])
+        encode_s.append(time.perf_counter() - t0)
+        for x, y in tile["points"]:
+            t0 = time.perf_counter()
+            out_masks, scores, _ = predictor.predict(
+                point_coords=np.array([[x, y]]), point_labels=np.array([1]), multimask_output=True,
+            )
+            decode_s.append(time.perf_counter() - t0)
+            masks.append(select_best_mask(out_masks, scores, x, y))
+
+    # Free the model before loading the next one
+    _predictor_cache.clear()
+    del predictor
+    gc.collect()
+    return masks, {"load_s": round(load_s, 2), "encode_s": percentile_summary(encode_s),
+                   "decode_s": percentile_summary(decode_s)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark SAM models against a reference.")
+    parser.add_argument("--corpus", required=True, help="Directory with corpus.json and tiles")
+    parser.add_argument("--models", nargs="+", required=True, help="Model names or tiers to compare")
+    parser.add_argument("--reference", default="vit_h", help="Model the IoU is measured against")
+    parser.add_argument("--out", help="Write results JSON here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    print(f"Corpus: {len(corpus)} tiles, {sum(len(t['points']) for t in corpus)} points", file=sys.stderr)
+
+    print(f"Reference {args.reference}...", file=sys.stderr)
+    ref_masks, ref_stats = run_model(args.reference, corpus)
+    results = {"reference": {"model": resolve_model(args.reference).name, **ref_stats}, "models": []}
+
+    for name in args.models:
+        print(f"Model {name}...", file=sys.stderr)
+        masks, stats = run_model(name, corpus)
+        ious = [mask_iou(m, r) for m, r in zip(masks, ref_masks)]
+        stats["iou_vs_reference"] = percentile_summary(ious)
+        stats["encode_speedup"] = round(ref_stats["encode_s"]["mean"] / stats["encode_s"]["mean"], 2)
+        results["models"].append({"model": resolve_model(name).name, **stats})
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+bench_pipeline.py
+
+Reproducible benchmark of the segmentation pipeline on a fixed corpus (same
+format as bench_models.py: a directory with PNG tiles and corpus.json).
+
+Sections:
+    tile_fetch   google_static_map_tile against a local fixture server standing
+                 in for Google Static Maps (pooled client, tile cache bypassed)
+    set_image    image encoder, per tile
+    predict      prompt encoder + mask decoder, per click
+    polygonize   mask_to_polygon and masks_to_polygons, per selected mask
+    endpoint     full POST /segment on an in-process server, at each
+                 --concurrency level: latency percentiles and throughput
+
+Also reported: peak RSS, and IoU of the selected masks against golden masks
+(--golden; create them once with --write-golden). The output is JSON;
+--compare old.json new.json lists latency regressions between two runs.
+
+Usage:
+    python bench_pipeline.py --corpus bench_corpus --write-golden golden.npz
+    python bench_pipeline.py --corpus bench_corpus --golden golden.npz --concurrency 1 4 16 \
+        --out bench_$(git rev-parse --short HEAD).json
+    python bench_pipeline.py --compare bench_old.json bench_new.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from bench_models import load_corpus, percentile_summary, mask_iou
+
+# Arbitrary but fixed area for the endpoint clicks (central India)
+BENCH_LAT, BENCH_LON = 20.5937, 78.9629
+BENCH_ZOOM = 19
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# ---- fixture tile server ---------------------------------------------------
+def corpus_origin(i: int, width: int, height: int):
+    """World pixel (zoom BENCH_ZOOM) of the top-left corner of corpus tile i on the fixture map."""
+    from farm_segment_google_sam import latlon_to_world_px
+    cx, cy = latlon_to_world_px(BENCH_LAT, BENCH_LON + i * 0.01, BENCH_ZOOM)
+    return int(round(cx)) - width // 2, int(round(cy)) - height // 2
+
+
+class FixtureTileServer:
+    """
+    Local HTTP/1.1 keep-alive server standing in for Google Static Maps.
+
+    Corpus tile i is laid out on the map at corpus_origin(i). A request whose
+    tile overlaps one of them gets that imagery cut out around the requested
+    center (gray outside it), so the server's snapped tile shows the click at
+    the corpus pixel it came from. Any other request gets one of the corpus
+    tiles unchanged (chosen by a stable hash of the center parameter).
+    """
+
+    def __init__(self, corpus_dir: str, files: List[str]):
+        from farm_segment_google_sam import latlon_to_world_px
+        tiles, placed = [], []
+        for i, name in enumerate(files):
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                tiles.append(f.read())
+            img = Image.open(io.BytesIO(tiles[-1])).convert("RGB")
+            placed.append((corpus_origin(i, *img.size), img))
+        crops: Dict[tuple, bytes] = {}
+
+        def placed_tile(center: str, size: str) -> Optional[bytes]:
+            try:
+                lat, lon = (float(v) for v in center.split(","))
+                width, height = (int(v) for v in size.split("x"))
+            except ValueError:
+                return None
+            cx, cy = latlon_to_world_px(lat, lon, BENCH_ZOOM)
+            left, top = int(round(cx)) - width // 2, int(round(cy)) - height // 2
+            for i, ((x0, y0), img) in enumerate(placed):
+                if x0 < left + width and left < x0 + img.width and y0 < top + height and top < y0 + img.height:
+                    key = (i, left - x0, top - y0, width, height)
+                    if key not in crops:
+                        canvas = Image.new("RGB", (width, height), (128, 128, 128))
+                        canvas.paste(img, (x0 - left, y0 - top))
+                        buf = io.BytesIO()
+                        canvas.save(buf, format="PNG")
+                        crops[key] = buf.getvalue()
+                    return crops[key]
+            return None
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                center = query.get("center", [""])[0]
+                body = placed_tile(center, query.get("size", [""])[0])
+                if body is None:
+                    body = tiles[sum(center.encode()) % len(tiles)]
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/staticmap"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---- sections --------------------------------------------------------------
+def bench_tile_fetch(n: int) -> Dict:
+    from imagery import google_static_map_tile
+    times = []
+    for i in range(n):
+        # A degree south of the placed corpus tiles: raw tiles, no cut-outs
+        t0 = time.perf_counter()
+        google_static_map_tile(BENCH_LAT - 1.0 + i * 1e-3, BENCH_LON, BENCH_ZOOM, 640, "bench", use_cache=False)
+        times.append(time.perf_counter() - t0)
+    return {"seconds": percentile_summary(times)}
+
+
+def bench_model(corpus: List[Dict], model: Optional[str]):
+    """set_image / predict / polygonize timings and the selected masks, in corpus order."""
+    from farm_segment_google_sam import (
+        load_predictor, select_best_mask, mask_to_polygon, masks_to_polygons, tile_bbox,
+    )
+    from model_registry import resolve_model
+
+    predictor = load_predictor(resolve_model(model))
+    encode_s, decode_s, polygon_s, legacy_polygon_s, masks = [], [], [], [], []
+    for tile in corpus:
+        h, w = tile["image"].shape[:2]
+        bbox = tile_bbox(BENCH_LAT, BENCH_LON, BENCH_ZOOM, w, h)
+        t0 = time.perf_counter()
+        predictor.set_image(tile["image"])
+        encode_s.append(time.perf_counter() - t0)
+        for x, y in tile["points"]:
+            t0 = time.perf_counter()
+            out_masks, scores, _ = predictor.predict(
+                point_coords=np.array([[x, y]]), point_labels=np.array([1]), multimask_output=True,
+            )
+            decode_s.append(time.perf_counter() - t0)
+            mask = select_best_mask(out_masks, scores, x, y)
+            masks.append(mask)
+
+            t0 = time.perf_counter()
+            mask_to_polygon(mask, bbox, (x, y))
+            polygon_s.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            masks_to_polygons([mask], bbox)
+            legacy_polygon_s.append(time.perf_counter() - t0)
+
+    stats = {
+        "set_image": {"seconds": percentile_summary(encode_s)},
+        "predict": {"seconds": percentile_summary(decode_s)},
+        "polygonize": {"seconds": percentile_summary(polygon_s)},
+        "masks_to_polygons": {"seconds": percentile_summary(legacy_polygon_s)},
+    }
+    return stats, masks
+
+
+def endpoint_clicks(corpus: List[Dict]) -> List[Dict]:
+    """One lat/lng click per corpus point, at that point of the tile as FixtureTileServer places it."""
+    from farm_segment_google_sam import world_px_to_latlon
+    clicks = []
+    for i, tile in enumerate(corpus):
+        h, w = tile["image"].shape[:2]
+        x0, y0 = corpus_origin(i, w, h)
+        for x, y in tile["points"]:
+            # Center of the clicked pixel
+            lat, lng = world_px_to_latlon(x0 + x + 0.5, y0 + y + 0.5, BENCH_ZOOM)
+            clicks.append({"lat": lat, "lng": lng})
+    return clicks
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_endpoint(clicks: List[Dict], concurrency: List[int], repeat: int, startup_timeout: float) -> Dict:
+    """Run the FastAPI app in-process and drive POST /segment at each concurrency level."""
+    import requests
+    import uvicorn
+    import main
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{port}"
+
+    t0 = time.perf_counter()
+    while True:
+        try:
+            if requests.get(base + "/readyz", timeout=5).status_code == 200:
+                break
+        except requests.ConnectionError:
+            pass
+        if time.perf_counter() - t0 > startup_timeout:
+            server.should_exit = True
+            raise RuntimeError("Server did not become ready in time")
+        time.sleep(0.5)
+    results = {"startup_s": round(time.perf_counter() - t0, 2), "levels": []}
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(concurrency)))
+
+    def one(click: Dict):
+        start = time.perf_counter()
+        r = session.post(base + "/segment", json=click, timeout=300)
+        return time.perf_counter() - start, r.status_code
+
+    try:
+        for level in concurrency:
+            work = clicks * repeat
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(level) as pool:
+                outcomes = list(pool.map(one, work))
+            wall = time.perf_counter() - t0
+            ok = [s for s, status in outcomes if status == 200]
+            results["levels"].append({
+                "concurrency": level,
+                "requests": len(work),
+                "errors": len(work) - len(ok),
+                "throughput_rps": round(len(work) / wall, 3),
+                "seconds": percentile_summary(ok),
+            })
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+    return results
+
+
+# ---- golden masks / comparison --------------------------------------------
+def save_golden(path: str, masks: List[np.ndarray]) -> None:
+    np.savez_compressed(path, **{f"m{i}": np.packbits(m) for i, m in enumerate(masks)},
+                        shapes=np.array([m.shape for m in masks]))
+
+
+def golden_iou(path: str, masks: List[np.ndarray]) -> Dict:
+    data = np.load(path)
+    shapes = data["shapes"]
+    if len(shapes) != len(masks):
+        raise ValueError(f"Golden file has {len(shapes)} masks, corpus produced {len(masks)}")
+    ious = []
+    for i, mask in enumerate(masks):
+        h, w = shapes[i]
+        golden = np.unpackbits(data[f"m{i}"])[:h * w].reshape(h, w).astype(bool)
+        ious.append(mask_iou(mask, golden))
+    return percentile_summary(ious)
+
+
+def _latency_metrics(result: Dict, prefix: str = ""):
+    """Yield (name, seconds summary) for every latency summary in a result JSON."""
+    for key, value in result.items():
+        if not isinstance(value, dict):
+            continue
+        if key == "seconds":
+            yield prefix.rstrip("."), value
+        else:
+            yield from _latency_metrics(value, f"{prefix}{key}.")
+    for level in result.get("levels", []):
+        yield f"{prefix}c{level['concurrency']}", level["seconds"]
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Print p50/p95 changes between two result files; exit status 1 on regressions."""
+    with open(old_path, encoding="utf-8") as f:
+        old = dict(_latency_metrics(json.load(f)))
+    with open(new_path, encoding="utf-8") as f:
+        new = dict(_latency_metrics(json.load(f)))
+    regressions = 0
+    for name in sorted(set(old) & set(new)):
+        for pct in ("p50", "p95"):
+            a, b = old[name].get(pct), new[name].get(pct)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:32s} {pct}  {a * 1000:9.1f} ms -> {b * 1000:9.1f} ms  {change:+7.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the SAM segmentation pipeline.")
+    parser.add_argument("--corpus", help="Directory with corpus.json and tiles")
+    parser.add_argument("--model", help="Model name or tier (default: SAM_MODEL)")
+    parser.add_argument("--golden", help="Golden masks (.npz) to measure IoU against")
+    parser.add_argument("--write-golden", help="Save the selected masks as the golden set and exit")
+    parser.add_argument("--fetches", type=int, default=50, help="Tile downloads from the fixture server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Concurrency levels for the endpoint benchmark")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the clicks per concurrency level")
+    parser.add_argument("--skip-endpoint", action="store_true", help="Only benchmark the library stages")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--out", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown flagged by --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+    if not args.corpus:
+        parser.error("--corpus is required")
+
+    corpus = load_corpus(args.corpus)
+    n_points = sum(len(t["points"]) for t in corpus)
+    print(f"Corpus: {len(corpus)} tiles, {n_points} points", file=sys.stderr)
+
+    with FixtureTileServer(args.corpus, [t["name"] for t in corpus]) as fixture:
+        # Point the whole pipeline at the fixture server, with fresh caches, no result
+        # cache, and a throwaway result log / farm store / job directory
+        state_dir = tempfile.mkdtemp(prefix="bench_state_")
+        os.environ.update({
+            "IMAGERY_SOURCE": "google",
+            "IMAGERY_BASE_URL": fixture.url,
+            "GOOGLE_MAPS_API_KEY": "bench",
+            "TILE_CACHE_DIR": tempfile.mkdtemp(prefix="bench_tiles_"),
+            "RESULT_CACHE": "off",
+            "RESULTS_LOG": os.path.join(state_dir, "results.geojsonl"),
+            "FARM_STORE": os.path.join(state_dir, "farms.db"),
+            "JOBS_DIR": os.path.join(state_dir, "jobs"),
+        })
+        if args.model:
+            os.environ["SAM_MODEL"] = args.model
+
+        results = {"commit": git_commit(), "model": args.model or os.getenv("SAM_MODEL", "vit_h"),
+                   "corpus": {"tiles": len(corpus), "points": n_points}}
+
+        print("tile_fetch...", file=sys.stderr)
+        results["tile_fetch"] = bench_tile_fetch(args.fetches)
+
+        print("set_image / predict / polygonize...", file=sys.stderr)
+        stats, masks = bench_model(corpus, args.model)
+        results.update(stats)
+        if args.write_golden:
+            save_golden(args.write_golden, masks)
+            print(f"Wrote {len(masks)} golden masks to {args.write_golden}", file=sys.stderr)
+            return 0
+        if args.golden:
+            results["iou_vs_golden"] = golden_iou(args.golden, masks)
+
+        if not args.skip_endpoint:
+            print(f"endpoint at concurrency {args.concurrency}...", file=sys.stderr)
+            results["endpoint"] = bench_endpoint(endpoint_clicks(corpus), args.concurrency, args.repeat,
+                                                 args.startup_timeout)
+        results["peak_rss_mb"] = peak_rss_mb()
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+embedding_cache.py
+
+Memory-bounded LRU cache of SAM image embeddings. Restoring an entry into a
+SamPredictor puts it in the same state as after set_image() on that tile, so a
+repeat click only runs the prompt encoder and mask decoder.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class ImageEmbedding(NamedTuple):
+    """Snapshot of the per-image state a SamPredictor keeps after set_image()."""
+    features: object            # torch.Tensor, 1 x C x H x W
+    original_size: Tuple[int, int]
+    input_size: Tuple[int, int]
+    target_length: int          # ResizeLongestSide target the input_size was computed for
+    nbytes: int
+
+
+def capture_embedding(predictor) -> ImageEmbedding:
+    """Take a snapshot of the image state of a predictor that has an image set."""
+    if not predictor.is_image_set:
+        raise RuntimeError("Predictor has no image set; call set_image() first.")
+    features = predictor.features
+    return ImageEmbedding(
+        features=features,
+        original_size=tuple(predictor.original_size),
+        input_size=tuple(predictor.input_size),
+        target_length=predictor.transform.target_length,
+        nbytes=features.element_size() * features.nelement(),
+    )
+
+
+def restore_embedding(predictor, embedding: ImageEmbedding) -> None:
+    """Load a snapshot back into a predictor, as if set_image() had just run."""
+    if predictor.transform.target_length != embedding.target_length:
+        raise ValueError("Embedding was computed for a different input resolution.")
+    predictor.reset_image()
+    predictor.features = embedding.features
+    predictor.original_size = embedding.original_size
+    predictor.input_size = embedding.input_size
+    predictor.is_image_set = True
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of ImageEmbedding, bounded by total tensor bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, ImageEmbedding]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[ImageEmbedding]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, embedding: ImageEmbedding) -> None:
+        if embedding.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = embedding
+            self._bytes += embedding.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache configured from the environment."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        max_mb = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "256"))
+        _embedding_cache = EmbeddingCache(max_bytes=int(max_mb * 1024 * 1024))
+    return _embedding_cache
@@ -2,53 +2,30 @@
 """
 farm_segment_google_sam.py
 
-Downloads satellite tiles from Google Static Maps and runs Meta's Segment-Anything (SAM)
-for interactive farm boundary segmentation using point prompts.
+Downloads satellite tiles (Google Static Maps by default, see imagery.py) and runs
+Meta's Segment-Anything (SAM) for interactive farm boundary segmentation using point prompts.
 """
 
 import os
 import sys
 import math
-import io
-import json
-from typing import Tuple, List
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 
-import requests
 import numpy as np
-from PIL import Image
 import shapely.geometry as geom
-import geopandas as gpd
-import rasterio.features
-import rasterio.transform
-
-from segment_anything import sam_model_registry, SamPredictor
-import torch
-
-# ---- Google Static Maps downloader helpers ---------------------------------
-GOOGLE_STATIC_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap"
-
-def google_static_map_tile(center_lat: float, center_lon: float, zoom: int, size: int, api_key: str) -> Image.Image:
-    """
-    Download one static map tile centered at lat,lon with zoom and size (px).
-    maptype=satellite to get satellite imagery.
-    """
-    params = {
-        "center": f"{center_lat},{center_lon}",
-        "zoom": str(zoom),
-        "size": f"{size}x{size}",
-        "maptype": "satellite",
-        "scale": "1",
-        "key": api_key
-    }
-    r = requests.get(GOOGLE_STATIC_MAPS_URL, params=params, timeout=30)
-    r.raise_for_status()
-    return Image.open(io.BytesIO(r.content)).convert("RGB")
-
-def meters_per_pixel(lat: float, zoom: int) -> float:
-    tile_size = 256.0
-    earth_circumference = 40075016.686
-    return (math.cos(math.radians(lat)) * earth_circumference) / (2 ** zoom * tile_size)
 
+# torch, segment_anything, geopandas and rasterio are imported where they are
+# used: together they take seconds to import, and the server should be able to
+# answer health checks while the model loads in the background.
+
+from embedding_cache import capture_embedding, restore_embedding, get_embedding_cache
+from model_registry import ModelSpec, resolve_model, optimize_image_encoder, checkpoint_digests
+from model_fetcher import fetch_checkpoint
+from metrics import stage
+from imagery import meters_per_pixel, latlon_to_world_px, world_px_to_latlon, tile_bbox, ImagerySource
+
+# ---- Tile geometry ---------------------------------------------------------
 def bbox_from_center(center_lat, center_lon, zoom, total_px_w, total_px_h) -> Tuple[float,float,float,float]:
     """
     Compute approximate bounding box (min_lon, min_lat, max_lon, max_lat)
@@ -68,46 +45,139 @@ def bbox_from_center(center_lat, center_lon, zoom, total_px_w, total_px_h) -> Tu
 
     return min_lon, min_lat, max_lon, max_lat
 
+def snap_to_tile_grid(lat: float, lon: float, zoom: int, tile_px: int) -> Tuple[float, float]:
+    """
+    Snap a point to the center of its cell on a half-tile grid (in Web Mercator pixels).
+    Every point in the cell lies within tile_px/4 of the snapped center, so the
+    tile centered there always contains the point with margin, and all clicks
+    in the cell share one tile.
+    """
+    step = tile_px / 2.0
+    x, y = latlon_to_world_px(lat, lon, zoom)
+    cx = (math.floor(x / step) + 0.5) * step
+    cy = (math.floor(y / step) + 0.5) * step
+    snapped_lat, snapped_lon = world_px_to_latlon(cx, cy, zoom)
+    return round(snapped_lat, 7), round(snapped_lon, 7)
+
+def latlon_to_tile_px(lat: float, lon: float, bbox: Tuple[float,float,float,float],
+                      width: int, height: int) -> Tuple[int, int]:
+    """Pixel (x, y) of lat/lon inside an image covering bbox, clamped to the image."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x = int((lon - min_lon) / (max_lon - min_lon) * width)
+    y = int((max_lat - lat) / (max_lat - min_lat) * height)
+    return min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+
 # ---- SAM download & setup -------------------------------------------------
-def get_sam_model(checkpoint_path: str = "sam_vit_h.pth", model_type: str = "vit_h"):
+def get_sam_model(checkpoint_path: str = "sam_vit_h.pth", model_type: str = "vit_h",
+                  mmap_weights: Optional[bool] = None, url: Optional[str] = None):
     """
     Downloads or loads a SAM checkpoint and returns a sam model instance and device.
+    With mmap_weights (default: SAM_WEIGHTS_MMAP env), CPU weights are memory-mapped
+    from the checkpoint instead of copied, so every process on the host shares one
+    copy through the page cache.
     """
-    default_url = "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth"
+    default_url = url or "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth"
     if not os.path.exists(checkpoint_path):
-        print("Downloading SAM checkpoint (this can be large, ~2.4GB)...")
-        r = requests.get(default_url, stream=True, timeout=60)
-        r.raise_for_status()
-        with open(checkpoint_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        print("Downloading SAM checkpoint (this can be large, up to ~2.4GB)...")
+        fetch_checkpoint(default_url, checkpoint_path, **checkpoint_digests(model_type))
         print("Downloaded SAM checkpoint to", checkpoint_path)
 
+    import torch
+    from segment_anything import sam_model_registry
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    if mmap_weights is None:
+        mmap_weights = os.getenv("SAM_WEIGHTS_MMAP", "0") == "1"
+    torch_version = tuple(int(part) for part in torch.__version__.split("+")[0].split(".")[:2])
+    if mmap_weights and torch_version < (2, 1):
+        # torch.load(mmap=) and load_state_dict(assign=) arrived in torch 2.1
+        logging.warning(f"SAM_WEIGHTS_MMAP needs torch >= 2.1 (found {torch.__version__}); loading a copy")
+        mmap_weights = False
     print("Loading SAM model on device:", device)
-    sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    if mmap_weights and device == "cpu":
+        sam = sam_model_registry[model_type]()
+        state_dict = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+        sam.load_state_dict(state_dict, assign=True)
+    else:
+        sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    sam.eval()
     sam.to(device=device)
     return sam, device
 
 _predictor_cache = {}
 
-def get_sam_predictor(checkpoint_path: str = "sam_vit_h.pth", model_type: str = "vit_h"):
+def get_sam_predictor(checkpoint_path: str = "sam_vit_h.pth", model_type: str = "vit_h",
+                      runtime: str = "fp32", url: Optional[str] = None):
+    from segment_anything import SamPredictor
+
     global _predictor_cache
-    if checkpoint_path in _predictor_cache:
-        return _predictor_cache[checkpoint_path]
+    cache_key = f"{model_type}-{runtime}:{checkpoint_path}"
+    if cache_key in _predictor_cache:
+        return _predictor_cache[cache_key]
         
-    sam, device = get_sam_model(checkpoint_path, model_type)
+    sam, device = get_sam_model(checkpoint_path, model_type, url=url)
+    if runtime != "fp32":
+        if device == "cpu":
+            print(f"Preparing {runtime} image encoder...")
+            optimize_image_encoder(sam, runtime, checkpoint_path)
+        else:
+            print(f"Runtime '{runtime}' is CPU-only; using the fp32 encoder on {device}")
     predictor = SamPredictor(sam)
-    _predictor_cache[checkpoint_path] = predictor
+    _predictor_cache[cache_key] = predictor
     return predictor
 
+def predictor_memory_bytes() -> Dict[str, int]:
+    """Parameter + buffer bytes of every loaded model, by predictor cache key (packed int8 weights excluded)."""
+    sizes = {}
+    for key, predictor in list(_predictor_cache.items()):
+        tensors = list(predictor.model.parameters()) + list(predictor.model.buffers())
+        sizes[key] = sum(t.element_size() * t.nelement() for t in tensors)
+    return sizes
+
+def load_predictor(spec: ModelSpec):
+    """get_sam_predictor for a registry entry (see model_registry.resolve_model)."""
+    return get_sam_predictor(spec.checkpoint_path, spec.model_type, spec.runtime, spec.url)
+
+def warmup_predictor(predictor, tile_px: int = 640) -> None:
+    """
+    Run one encode + decode on a blank tile so the first real request doesn't pay
+    for lazy initialisation (allocator growth, kernel selection). Bypasses the
+    embedding cache.
+    """
+    predictor.set_image(np.zeros((tile_px, tile_px, 3), dtype=np.uint8))
+    predictor.predict(
+        point_coords=np.array([[tile_px // 2, tile_px // 2]]),
+        point_labels=np.array([1]),
+        multimask_output=True,
+    )
+    predictor.reset_image()
+
+def set_image_cached(predictor, img_np: np.ndarray, cache_key: str) -> bool:
+    """
+    Equivalent to predictor.set_image(img_np), but reuses a cached embedding when
+    the same tile was already encoded by the same model.
+    cache_key must identify both the model and the tile.
+    Returns True on a cache hit.
+    """
+    cache = get_embedding_cache()
+    embedding = cache.get(cache_key)
+    if embedding is not None:
+        restore_embedding(predictor, embedding)
+        return True
+    with stage("set_image"):
+        predictor.set_image(img_np)
+    cache.put(cache_key, capture_embedding(predictor))
+    return False
+
 # ---- mask -> polygon conversion helpers -----------------------------------
 def masks_to_polygons(masks: List[np.ndarray], bbox: Tuple[float,float,float,float]) -> List[geom.Polygon]:
     """
     Convert boolean masks (2D numpy arrays) to shapely Polygons in lat/lon.
     bbox = (min_lon, min_lat, max_lon, max_lat)
     """
+    import rasterio.features
+    import rasterio.transform
+
     min_lon, min_lat, max_lon, max_lat = bbox
     polygons = []
     for mask in masks:
@@ -121,124 +191,538 @@ def masks_to_polygons(masks: List[np.ndarray], bbox: Tuple[float,float,float,flo
                     polygons.append(poly)
     return polygons
 
-# ---- Interactive Segmentation ----------------------------------------------
-def segment_from_point(api_key: str, lat: float, lon: float, zoom: int = 19, tile_px: int = 640):
+# Simplification tolerance for field outlines, in metres (0 disables). Removes
+# the pixel staircase without moving boundaries by more than this.
+SIMPLIFY_TOLERANCE_M = float(os.getenv("SAM_SIMPLIFY_M", "0.5"))
+
+_geod = None
+
+def geodesic_area_m2(polygon: geom.Polygon) -> float:
+    """Area on the WGS84 ellipsoid (correct at any latitude, unlike Web Mercator)."""
+    global _geod
+    if _geod is None:
+        from pyproj import Geod
+        _geod = Geod(ellps="WGS84")
+    area, _ = _geod.geometry_area_perimeter(polygon)
+    return abs(area)
+
+def mask_to_polygon(mask: np.ndarray, bbox: Tuple[float,float,float,float], click: Optional[Tuple[int, int]] = None,
+                    simplify_m: Optional[float] = None) -> Optional[geom.Polygon]:
     """
-    Segment a farm at the given lat/lon using a point prompt.
-    Downloads a single tile centered at lat/lon, runs SAM with the center point as prompt.
+    Outline of the connected component of mask containing click (x, y) -- or the
+    largest component if click is None or outside the mask -- as a lat/lon polygon.
+
+    Only that component is polygonized (cropped to its extent), in pixel space,
+    then simplified with a tolerance in metres and mapped to lat/lon with the
+    bbox's affine transform.
     """
-    # Configure logging
-    import logging
-    logging.basicConfig(filename='debug_sam.log', level=logging.INFO, 
-                        format='%(asctime)s %(message)s', filemode='a')
-    
-    logging.info(f"--- Processing Request: {lat}, {lon} ---")
-    
+    from scipy import ndimage
+    import rasterio.features
+    from shapely.affinity import affine_transform
+
+    labels, n = ndimage.label(mask)
+    if n == 0:
+        return None
+    if click is not None and labels[click[1], click[0]]:
+        component = labels == labels[click[1], click[0]]
+    else:
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        component = labels == int(np.argmax(sizes))
+
+    rows = np.flatnonzero(component.any(axis=1))
+    cols = np.flatnonzero(component.any(axis=0))
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    crop = component[y0:y1, x0:x1].astype(np.uint8)
+
+    polygon = None
+    for geom_json, val in rasterio.features.shapes(crop, mask=crop.astype(bool)):
+        if val == 1:
+            part = geom.shape(geom_json)
+            if polygon is None or part.area > polygon.area:
+                polygon = part
+    if polygon is None:
+        return None
+
+    h, w = mask.shape
+    min_lon, min_lat, max_lon, max_lat = bbox
+    deg_x = (max_lon - min_lon) / w
+    deg_y = (max_lat - min_lat) / h
+
+    simplify_m = SIMPLIFY_TOLERANCE_M if simplify_m is None else simplify_m
+    if simplify_m > 0:
+        m_per_px = deg_y * 111320.0
+        polygon = polygon.simplify(simplify_m / m_per_px, preserve_topology=True)
+
+    # pixel (col, row) in the crop -> lon/lat
+    return affine_transform(polygon, [deg_x, 0, 0, -deg_y, min_lon + x0 * deg_x, max_lat - y0 * deg_y])
+
+def polygons_to_geojson(polygons: List[Optional[geom.Polygon]], properties: Optional[List[Dict]] = None) -> Dict:
+    """
+    Build a FeatureCollection (EPSG:4326) with a geodesic area_m2 property per
+    polygon. Missing polygons (None) become features with a null geometry, so
+    callers can keep one feature per input.
+    """
+    if properties is None:
+        properties = [{} for _ in polygons]
+    features = []
+    for i, (polygon, props) in enumerate(zip(polygons, properties)):
+        props = dict(props)
+        props["area_m2"] = geodesic_area_m2(polygon) if polygon is not None else None
+        features.append({
+            "id": str(i),
+            "type": "Feature",
+            "properties": props,
+            "geometry": geom.mapping(polygon) if polygon is not None else None,
+        })
+    logging.debug(f"Calculated area: {[f['properties']['area_m2'] for f in features]} m2")
+    return {"type": "FeatureCollection", "features": features}
+
+# ---- Interactive Segmentation ----------------------------------------------
+def load_tile(source: ImagerySource, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> np.ndarray:
+    """Fetch a (cached) tile from an imagery source as an RGB array and log basic image stats."""
     try:
-        print(f"Downloading tile at {lat}, {lon}...")
-        img = google_static_map_tile(lat, lon, zoom, tile_px, api_key)
-        img_np = np.array(img)
-        
+        logging.debug(f"Fetching tile at {center_lat}, {center_lon}...")
+        with stage("tile_fetch"):
+            img_np = source.read(center_lat, center_lon, zoom, tile_px)
+
         # Log image stats
-        logging.info(f"Image shape: {img_np.shape}, Mean: {img_np.mean():.2f}, Std: {img_np.std():.2f}")
+        logging.debug(f"Image shape: {img_np.shape}, Mean: {img_np.mean():.2f}, Std: {img_np.std():.2f}")
         if img_np.std() < 5:
             logging.warning("Image seems blank or uniform!")
     except Exception as e:
         logging.error(f"Image download failed: {e}")
         raise e
-    
-    bbox = bbox_from_center(lat, lon, zoom, tile_px, tile_px)
-    logging.info(f"BBox: {bbox}")
-    
-    checkpoint_path = os.path.join(os.path.dirname(__file__), "sam_vit_h.pth")
-    if not os.path.exists(checkpoint_path):
-        checkpoint_path = "sam_vit_h.pth"
-        
-    predictor = get_sam_predictor(checkpoint_path=checkpoint_path)
-    predictor.set_image(img_np)
-    
-    # Use center point as prompt
-    center_x, center_y = tile_px // 2, tile_px // 2
-    input_point = np.array([[center_x, center_y]])
-    input_label = np.array([1])  # 1 = foreground
-    
-    # Generate multiple masks
-    masks, scores, logits = predictor.predict(
-        point_coords=input_point,
-        point_labels=input_label,
-        multimask_output=True,
+    return img_np
+
+class Tile(NamedTuple):
+    """An image to segment on: a grid tile or a mosaic of them."""
+    key: str                                    # identifies the imagery in cache keys
+    bbox: Tuple[float, float, float, float]     # (min_lon, min_lat, max_lon, max_lat)
+    image: np.ndarray                           # H x W x 3 uint8
+
+class PromptResult(NamedTuple):
+    polygon: Optional[geom.Polygon]
+    score: Optional[float]
+    edges: str = ""         # sides of the image the chosen mask touches ("N", "S", "W", "E")
+    policy: str = ""        # mask selection policy that produced it (see MASK_POLICIES)
+
+def load_grid_tile(source: ImagerySource, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> Tile:
+    """The (cached) grid tile centered at a snapped center."""
+    img_np = load_tile(source, center_lat, center_lon, zoom, tile_px)
+    return Tile(
+        key=source.tile_key(center_lat, center_lon, zoom, tile_px),
+        bbox=tile_bbox(center_lat, center_lon, zoom, tile_px, tile_px),
+        image=img_np,
     )
-    
-    # SAM returns 3 masks with multimask_output=True
-    # Select the best mask based on:
-    # 1. Score (SAM's confidence)
-    # 2. Size (not too small, not too large - farm-sized)
-    # 3. Contains the click point
-    
-    best_mask = None
+
+def encode_tile(predictor, tile: Tile, model_key: str) -> None:
+    """set_image() for a tile, through the embedding cache."""
+    if set_image_cached(predictor, tile.image, f"{model_key}|{tile.key}"):
+        logging.info("Reused cached image embedding")
+
+def mask_edges(mask: np.ndarray) -> str:
+    """Which image borders a mask touches, e.g. "NE"."""
+    return "".join(side for side, touches in (
+        ("N", mask[0].any()), ("S", mask[-1].any()), ("W", mask[:, 0].any()), ("E", mask[:, -1].any()),
+    ) if touches)
+
+# Masks smaller or larger than these fractions of the image are not farms
+MIN_AREA_RATIO = 0.002
+MAX_AREA_RATIO = 0.80
+
+def select_best_mask(masks: np.ndarray, scores: np.ndarray, click_x: int, click_y: int) -> np.ndarray:
+    """Pick one of SAM's multimask outputs for a click (see select_best_index)."""
+    return masks[select_best_index(masks, scores, click_x, click_y)]
+
+def select_best_index(masks: np.ndarray, scores: np.ndarray, click_x: int, click_y: int) -> int:
+    """
+    Index of the best of SAM's multimask outputs for a click.
+
+    Select the best mask based on:
+    1. Score (SAM's confidence)
+    2. Size (not too small, not too large - farm-sized)
+    3. Contains the click point
+    """
+    best_index = None
     best_score = -1
-    total_pixels = tile_px * tile_px
-    
+    h, w = masks[0].shape
+    total_pixels = h * w
+
     for i, (mask, score) in enumerate(zip(masks, scores)):
         mask_area = mask.sum()
         area_ratio = mask_area / total_pixels
-        
-        logging.info(f"Mask {i}: score={score:.3f}, area_ratio={area_ratio:.4f} ({area_ratio*100:.2f}%)")
-        
+
+        logging.debug(f"Mask {i}: score={score:.3f}, area_ratio={area_ratio:.4f} ({area_ratio*100:.2f}%)")
+
         # Skip masks that are too small (<0.2%) or too large (>80%)
         # Lowered threshold to 0.002 to catch small plots
-        if area_ratio < 0.002 or area_ratio > 0.80:
-            print(f"  Mask {i}: score={score:.3f}, area={area_ratio*100:.1f}% - SKIPPED (size)")
-            logging.info(f"Mask {i} SKIPPED (size)")
+        if area_ratio < MIN_AREA_RATIO or area_ratio > MAX_AREA_RATIO:
+            logging.debug(f"Mask {i} SKIPPED (size)")
             continue
-            
+
         # Check if mask contains the click point
-        if not mask[center_y, center_x]:
-            print(f"  Mask {i}: score={score:.3f}, area={area_ratio*100:.1f}% - SKIPPED (no center)")
-            logging.info(f"Mask {i} SKIPPED (no center at {center_x},{center_y})")
+        if not mask[click_y, click_x]:
+            logging.debug(f"Mask {i} SKIPPED (no click point at {click_x},{click_y})")
             continue
-        
-        print(f"  Mask {i}: score={score:.3f}, area={area_ratio*100:.1f}% - CANDIDATE")
-        
+
+        logging.debug(f"Mask {i} CANDIDATE")
+
         # Prefer masks with reasonable area (5-50% of tile)
         area_score = 1.0 - abs(area_ratio - 0.25) * 2  # Peak at 25%
         combined_score = score * 0.7 + area_score * 0.3
-        
+
         if combined_score > best_score:
             best_score = combined_score
-            best_mask = mask
-    
+            best_index = i
+
     # Fallback to highest scoring mask if no good candidate found
-    if best_mask is None:
-        print("  No suitable mask found, using highest score")
+    if best_index is None:
         logging.warning("No suitable mask found, using highest score fallback")
-        best_idx = np.argmax(scores)
-        best_mask = masks[best_idx]
+        best_index = int(np.argmax(scores))
+    return best_index
+
+# ---- Refinement ------------------------------------------------------------
+# "heuristic": the multimask output picked by select_best_index.
+# "refine": that mask's low-res logits are fed back as mask_input for one more
+#   (single-mask) decoder pass, together with negative points sampled just
+#   outside it, which trims leaks into neighbouring fields. The refined mask is
+#   kept only if it still contains the click and is farm-sized; otherwise the
+#   heuristic choice stands (and is reported as such).
+MASK_POLICIES = ("heuristic", "refine")
+MASK_POLICY = os.getenv("SAM_MASK_POLICY", "heuristic")
+# Automatic negative points per prompt in the refinement pass
+REFINE_NEGATIVES = int(os.getenv("SAM_REFINE_NEGATIVES", "4"))
+
+def auto_negative_points(mask: np.ndarray, click: Tuple[int, int], count: int = REFINE_NEGATIVES) -> List[Tuple[int, int]]:
+    """
+    Up to count background points (x, y) just outside mask: on a ring around
+    its bounding box (margin ~10% of its size), at evenly spaced angles seen
+    from the click, keeping only points that are inside the image and off the mask.
+    """
+    if count <= 0 or not mask.any():
+        return []
+    h, w = mask.shape
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    y0, y1, x0, x1 = rows[0], rows[-1], cols[0], cols[-1]
+    margin = max(4, int(0.1 * max(x1 - x0, y1 - y0)))
+    half_w = (x1 - x0) / 2 + margin
+    half_h = (y1 - y0) / 2 + margin
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+
+    points = []
+    for k in range(count):
+        angle = 2 * math.pi * k / count
+        dx, dy = math.cos(angle), math.sin(angle)
+        # Scale the direction onto the expanded bounding box
+        t = min(half_w / abs(dx) if dx else math.inf, half_h / abs(dy) if dy else math.inf)
+        x, y = int(round(cx + dx * t)), int(round(cy + dy * t))
+        if 0 <= x < w and 0 <= y < h and not mask[y, x] and (x, y) != tuple(click):
+            points.append((x, y))
+    return points
+
+def refine_prompts(predictor, pixel_prompts: List[Tuple], decoded: List[Tuple], chosen: List[int],
+                   indices: List[int]) -> Dict[int, Tuple[np.ndarray, float]]:
+    """
+    Second decoder pass for the prompts at indices: the chosen mask's logits as
+    mask_input plus automatic negative points. Returns {index: (mask, score)}
+    for the refinements that were accepted.
+    """
+    second = []
+    for i in indices:
+        click, coords, labels, box = pixel_prompts[i]
+        negatives = auto_negative_points(decoded[i][0][chosen[i]], click)
+        second.append((coords + negatives, labels + [0] * len(negatives), box))
+    refined = decode_prompts(predictor, second, mask_inputs=[decoded[i][2][chosen[i]] for i in indices],
+                             multimask_output=False)
+
+    accepted = {}
+    for i, (masks, scores, _) in zip(indices, refined):
+        mask = masks[0]
+        click = pixel_prompts[i][0]
+        area_ratio = mask.sum() / mask.size
+        if mask[click[1], click[0]] and MIN_AREA_RATIO <= area_ratio <= MAX_AREA_RATIO:
+            accepted[i] = (mask, float(scores[0]))
+        else:
+            logging.debug(f"Refined mask for prompt {i} rejected (area_ratio={area_ratio:.4f})")
+    return accepted
+
+def segment_from_point(source: ImagerySource, lat: float, lon: float, zoom: int = 19, tile_px: int = 640,
+                       model: Optional[str] = None, policy: Optional[str] = None):
+    """
+    Segment a farm at the given lat/lon using a point prompt.
+    Fetches the (cached) tile whose grid cell contains lat/lon from the imagery
+    source (see imagery.get_imagery_source) and runs SAM with the clicked
+    pixel as prompt.
+    model: model name or quality tier (see model_registry); None = deployment default.
+    policy: mask selection policy (see MASK_POLICIES); None = SAM_MASK_POLICY.
+    """
+    logging.debug(f"--- Processing Request: {lat}, {lon} ---")
     
-    polygons = masks_to_polygons([best_mask], bbox)
-    logging.info(f"Generated {len(polygons)} polygons")
+    center_lat, center_lon = snap_to_tile_grid(lat, lon, zoom, tile_px)
+    tile = load_grid_tile(source, center_lat, center_lon, zoom, tile_px)
+    bbox = tile.bbox
+    logging.debug(f"BBox: {bbox}")
     
-    if not polygons:
+    spec = resolve_model(model)
+    predictor = load_predictor(spec)
+
+    # The clicked point is the prompt
+    prompt = {"lat": lat, "lng": lon, "policy": policy}
+    result = segment_tile_prompts(predictor, spec.key, tile, [prompt])[0]
+    if result.edges and ADAPTIVE_MOSAIC:
+        result = extend_across_tiles(predictor, spec.key, source, prompt,
+                                     (center_lat, center_lon), zoom, tile_px, result)
+
+    if result.polygon is None:
         return {"type": "FeatureCollection", "features": []}
-        
-    # Sort by area descending to find the main field and ignore noise
-    polygons.sort(key=lambda p: p.area, reverse=True)
-    
-    # Keep only the largest polygon
-    if len(polygons) > 1:
-        logging.info(f"Filtering noise: Keeping largest polygon of {len(polygons)}")
-        polygons = [polygons[0]]
-        
-    gdf = gpd.GeoDataFrame({'geometry': polygons})
-    gdf = gdf.set_crs(epsg=4326)
-    
-    # Calculate area
-    try:
-        gdf['area_m2'] = gdf.to_crs(epsg=3857).area
-        logging.info(f"Calculated area: {gdf['area_m2'].values[0]} m2")
-    except Exception as e:
-        logging.error(f"Area calculation failed: {e}")
-        gdf['area_m2'] = None
-    
-    return json.loads(gdf.to_json())
+    with stage("serialize"):
+        return point_geojson(result)
+
+def point_geojson(result: PromptResult) -> Dict:
+    """Single-click response: one feature with score and the mask selection policy used."""
+    return polygons_to_geojson([result.polygon], [{"score": result.score, "policy": result.policy}])
+
+# ---- Batched Segmentation --------------------------------------------------
+# Prompts decoded together in one predict_torch call; bounds peak memory of
+# the B x 3 x H x W mask tensor.
+DECODE_BATCH_SIZE = 64
+
+def _prompts_to_pixels(prompt: Dict, bbox: Tuple[float,float,float,float], width: int, height: int):
+    """
+    Convert one point prompt (lat/lng, optional negative points and box in
+    degrees) to pixel space. Negative points outside the tile are dropped and
+    the box is clipped to the tile.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    click = latlon_to_tile_px(prompt["lat"], prompt["lng"], bbox, width, height)
+    coords = [click]
+    labels = [1]
+    for neg_lat, neg_lng in prompt.get("negative_points") or []:
+        if min_lat <= neg_lat <= max_lat and min_lon <= neg_lng <= max_lon:
+            coords.append(latlon_to_tile_px(neg_lat, neg_lng, bbox, width, height))
+            labels.append(0)
+    box = None
+    if prompt.get("box"):
+        b_min_lon, b_min_lat, b_max_lon, b_max_lat = prompt["box"]
+        x0, y1 = latlon_to_tile_px(b_min_lat, b_min_lon, bbox, width, height)
+        x1, y0 = latlon_to_tile_px(b_max_lat, b_max_lon, bbox, width, height)
+        box = [x0, y0, x1, y1]
+    return click, coords, labels, box
+
+def decode_prompts(predictor, prompts: Sequence[Tuple[List, List, Optional[List]]],
+                   mask_inputs: Optional[Sequence[np.ndarray]] = None, multimask_output: bool = True):
+    """
+    Run SAM's prompt encoder and mask decoder on many prompts for the image
+    currently set on the predictor, in batched predict_torch calls.
+
+    prompts: (coords, labels, box) per prompt, in pixel space. Prompts with and
+    without boxes are decoded in separate calls (predict_torch takes boxes for
+    all or none); point lists are padded with label -1.
+    mask_inputs: optional 256 x 256 low-res logits per prompt (from an earlier pass).
+    Returns (masks, scores, low-res logits) numpy arrays per prompt, in input order.
+    """
+    import torch
+
+    results = [None] * len(prompts)
+    with_box = [i for i, p in enumerate(prompts) if p[2] is not None]
+    without_box = [i for i, p in enumerate(prompts) if p[2] is None]
+
+    for group in (with_box, without_box):
+        for start in range(0, len(group), DECODE_BATCH_SIZE):
+            idx = group[start:start + DECODE_BATCH_SIZE]
+            n_points = max(len(prompts[i][0]) for i in idx)
+            coords = np.zeros((len(idx), n_points, 2), dtype=np.float32)
+            labels = np.full((len(idx), n_points), -1, dtype=np.int64)
+            for row, i in enumerate(idx):
+                pts, lbls, _ = prompts[i]
+                coords[row, :len(pts)] = pts
+                labels[row, :len(lbls)] = lbls
+
+            coords = predictor.transform.apply_coords(coords, predictor.original_size)
+            coords_t = torch.as_tensor(coords, dtype=torch.float, device=predictor.device)
+            labels_t = torch.as_tensor(labels, dtype=torch.int, device=predictor.device)
+            boxes_t = None
+            if prompts[idx[0]][2] is not None:
+                boxes = np.array([prompts[i][2] for i in idx], dtype=np.float32)
+                boxes = predictor.transform.apply_boxes(boxes, predictor.original_size)
+                boxes_t = torch.as_tensor(boxes, dtype=torch.float, device=predictor.device)
+            mask_t = None
+            if mask_inputs is not None:
+                mask_t = torch.as_tensor(np.stack([mask_inputs[i][None] for i in idx]),
+                                         dtype=torch.float, device=predictor.device)
+
+            with stage("predict"):
+                masks, scores, logits = predictor.predict_torch(
+                    coords_t, labels_t, boxes=boxes_t, mask_input=mask_t, multimask_output=multimask_output,
+                )
+                masks = masks.cpu().numpy()
+                scores = scores.float().cpu().numpy()
+                logits = logits.float().cpu().numpy()
+            for row, i in enumerate(idx):
+                results[i] = (masks[row], scores[row], logits[row])
+    return results
+
+def group_by_tile(prompts: List[Dict], zoom: int, tile_px: int) -> Dict[Tuple[float, float], List[int]]:
+    """Indices of prompts grouped by the snapped center of the grid tile covering them."""
+    tiles: Dict[Tuple[float, float], List[int]] = {}
+    for i, prompt in enumerate(prompts):
+        center = snap_to_tile_grid(prompt["lat"], prompt["lng"], zoom, tile_px)
+        tiles.setdefault(center, []).append(i)
+    return tiles
+
+def segment_tile_prompts(predictor, model_key: str, tile: Tile, prompts: List[Dict]) -> List[PromptResult]:
+    """
+    Encode one tile (through the embedding cache) and decode all prompts on it
+    in batched calls. Prompts whose 'policy' (default MASK_POLICY) is "refine"
+    get a second, batched decoder pass. Returns a PromptResult per prompt.
+    """
+    encode_tile(predictor, tile, model_key)
+    h, w = tile.image.shape[:2]
+
+    pixel_prompts = [_prompts_to_pixels(p, tile.bbox, w, h) for p in prompts]
+    decoded = decode_prompts(predictor, [(c, l, b) for _, c, l, b in pixel_prompts])
+    chosen = [select_best_index(masks, scores, click[0], click[1])
+              for (click, _, _, _), (masks, scores, _) in zip(pixel_prompts, decoded)]
+    to_refine = [i for i, p in enumerate(prompts) if (p.get("policy") or MASK_POLICY) == "refine"]
+    refined = refine_prompts(predictor, pixel_prompts, decoded, chosen, to_refine) if to_refine else {}
+
+    results = []
+    for i, ((click, _, _, _), (masks, scores, _)) in enumerate(zip(pixel_prompts, decoded)):
+        if i in refined:
+            best_mask, score = refined[i]
+            policy = "refine"
+        else:
+            best_mask, score = masks[chosen[i]], float(scores[chosen[i]])
+            policy = "heuristic"
+        with stage("polygonize"):
+            polygon = mask_to_polygon(best_mask, tile.bbox, click)
+        results.append(PromptResult(polygon, score, mask_edges(best_mask), policy))
+    return results
+
+# ---- Multi-tile mosaics ----------------------------------------------------
+# A zoom-19 tile is only ~190 m across; when the chosen mask runs into the tile
+# border, the neighbouring tiles it runs into are fetched, stitched into a
+# mosaic and the prompt is decoded again on the larger extent.
+ADAPTIVE_MOSAIC = os.getenv("SAM_ADAPTIVE_MOSAIC", "1") == "1"
+# Largest mosaic, in tiles per side
+MOSAIC_MAX_SPAN = int(os.getenv("SAM_MOSAIC_MAX_SPAN", "3"))
+
+# Mosaic extent around a grid tile: inclusive (first, last) tile offsets
+Extent = Tuple[Tuple[int, int], Tuple[int, int]]
+
+def grow_extent(extent: Extent, edges: str, max_span: int = MOSAIC_MAX_SPAN) -> Optional[Extent]:
+    """Extend the mosaic one tile towards each touched edge; None if it cannot grow."""
+    (r0, r1), (c0, c1) = extent
+    if "N" in edges and r1 - r0 + 1 < max_span:
+        r0 -= 1
+    if "S" in edges and r1 - r0 + 1 < max_span:
+        r1 += 1
+    if "W" in edges and c1 - c0 + 1 < max_span:
+        c0 -= 1
+    if "E" in edges and c1 - c0 + 1 < max_span:
+        c1 += 1
+    grown = ((r0, r1), (c0, c1))
+    return grown if grown != extent else None
+
+def mosaic_tile_centers(center: Tuple[float, float], zoom: int, tile_px: int,
+                        extent: Extent) -> List[List[Tuple[float, float]]]:
+    """Snapped centers of the tiles in a mosaic, as rows (north to south)."""
+    (r0, r1), (c0, c1) = extent
+    cx, cy = latlon_to_world_px(center[0], center[1], zoom)
+    rows = []
+    for r in range(r0, r1 + 1):
+        row = []
+        for c in range(c0, c1 + 1):
+            lat, lon = world_px_to_latlon(cx + c * tile_px, cy + r * tile_px, zoom)
+            row.append((round(lat, 7), round(lon, 7)))
+        rows.append(row)
+    return rows
+
+def build_mosaic(source: ImagerySource, center: Tuple[float, float], zoom: int, tile_px: int, extent: Extent,
+                 images: List[List[np.ndarray]]) -> Tile:
+    """Stitch tile images (rows from mosaic_tile_centers) into one georeferenced Tile."""
+    (r0, r1), (c0, c1) = extent
+    cx, cy = latlon_to_world_px(center[0], center[1], zoom)
+    left, right = cx - tile_px / 2 + c0 * tile_px, cx + tile_px / 2 + c1 * tile_px
+    top, bottom = cy - tile_px / 2 + r0 * tile_px, cy + tile_px / 2 + r1 * tile_px
+    max_lat, min_lon = world_px_to_latlon(left, top, zoom)
+    min_lat, max_lon = world_px_to_latlon(right, bottom, zoom)
+    center_key = source.tile_key(center[0], center[1], zoom, tile_px)
+    return Tile(
+        key=f"{center_key}|mosaic r{r0}:{r1} c{c0}:{c1}",
+        bbox=(min_lon, min_lat, max_lon, max_lat),
+        image=np.concatenate([np.concatenate(row, axis=1) for row in images], axis=0),
+    )
+
+_mosaic_fetch_pool = None
+
+def extend_across_tiles(predictor, model_key: str, source: ImagerySource, prompt: Dict, center: Tuple[float, float],
+                        zoom: int, tile_px: int, result: PromptResult) -> PromptResult:
+    """
+    Re-decode a prompt on growing mosaics until its mask no longer touches the
+    border (or the mosaic reaches MOSAIC_MAX_SPAN). Neighbour tiles are fetched
+    in parallel; tiles and mosaic embeddings go through the usual caches.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    global _mosaic_fetch_pool
+    if _mosaic_fetch_pool is None:
+        _mosaic_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mosaic-fetch")
+
+    extent: Extent = ((0, 0), (0, 0))
+    while result.edges:
+        grown = grow_extent(extent, result.edges)
+        if grown is None:
+            break
+        extent = grown
+        centers = mosaic_tile_centers(center, zoom, tile_px, extent)
+        futures = [[_mosaic_fetch_pool.submit(load_tile, source, lat, lon, zoom, tile_px) for lat, lon in row]
+                   for row in centers]
+        images = [[f.result() for f in row] for row in futures]
+        mosaic = build_mosaic(source, center, zoom, tile_px, extent, images)
+        logging.info(f"Mask touches {result.edges}; re-decoding on mosaic {extent}")
+        result = segment_tile_prompts(predictor, model_key, mosaic, [prompt])[0]
+    return result
+
+def segment_points(source: ImagerySource, prompts: List[Dict], zoom: int = 19, tile_px: int = 640,
+                   model: Optional[str] = None) -> Dict:
+    """
+    Segment many farms at once.
+
+    prompts: dicts with 'lat', 'lng' and optionally 'negative_points'
+    ([(lat, lng), ...]), 'box' ((min_lon, min_lat, max_lon, max_lat)) and
+    'policy' (see MASK_POLICIES).
+    Prompts are grouped by the grid tile that covers them; each tile is encoded
+    once and all its prompts are decoded in batched calls.
+    Returns a FeatureCollection with one feature per prompt, in input order
+    (null geometry where nothing was segmented).
+    """
+    if not prompts:
+        return {"type": "FeatureCollection", "features": []}
+
+    tiles = group_by_tile(prompts, zoom, tile_px)
+    logging.debug(f"--- Batch Request: {len(prompts)} points on {len(tiles)} tiles ---")
+
+    spec = resolve_model(model)
+    predictor = load_predictor(spec)
+
+    results: List[PromptResult] = [PromptResult(None, None)] * len(prompts)
+    for center, indices in tiles.items():
+        tile = load_grid_tile(source, center[0], center[1], zoom, tile_px)
+        tile_results = segment_tile_prompts(predictor, spec.key, tile, [prompts[i] for i in indices])
+        for i, result in zip(indices, tile_results):
+            if result.edges and ADAPTIVE_MOSAIC:
+                result = extend_across_tiles(predictor, spec.key, source, prompts[i], center, zoom, tile_px, result)
+            results[i] = result
+    with stage("serialize"):
+        return batch_geojson(prompts, results)
 
+def batch_geojson(prompts: List[Dict], results: List[PromptResult]) -> Dict:
+    """FeatureCollection with one feature per prompt (index, lat, lng, score, policy, area_m2)."""
+    properties = [
+        {"index": i, "lat": p["lat"], "lng": p["lng"], "score": r.score, "policy": r.policy or None}
+        for i, (p, r) in enumerate(zip(prompts, results))
+    ]
+    return polygons_to_geojson([r.polygon for r in results], properties)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+farm_store.py
+
+Persistent store of accepted farm polygons, so a click inside a farm that is
+already mapped is answered without running SAM.
+
+Farms live in SQLite (FARM_STORE, default backend/farms/farms.db; "off"
+disables the store). Every change is a new version of a farm; older versions
+are kept for audit. Current farms are held in memory with an STRtree, so a
+point lookup is a tree query plus a point-in-polygon test. Farms inserted
+after the tree was built are checked linearly until the next rebuild, so
+inserts don't pay for a rebuild each.
+
+Usage:
+    python farm_store.py load fields.geojsonl            # bulk load (GeoJSON or GeoJSON lines)
+    python farm_store.py load village.geojson --source survey-2025
+    python farm_store.py lookup 19.5412 74.1733
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import shapely.geometry as geom
+from shapely.strtree import STRtree
+
+# Farms added since the last STRtree build before the tree is rebuilt
+REBUILD_AFTER = 512
+
+
+class FarmStore:
+    """Versioned farm polygons (EPSG:4326) with a point lookup index."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS farms ("
+            " farm_id TEXT, version INTEGER, current INTEGER, geometry TEXT, properties TEXT,"
+            " source TEXT, created REAL, PRIMARY KEY (farm_id, version))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS farms_current ON farms (current)")
+        self._db.commit()
+
+        # farm_id -> (version, shape, feature) of current versions
+        self._current: Dict[str, Tuple[int, geom.base.BaseGeometry, Dict]] = {}
+        self._tree: Optional[STRtree] = None
+        self._tree_entries: List[Tuple[str, int]] = []
+        self._pending: List[str] = []
+        self._reload()
+
+    @classmethod
+    def from_env(cls) -> Optional["FarmStore"]:
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "farms", "farms.db")
+        path = os.getenv("FARM_STORE", default)
+        return None if path == "off" else cls(path)
+
+    # ---- index -------------------------------------------------------------
+    @staticmethod
+    def _feature(farm_id: str, version: int, geometry: Dict, properties: Dict, source: str,
+                 created: float) -> Dict:
+        props = dict(properties)
+        props.update(farm_id=farm_id, version=version, source=source, created=created)
+        return {"type": "Feature", "id": farm_id, "properties": props, "geometry": geometry}
+
+    def _index(self, farm_id: str, version: int, geometry, properties, source: str, created: float) -> Dict:
+        if isinstance(geometry, str):
+            geometry, properties = json.loads(geometry), json.loads(properties)
+        feature = self._feature(farm_id, version, geometry, properties, source, created)
+        self._current[farm_id] = (version, geom.shape(geometry), feature)
+        self._pending.append(farm_id)
+        return feature
+
+    def _reload(self) -> None:
+        """Rebuild the in-memory index from the database."""
+        self._current = {}
+        for row in self._db.execute(
+            "SELECT farm_id, version, geometry, properties, source, created FROM farms WHERE current = 1"
+        ):
+            self._index(*row)
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._tree_entries = [(farm_id, entry[0]) for farm_id, entry in self._current.items()]
+        shapes = [self._current[farm_id][1] for farm_id, _ in self._tree_entries]
+        self._tree = STRtree(shapes) if shapes else None
+        self._pending = []
+
+    def _candidates(self, area: geom.base.BaseGeometry) -> Iterable[Tuple[geom.base.BaseGeometry, Dict]]:
+        """Current farms whose bounds may intersect area (lock held)."""
+        seen = set()
+        hits = self._tree.query(area) if self._tree is not None else []
+        for i in hits:
+            farm_id, version = self._tree_entries[i]
+            entry = self._current.get(farm_id)
+            if entry is not None and entry[0] == version:  # skip replaced / retired versions
+                seen.add(farm_id)
+                yield entry[1], entry[2]
+        for farm_id in self._pending:
+            entry = self._current.get(farm_id)
+            if entry is not None and farm_id not in seen:
+                seen.add(farm_id)
+                yield entry[1], entry[2]
+
+    # ---- queries -----------------------------------------------------------
+    def lookup(self, lat: float, lng: float) -> Optional[Dict]:
+        """The current farm containing the point (the smallest, if farms overlap), or None."""
+        point = geom.Point(lng, lat)
+        with self._lock:
+            hits = [(shape.area, feature) for shape, feature in self._candidates(point) if shape.covers(point)]
+        return min(hits, key=lambda hit: hit[0])[1] if hits else None
+
+    def query(self, bounds: Tuple[float, float, float, float]) -> List[Dict]:
+        """Current farms intersecting bounds (min_lon, min_lat, max_lon, max_lat)."""
+        area = geom.box(*bounds)
+        with self._lock:
+            return [feature for shape, feature in self._candidates(area) if shape.intersects(area)]
+
+    def get(self, farm_id: str, version: Optional[int] = None) -> Optional[Dict]:
+        """A farm's current version, or the given version."""
+        sql = "SELECT farm_id, version, geometry, properties, source, created FROM farms WHERE farm_id = ?"
+        args: tuple = (farm_id,)
+        if version is None:
+            sql += " AND current = 1"
+        else:
+            sql += " AND version = ?"
+            args += (version,)
+        with self._lock:
+            row = self._db.execute(sql, args).fetchone()
+        if row is None:
+            return None
+        return self._feature(row[0], row[1], json.loads(row[2]), json.loads(row[3]), row[4], row[5])
+
+    def history(self, farm_id: str) -> List[Dict]:
+        """All versions of a farm, oldest first (a retired farm has no current version)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version, current, source, created FROM farms WHERE farm_id = ? ORDER BY version",
+                (farm_id,),
+            ).fetchall()
+        return [{"version": v, "current": bool(c), "source": s, "created": t} for v, c, s, t in rows]
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    # ---- changes -----------------------------------------------------------
+    def _put(self, geometry: Dict, properties: Dict, farm_id: Optional[str], source: str) -> Dict:
+        """Insert a farm or a new version of one (lock held, caller commits)."""
+        shape = geom.shape(geometry)
+        if shape.is_empty or shape.geom_type not in ("Polygon", "MultiPolygon"):
+            raise ValueError("A farm geometry must be a non-empty Polygon or MultiPolygon")
+        farm_id = str(farm_id) if farm_id is not None else uuid.uuid4().hex
+        row = self._db.execute("SELECT MAX(version) FROM farms WHERE farm_id = ?", (farm_id,)).fetchone()
+        version = (row[0] or 0) + 1
+        created = time.time()
+        properties = {k: v for k, v in (properties or {}).items()
+                      if k not in ("farm_id", "version", "source", "created")}
+        self._db.execute("UPDATE farms SET current = 0 WHERE farm_id = ?", (farm_id,))
+        self._db.execute(
+            "INSERT INTO farms VALUES (?, ?, 1, ?, ?, ?, ?)",
+            (farm_id, version, json.dumps(geometry), json.dumps(properties), source, created),
+        )
+        return self._index(farm_id, version, geometry, properties, source, created)
+
+    def _maybe_rebuild(self) -> None:
+        if len(self._pending) > REBUILD_AFTER:
+            self._rebuild()
+
+    def put(self, geometry: Dict, properties: Optional[Dict] = None, farm_id: Optional[str] = None,
+            source: str = "api") -> Dict:
+        """
+        Add a farm (new id when farm_id is None) or a new version of farm_id.
+        Returns the stored feature. Raises ValueError for non-polygon geometry.
+        """
+        with self._lock:
+            feature = self._put(geometry, properties or {}, farm_id, source)
+            self._db.commit()
+            self._maybe_rebuild()
+        return feature
+
+    def bulk_load(self, features: Iterable[Dict], source: str = "bulk") -> int:
+        """
+        Add many GeoJSON features in one transaction. A feature's `farm_id`
+        property makes it a new version of that farm (feature ids are not
+        used: pipeline outputs number their features from 0). Features without
+        a polygon are skipped. Returns the number stored.
+        """
+        count = 0
+        with self._lock:
+            try:
+                for feature in features:
+                    geometry = feature.get("geometry")
+                    if not geometry or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+                        continue
+                    props = feature.get("properties") or {}
+                    self._put(geometry, props, props.get("farm_id"), source)
+                    count += 1
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                self._reload()  # drop the rolled-back farms from the index
+                raise
+            self._rebuild()
+        return count
+
+    def retire(self, farm_id: str) -> bool:
+        """Remove a farm from lookups; its versions stay in the history. False if unknown."""
+        with self._lock:
+            if farm_id not in self._current:
+                return False
+            self._db.execute("UPDATE farms SET current = 0 WHERE farm_id = ?", (farm_id,))
+            self._db.commit()
+            del self._current[farm_id]
+        return True
+
+
+def read_features(path: str) -> Iterable[Dict]:
+    """Features of a GeoJSON file (FeatureCollection or Feature) or GeoJSON-lines file."""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith((".geojsonl", ".geojsonseq", ".ndjson", ".jsonl")):
+            for line in f:
+                line = line.strip().lstrip("\x1e")
+                if line:
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        yield from data["features"]
+    elif data.get("type") == "Feature":
+        yield data
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the store of accepted farm polygons.")
+    parser.add_argument("--store", help="SQLite file (default: FARM_STORE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="Bulk load GeoJSON / GeoJSON-lines features")
+    load.add_argument("path")
+    load.add_argument("--source", default="bulk", help="Recorded as each version's source")
+    lookup = commands.add_parser("lookup", help="Farm containing a point")
+    lookup.add_argument("lat", type=float)
+    lookup.add_argument("lng", type=float)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    store = FarmStore(args.store) if args.store else FarmStore.from_env()
+    if store is None:
+        print("FARM_STORE is off", file=sys.stderr)
+        return 1
+
+    if args.command == "load":
+        t0 = time.perf_counter()
+        count = store.bulk_load(read_features(args.path), source=args.source)
+        print(f"Loaded {count} farms in {time.perf_counter() - t0:.1f}s ({len(store)} current)")
+    else:
+        t0 = time.perf_counter()
+        feature = store.lookup(args.lat, args.lng)
+        elapsed_us = (time.perf_counter() - t0) * 1e6
+        print(json.dumps(feature) if feature else "No farm at this point")
+        print(f"Lookup took {elapsed_us:.0f} us over {len(store)} farms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+http_client.py
+
+Shared HTTP client for imagery downloads.
+
+- One requests.Session per process with keep-alive, so tiles reuse pooled
+  TCP/TLS connections instead of handshaking for every download; the pool size
+  per host is bounded.
+- Transient failures (connection errors, timeouts, truncated or undecodable
+  bodies, TLS errors, 429 and 5xx) are retried with full-jitter exponential
+  backoff, honouring Retry-After.
+- A circuit breaker stops hammering an upstream that keeps failing: after
+  IMAGERY_BREAKER_FAILURES consecutive failed requests, calls fail fast with
+  CircuitOpen for IMAGERY_BREAKER_COOLDOWN_S, then one trial request decides
+  whether it closes again.
+- The base URL is configurable (IMAGERY_BASE_URL), so a local stand-in server
+  can replace Google Static Maps in tests and benchmarks.
+
+requests speaks HTTP/1.1 only; connection reuse is what removes the handshake
+cost here.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpen(requests.RequestException):
+    """The upstream failed repeatedly; requests are refused until the cooldown ends."""
+
+    def __init__(self, retry_after: int, message: str = "Imagery provider unavailable, retry later"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open -> closed/open."""
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                return "half-open"
+            return "open"
+
+    def before_request(self) -> None:
+        """Raise CircuitOpen unless a request may go out now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown_seconds - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_flight:
+                raise CircuitOpen(max(1, int(remaining + 0.999)))
+            # Half-open: let exactly one trial request through
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    logging.warning(f"Imagery circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Give back the half-open trial of a request that ended without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class ImageryClient:
+    """Pooled, retrying HTTP GET client guarded by a circuit breaker."""
+
+    def __init__(self, base_url: str, pool_size: int = 16, timeout: float = 30.0, max_retries: int = 3,
+                 backoff_base: float = 0.25, backoff_max: float = 8.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Args:
+            base_url: URL requests are sent to (e.g. Google Static Maps, or a local stand-in)
+            pool_size: Keep-alive connections kept per host
+            timeout: Connect/read timeout per attempt, in seconds
+            max_retries: Retries after the first attempt for transient failures
+            backoff_base: First backoff ceiling in seconds (doubles per retry, full jitter)
+            backoff_max: Upper bound on a single backoff
+            breaker: Circuit breaker (default: CircuitBreaker())
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        # Retries are handled below (with jitter and the breaker), not by urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_env(cls, default_base_url: str) -> "ImageryClient":
+        return cls(
+            base_url=os.getenv("IMAGERY_BASE_URL") or default_base_url,
+            pool_size=int(os.getenv("IMAGERY_POOL_SIZE", "16")),
+            timeout=float(os.getenv("IMAGERY_TIMEOUT_S", "30")),
+            max_retries=int(os.getenv("IMAGERY_MAX_RETRIES", "3")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("IMAGERY_BREAKER_FAILURES", "5")),
+                cooldown_seconds=float(os.getenv("IMAGERY_BREAKER_COOLDOWN_S", "30")),
+            ),
+        )
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, params: Optional[Dict] = None, url: Optional[str] = None) -> bytes:
+        """
+        GET url (default: base_url) and return the body.
+
+        Raises:
+            CircuitOpen: The breaker is open
+            requests.RequestException: The request still failed after retries
+        """
+        url = url or self.base_url
+        attempt = 0
+        while True:
+            self.breaker.before_request()
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    self.breaker.record_success()
+                    return response.content
+                error: requests.RequestException = requests.HTTPError(
+                    f"{response.status_code} from imagery provider", response=response)
+            except requests.HTTPError:
+                # Non-retryable 4xx: the request is wrong, not the upstream
+                self.breaker.record_success()
+                raise
+            except requests.RequestException as e:
+                # Connection errors, timeouts, truncated bodies, TLS failures...
+                error = e
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+
+            self.breaker.record_failure()
+            if attempt >= self.max_retries:
+                raise error
+            wait = self._backoff(attempt, response)
+            logging.info(f"Imagery request failed ({error}); retry {attempt + 1} in {wait:.2f}s")
+            time.sleep(wait)
+            attempt += 1
+
+
+_clients: Dict[str, ImageryClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_imagery_client(default_base_url: str) -> ImageryClient:
+    """Process-wide client for an imagery endpoint (IMAGERY_BASE_URL overrides the URL)."""
+    with _clients_lock:
+        client = _clients.get(default_base_url)
+        if client is None:
+            client = _clients[default_base_url] = ImageryClient.from_env(default_base_url)
+        return client
@@ -0,0 +1,242 @@
+"""
+imagery.py
+
+Where satellite imagery comes from.
+
+Every source answers the same question: the RGB image of tile_px x tile_px
+Web Mercator pixels at a zoom level, centered on a (snapped) point. The rest of
+the pipeline (grid snapping, mosaics, caches, georeferencing) is therefore
+identical whatever the source:
+
+    google                  Google Static Maps (default; needs GOOGLE_MAPS_API_KEY)
+    xyz:<url template>      standard slippy-map tiles, e.g.
+                            xyz:https://tiles.example.org/{z}/{x}/{y}.jpg
+                            fetched in parallel and stitched
+    raster:<path>           local GeoTIFF / Cloud-Optimized GeoTIFF / MBTiles
+    cog:<path>, mbtiles:<path>
+                            (aliases of raster:) read through rasterio: only the
+                            blocks (and overview level) covering the window are
+                            read, warped to Web Mercator with the file's exact
+                            geotransform
+
+The deployment's source is IMAGERY_SOURCE (default "google").
+"""
+
+import io
+import os
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from tile_cache import TileCache, get_tile_cache
+from http_client import get_imagery_client
+
+EARTH_CIRCUMFERENCE = 40075016.686
+
+
+# ---- Web Mercator ----------------------------------------------------------
+def meters_per_pixel(lat: float, zoom: int) -> float:
+    tile_size = 256.0
+    return (math.cos(math.radians(lat)) * EARTH_CIRCUMFERENCE) / (2 ** zoom * tile_size)
+
+def latlon_to_world_px(lat: float, lon: float, zoom: int) -> Tuple[float, float]:
+    """Web Mercator global pixel coordinates (256px tiles) for lat/lon at zoom."""
+    scale = 256.0 * (2 ** zoom)
+    siny = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    x = (lon + 180.0) / 360.0 * scale
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return x, y
+
+def world_px_to_latlon(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    """Inverse of latlon_to_world_px."""
+    scale = 256.0 * (2 ** zoom)
+    lon = x / scale * 360.0 - 180.0
+    n = math.pi - 2.0 * math.pi * y / scale
+    lat = math.degrees(math.atan(math.sinh(n)))
+    return lat, lon
+
+def tile_bbox(center_lat: float, center_lon: float, zoom: int, width: int, height: int) -> Tuple[float, float, float, float]:
+    """Exact (min_lon, min_lat, max_lon, max_lat) of a width x height Mercator image centered at lat/lon."""
+    cx, cy = latlon_to_world_px(center_lat, center_lon, zoom)
+    max_lat, min_lon = world_px_to_latlon(cx - width / 2.0, cy - height / 2.0, zoom)
+    min_lat, max_lon = world_px_to_latlon(cx + width / 2.0, cy + height / 2.0, zoom)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+# ---- Google Static Maps downloader helpers ---------------------------------
+GOOGLE_STATIC_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+def google_static_map_tile(center_lat: float, center_lon: float, zoom: int, size: int, api_key: str,
+                           maptype: str = "satellite", use_cache: bool = True) -> Image.Image:
+    """
+    Download one static map tile centered at lat,lon with zoom and size (px).
+    maptype=satellite to get satellite imagery.
+    Tiles are served from the tile cache when possible; callers should pass a
+    center from snap_to_tile_grid so nearby requests share the same tile.
+    Downloads go through the shared pooled/retrying imagery client.
+    """
+    cache = get_tile_cache() if use_cache else None
+    key = TileCache.make_key(center_lat, center_lon, zoom, size, maptype)
+    data = cache.get(key) if cache else None
+
+    if data is None:
+        params = {
+            "center": f"{center_lat},{center_lon}",
+            "zoom": str(zoom),
+            "size": f"{size}x{size}",
+            "maptype": maptype,
+            "scale": "1",
+            "key": api_key
+        }
+        data = get_imagery_client(GOOGLE_STATIC_MAPS_URL).get(params)
+        if cache:
+            cache.put(key, data)
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+# ---- sources ---------------------------------------------------------------
+class ImagerySource:
+    """Base class: subclasses implement read()."""
+
+    # Identifies the imagery in tile / embedding cache keys
+    name = "imagery"
+
+    def read(self, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> np.ndarray:
+        """tile_px x tile_px x 3 uint8 image centered at lat/lon (Web Mercator, 256px tiles at zoom)."""
+        raise NotImplementedError
+
+    def tile_key(self, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> str:
+        return TileCache.make_key(center_lat, center_lon, zoom, tile_px, self.name)
+
+
+class GoogleStaticMapsSource(ImagerySource):
+    """Google Static Maps satellite tiles (metered)."""
+
+    name = "satellite"
+
+    def __init__(self, api_key: str, maptype: str = "satellite"):
+        self.api_key = api_key
+        self.name = maptype
+
+    def read(self, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> np.ndarray:
+        img = google_static_map_tile(center_lat, center_lon, zoom, tile_px, self.api_key, maptype=self.name)
+        return np.array(img)
+
+
+class XYZTileSource(ImagerySource):
+    """Slippy-map tiles ({z}/{x}/{y} URL template), fetched in parallel and stitched."""
+
+    def __init__(self, url_template: str, tile_size: int = 256, fetch_concurrency: int = 8):
+        self.url_template = url_template
+        self.tile_size = tile_size
+        self.name = f"xyz|{url_template}"
+        self._pool = ThreadPoolExecutor(fetch_concurrency, thread_name_prefix="xyz-fetch")
+
+    def _tile(self, z: int, x: int, y: int) -> Image.Image:
+        n = 2 ** z
+        if not 0 <= y < n:
+            return Image.new("RGB", (self.tile_size, self.tile_size))
+        x %= n
+        cache = get_tile_cache()
+        key = TileCache.make_key(x, y, z, self.tile_size, self.name)
+        data = cache.get(key)
+        if data is None:
+            url = self.url_template.format(z=z, x=x, y=y)
+            data = get_imagery_client(self.url_template).get(url=url)
+            cache.put(key, data)
+        return Image.open(io.BytesIO(data)).convert("RGB").resize((self.tile_size, self.tile_size))
+
+    def read(self, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> np.ndarray:
+        # Tile servers with 512px tiles serve zoom z at the resolution of 256px zoom z+1
+        z = zoom - int(math.log2(self.tile_size // 256))
+        cx, cy = latlon_to_world_px(center_lat, center_lon, zoom)
+        left, top = int(round(cx - tile_px / 2.0)), int(round(cy - tile_px / 2.0))
+        tx0, ty0 = left // self.tile_size, top // self.tile_size
+        tx1, ty1 = (left + tile_px - 1) // self.tile_size, (top + tile_px - 1) // self.tile_size
+
+        coords = [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+        tiles = self._pool.map(lambda c: self._tile(z, c[0], c[1]), coords)
+        canvas = Image.new("RGB", ((tx1 - tx0 + 1) * self.tile_size, (ty1 - ty0 + 1) * self.tile_size))
+        for (tx, ty), tile in zip(coords, tiles):
+            canvas.paste(tile, ((tx - tx0) * self.tile_size, (ty - ty0) * self.tile_size))
+        ox, oy = left - tx0 * self.tile_size, top - ty0 * self.tile_size
+        return np.array(canvas.crop((ox, oy, ox + tile_px, oy + tile_px)))
+
+
+class RasterSource(ImagerySource):
+    """
+    Local raster (GeoTIFF, COG, MBTiles, anything GDAL reads) in any CRS.
+    Each read warps just the requested window to Web Mercator; GDAL reads only
+    the blocks it needs, from the overview level closest to the zoom.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"raster|{os.path.abspath(path)}"
+        # Dataset handles are not thread-safe; keep one per thread
+        self._local = threading.local()
+
+    def _dataset(self):
+        src = getattr(self._local, "src", None)
+        if src is None:
+            import rasterio
+            src = self._local.src = rasterio.open(self.path)
+        return src
+
+    def read(self, center_lat: float, center_lon: float, zoom: int, tile_px: int) -> np.ndarray:
+        from affine import Affine
+        from rasterio.enums import Resampling
+        from rasterio.vrt import WarpedVRT
+
+        # Window in EPSG:3857 metres
+        res = EARTH_CIRCUMFERENCE / (256.0 * 2 ** zoom)
+        cx, cy = latlon_to_world_px(center_lat, center_lon, zoom)
+        left = (cx - tile_px / 2.0) * res - EARTH_CIRCUMFERENCE / 2
+        top = EARTH_CIRCUMFERENCE / 2 - (cy - tile_px / 2.0) * res
+
+        src = self._dataset()
+        bands = [1, 2, 3] if src.count >= 3 else [1, 1, 1]
+        with WarpedVRT(src, crs="EPSG:3857", transform=Affine(res, 0, left, 0, -res, top),
+                       width=tile_px, height=tile_px, resampling=Resampling.bilinear, nodata=0) as vrt:
+            data = vrt.read(bands)
+        if data.dtype != np.uint8:
+            # e.g. 16-bit orthophotos: stretch to 8 bits
+            hi = np.percentile(data[data > 0], 99) if (data > 0).any() else 1
+            data = np.clip(data / max(hi, 1) * 255, 0, 255).astype(np.uint8)
+        return np.ascontiguousarray(data.transpose(1, 2, 0))
+
+
+def make_imagery_source(spec: str, api_key: Optional[str] = None) -> ImagerySource:
+    """
+    Build a source from a spec string (see the module docstring).
+    Raises ValueError for unknown specs or a missing API key.
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "google":
+        if not api_key:
+            raise ValueError("Google Maps API Key not configured. Set GOOGLE_MAPS_API_KEY in .env")
+        return GoogleStaticMapsSource(api_key)
+    if kind == "xyz" and arg:
+        return XYZTileSource(arg, tile_size=int(os.getenv("IMAGERY_XYZ_TILE_SIZE", "256")))
+    if kind in ("raster", "cog", "mbtiles") and arg:
+        if not os.path.exists(arg):
+            raise ValueError(f"Imagery file not found: {arg}")
+        return RasterSource(arg)
+    raise ValueError(f"Unknown imagery source '{spec}'. Use google, xyz:<url template> or raster:<path>.")
+
+
+_sources: Dict[Tuple[str, Optional[str]], ImagerySource] = {}
+_sources_lock = threading.Lock()
+
+def get_imagery_source(api_key: Optional[str] = None, spec: Optional[str] = None) -> ImagerySource:
+    """Process-wide source for spec (default: IMAGERY_SOURCE, else "google")."""
+    spec = spec or os.getenv("IMAGERY_SOURCE", "google")
+    with _sources_lock:
+        source = _sources.get((spec, api_key))
+        if source is None:
+            source = _sources[(spec, api_key)] = make_imagery_source(spec, api_key)
+        return source
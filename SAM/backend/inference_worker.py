@@ -0,0 +1,385 @@
+"""
+inference_worker.py
+
+Execution model for the FastAPI server.
+
+- Tile downloads run on a bounded thread pool and are awaited, so the event
+  loop never blocks on the network.
+- All SAM calls happen on one dedicated inference thread. SamPredictor is
+  stateful (set_image/predict), so a single owner thread is what keeps
+  concurrent requests from corrupting each other; every batch restores the
+  embedding for its own tile before decoding.
+- Jobs are collected for a short window and prompts that land on the same
+  tile are decoded together (micro-batching).
+- Optionally (SAM_WORKER_PROCESSES > 0) tile groups are fanned out to a pool
+  of pre-forked inference processes sharing one copy of the weights instead
+  (see worker_pool.py); each process handles one tile at a time.
+- When a field's mask runs into the tile border, the prompt is re-decoded on
+  a mosaic of the tile and its neighbours (fetched in parallel), enqueued as
+  one more job.
+- Admission control bounds the number of requests in flight; beyond that the
+  server answers 503 with Retry-After instead of queueing without limit.
+- The model is loaded and warmed up in the background after startup; until
+  then `status` is not "ready" and requests are answered with 503.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from farm_segment_google_sam import (
+    Extent, PromptResult, Tile, load_predictor, group_by_tile, load_grid_tile, load_tile,
+    segment_tile_prompts, point_geojson, batch_geojson, warmup_predictor,
+    ADAPTIVE_MOSAIC, grow_extent, mosaic_tile_centers, build_mosaic,
+)
+from model_registry import resolve_model
+from imagery import ImagerySource
+from worker_pool import SamProcessPool, run_region_tile, run_tile_job
+from metrics import Trace, bind_context, current_trace, observe, record_stages, stage, tracing
+
+
+class Overloaded(Exception):
+    """Raised when the worker cannot accept another request."""
+
+    def __init__(self, retry_after: int, message: str = "Server busy, retry later"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TileJob:
+    """Prompts of one request that fall on one tile (or mosaic), plus the future to resolve."""
+    __slots__ = ("tile", "model", "prompts", "future", "trace", "enqueued_at")
+
+    def __init__(self, tile: Tile, model: str, prompts: List[Dict], future: asyncio.Future,
+                 trace: Optional[Trace] = None):
+        self.tile = tile
+        self.model = model
+        self.prompts = prompts
+        self.trace = trace
+        self.enqueued_at = time.perf_counter()
+        self.future = future
+
+
+class InferenceWorker:
+    """Owns the SAM predictor and serves segmentation requests from the event loop."""
+
+    def __init__(self, max_pending: int = 32, batch_window_ms: float = 20, max_batch_prompts: int = 64,
+                 download_concurrency: int = 8, retry_after: int = 5, zoom: int = 19, tile_px: int = 640,
+                 process_pool: Optional[SamProcessPool] = None, warmup: bool = True,
+                 preload_models: Optional[List[str]] = None):
+        """
+        Args:
+            max_pending: Requests admitted at once (downloading, queued or running)
+            batch_window_ms: How long to wait for more jobs before running a batch
+            max_batch_prompts: Stop collecting a batch once it has this many prompts
+            download_concurrency: Parallel tile downloads
+            retry_after: Seconds suggested to clients that get a 503
+            process_pool: Run inference in worker processes instead of the inference thread
+            warmup: Run a dummy inference after loading the model
+            preload_models: Models loaded at startup besides the default (others load on first use)
+        """
+        self.max_pending = max_pending
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_prompts = max_batch_prompts
+        self.download_concurrency = download_concurrency
+        self.retry_after = retry_after
+        self.zoom = zoom
+        self.tile_px = tile_px
+        self.process_pool = process_pool
+        self.warmup = warmup
+        self.models = [resolve_model(None).name] + [resolve_model(m).name for m in preload_models or []]
+
+        self.status = "starting"   # -> loading -> ready | failed
+        self.error: Optional[str] = None
+        self.startup_seconds: Optional[float] = None
+        self.pending = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._download_pool: Optional[ThreadPoolExecutor] = None
+        self._inference_pool: Optional[ThreadPoolExecutor] = None
+        self._pool_tasks = set()
+        self._startup_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "InferenceWorker":
+        return cls(
+            max_pending=int(os.getenv("SAM_MAX_PENDING", "32")),
+            batch_window_ms=float(os.getenv("SAM_BATCH_WINDOW_MS", "20")),
+            max_batch_prompts=int(os.getenv("SAM_MAX_BATCH_PROMPTS", "64")),
+            download_concurrency=int(os.getenv("SAM_DOWNLOAD_CONCURRENCY", "8")),
+            retry_after=int(os.getenv("SAM_RETRY_AFTER_SECONDS", "5")),
+            process_pool=SamProcessPool.from_env(),
+            warmup=os.getenv("SAM_WARMUP", "1") == "1",
+            preload_models=[m for m in os.getenv("SAM_PRELOAD_MODELS", "").split(",") if m.strip()],
+        )
+
+    # ---- lifecycle ---------------------------------------------------------
+    async def start(self) -> None:
+        """Start serving; the model loads in the background (see status)."""
+        self._queue = asyncio.Queue()
+        self._download_pool = ThreadPoolExecutor(self.download_concurrency, thread_name_prefix="tile-fetch")
+        self._inference_pool = ThreadPoolExecutor(1, thread_name_prefix="sam-inference")
+        self._loop_task = asyncio.create_task(self._batch_loop())
+        self._startup_task = asyncio.create_task(self._load_in_background())
+
+    async def _load_in_background(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.status = "loading"
+        t0 = time.perf_counter()
+        try:
+            if self.process_pool:
+                # No requests are admitted yet, so nothing else is running
+                # when the workers are forked
+                await loop.run_in_executor(None, self.process_pool.start, self.models)
+                if self.warmup:
+                    await loop.run_in_executor(None, self.process_pool.warmup, self.models, self.tile_px)
+            else:
+                await loop.run_in_executor(self._inference_pool, self._load_model)
+        except Exception as e:
+            logging.exception("Model startup failed")
+            self.status = "failed"
+            self.error = str(e)
+            return
+        self.startup_seconds = time.perf_counter() - t0
+        self.status = "ready"
+        print(f"SAM model ready in {self.startup_seconds:.1f}s")
+
+    def _load_model(self) -> None:
+        """Runs on the inference thread."""
+        for name in self.models:
+            predictor = load_predictor(resolve_model(name))
+            if self.warmup:
+                warmup_predictor(predictor, self.tile_px)
+
+    async def stop(self) -> None:
+        if self._startup_task and not self._startup_task.done():
+            self._startup_task.cancel()
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+        for pool in (self._download_pool, self._inference_pool):
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool:
+            self.process_pool.shutdown()
+
+    async def wait_ready(self, poll_seconds: float = 1.0) -> None:
+        """Wait until the model is ready; raises RuntimeError if loading failed."""
+        while self.status != "ready":
+            if self.status == "failed":
+                raise RuntimeError(f"Model failed to load: {self.error}")
+            await asyncio.sleep(poll_seconds)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a request slot, or raise Overloaded if all slots are taken."""
+        if self.status != "ready":
+            raise Overloaded(self.retry_after, "Model is loading, retry later")
+        if self.pending >= self.max_pending:
+            raise Overloaded(self.retry_after)
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    # ---- request API -------------------------------------------------------
+    async def segment_point(self, source: ImagerySource, lat: float, lng: float, model: Optional[str] = None,
+                            policy: Optional[str] = None) -> Dict:
+        """Single click; same response shape as segment_from_point."""
+        result, = await self._segment(source, [{"lat": lat, "lng": lng, "policy": policy}], model)
+        if result.polygon is None:
+            return {"type": "FeatureCollection", "features": []}
+        return await self._run_in_download_pool(self._serialize, point_geojson, result)
+
+    async def segment_points(self, source: ImagerySource, prompts: List[Dict], model: Optional[str] = None) -> Dict:
+        """Many prompts; same response shape as farm_segment_google_sam.segment_points."""
+        if not prompts:
+            return {"type": "FeatureCollection", "features": []}
+        results = await self._segment(source, prompts, model)
+        return await self._run_in_download_pool(self._serialize, batch_geojson, prompts, results)
+
+    async def _segment(self, source: ImagerySource, prompts: List[Dict], model: Optional[str] = None) -> List[PromptResult]:
+        model_name = resolve_model(model).name
+        tiles = group_by_tile(prompts, self.zoom, self.tile_px)
+        grid_tiles = await asyncio.gather(*(
+            self._run_in_download_pool(load_grid_tile, source, lat, lon, self.zoom, self.tile_px)
+            for lat, lon in tiles
+        ))
+
+        jobs = []
+        for (center, indices), tile in zip(tiles.items(), grid_tiles):
+            jobs.append((center, indices, self._enqueue(tile, model_name, [prompts[i] for i in indices])))
+
+        results: List[PromptResult] = [PromptResult(None, None)] * len(prompts)
+        extensions = []
+        for center, indices, future in jobs:
+            for i, result in zip(indices, await future):
+                results[i] = result
+                if result.edges and ADAPTIVE_MOSAIC:
+                    extensions.append((i, center))
+        if extensions:
+            extended = await asyncio.gather(*(
+                self._extend(source, model_name, prompts[i], center, results[i]) for i, center in extensions
+            ))
+            for (i, _), result in zip(extensions, extended):
+                results[i] = result
+        return results
+
+    def _enqueue(self, tile: Tile, model: str, prompts: List[Dict]) -> asyncio.Future:
+        job = TileJob(tile, model, prompts, asyncio.get_running_loop().create_future(), current_trace())
+        self._queue.put_nowait(job)
+        return job.future
+
+    async def _extend(self, source: ImagerySource, model: str, prompt: Dict, center: Tuple[float, float],
+                      result: PromptResult) -> PromptResult:
+        """Async counterpart of extend_across_tiles: grow a mosaic while the mask touches its border."""
+        extent: Extent = ((0, 0), (0, 0))
+        while result.edges:
+            grown = grow_extent(extent, result.edges)
+            if grown is None:
+                break
+            extent = grown
+            centers = mosaic_tile_centers(center, self.zoom, self.tile_px, extent)
+            images = await asyncio.gather(*(
+                self._run_in_download_pool(load_tile, source, lat, lon, self.zoom, self.tile_px)
+                for row in centers for lat, lon in row
+            ))
+            width = len(centers[0])
+            rows = [images[r * width:(r + 1) * width] for r in range(len(centers))]
+            mosaic = await self._run_in_download_pool(
+                build_mosaic, source, center, self.zoom, self.tile_px, extent, rows,
+            )
+            result, = await self._enqueue(mosaic, model, [prompt])
+        return result
+
+    def run_region_tile(self, model: Optional[str], img_np, bbox, points_per_side: int) -> List[Tuple]:
+        """
+        Blocking; callable from any thread. Runs one region-pipeline tile on the
+        inference thread (or a worker process), so bulk jobs share the model
+        with interactive requests instead of racing them on the predictor.
+        Interactive batches queue behind at most one such tile.
+        """
+        executor = self.process_pool.executor if self.process_pool else self._inference_pool
+        return executor.submit(run_region_tile, resolve_model(model).name, img_np, bbox, points_per_side).result()
+
+    async def _run_in_download_pool(self, fn, *args):
+        # bind_context: stages timed in the pool land in the request's trace
+        return await asyncio.get_running_loop().run_in_executor(self._download_pool, bind_context(fn, *args))
+
+    @staticmethod
+    def _serialize(fn, *args) -> Dict:
+        with stage("serialize"):
+            return fn(*args)
+
+    # ---- batching ----------------------------------------------------------
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_prompts = len(batch[0].prompts)
+            deadline = loop.time() + self.batch_window
+            while n_prompts < self.max_batch_prompts:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(job)
+                n_prompts += len(job.prompts)
+
+            started = time.perf_counter()
+            for job in batch:
+                observe("queue_wait", started - job.enqueued_at, job.trace)
+
+            if self.process_pool:
+                # Worker processes run tiles in parallel; keep collecting batches
+                task = asyncio.create_task(self._run_batch_in_pool(batch))
+                self._pool_tasks.add(task)
+                task.add_done_callback(self._pool_tasks.discard)
+            else:
+                outcomes = await loop.run_in_executor(self._inference_pool, self._run_batch, batch)
+                self._resolve(batch, outcomes)
+
+    @staticmethod
+    def _resolve(batch: List[TileJob], outcomes: List) -> None:
+        for job, outcome in zip(batch, outcomes):
+            if job.future.done():
+                continue
+            if isinstance(outcome, Exception):
+                job.future.set_exception(outcome)
+            else:
+                job.future.set_result(outcome)
+
+    @staticmethod
+    def _group_batch(batch: List[TileJob]) -> Dict[Tuple[str, str], List[int]]:
+        """Jobs for the same tile and model are decoded together."""
+        by_tile: Dict[Tuple[str, str], List[int]] = {}
+        for i, job in enumerate(batch):
+            by_tile.setdefault((job.tile.key, job.model), []).append(i)
+        return by_tile
+
+    @staticmethod
+    def _split(batch: List[TileJob], job_ids: List[int], results, outcomes: List) -> None:
+        """Hand the results of one merged tile decode back to the jobs it came from."""
+        if isinstance(results, Exception):
+            for i in job_ids:
+                outcomes[i] = results
+            return
+        offset = 0
+        for i in job_ids:
+            n = len(batch[i].prompts)
+            outcomes[i] = results[offset:offset + n]
+            offset += n
+
+    def _run_batch(self, batch: List[TileJob]) -> List:
+        """Runs on the inference thread. Returns per-job results or exceptions."""
+        outcomes: List = [None] * len(batch)
+
+        for (_, model), job_ids in self._group_batch(batch).items():
+            prompts = [p for i in job_ids for p in batch[i].prompts]
+            # Time the shared work once, then charge it to every request in the group
+            with tracing() as group_trace:
+                try:
+                    spec = resolve_model(model)
+                    results = segment_tile_prompts(load_predictor(spec), spec.key, batch[job_ids[0]].tile, prompts)
+                except Exception as e:
+                    logging.exception("Inference failed")
+                    results = e
+            for i in job_ids:
+                if batch[i].trace is not None:
+                    batch[i].trace.merge(group_trace.stages)
+            self._split(batch, job_ids, results, outcomes)
+        return outcomes
+
+    async def _run_batch_in_pool(self, batch: List[TileJob]) -> None:
+        loop = asyncio.get_running_loop()
+        groups = list(self._group_batch(batch).items())
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                self.process_pool.executor, run_tile_job, batch[job_ids[0]].tile, model,
+                [p for i in job_ids for p in batch[i].prompts],
+            )
+            for (_, model), job_ids in groups
+        ), return_exceptions=True)
+
+        outcomes: List = [None] * len(batch)
+        for (_, job_ids), result in zip(groups, results):
+            if not isinstance(result, Exception):
+                result, stages = result
+                record_stages(stages, [batch[i].trace for i in job_ids])
+            self._split(batch, job_ids, result, outcomes)
+        self._resolve(batch, outcomes)
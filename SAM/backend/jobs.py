@@ -0,0 +1,252 @@
+"""
+jobs.py
+
+Asynchronous jobs for work that should not hold an HTTP request open.
+
+POST /jobs returns a job id at once; runner tasks work through the queue and
+clients poll GET /jobs/{id} or subscribe to GET /jobs/{id}/events (Server-Sent
+Events) for progress. Jobs and their results are persisted in SQLite, so they
+can be fetched later and queued work survives a restart (jobs that were
+running are queued again).
+
+Jobs run in two lanes so bulk work never starves interactive users:
+    interactive   "point" (priority 0) and "batch" (priority 1) jobs,
+                  JOB_RUNNERS runners
+    bulk          "region" jobs, JOB_BULK_RUNNERS runners
+Within a lane, lower priority values run first (FIFO among equals).
+
+What a job does is up to the handler registered for its kind (see main.py).
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+
+PRIORITIES = {"point": 0, "batch": 1, "region": 10}
+BULK_KINDS = {"region"}
+TERMINAL = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job (e.g. from its progress callback) once it is cancelled."""
+
+
+class JobStore:
+    """SQLite persistence of jobs and their results."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT, priority INTEGER, status TEXT, params TEXT,"
+            " progress REAL, message TEXT, result TEXT, error TEXT,"
+            " created REAL, started REAL, finished REAL)"
+        )
+        self._db.commit()
+
+    def insert(self, job: Dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, priority, status, params, progress, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["kind"], job["priority"], job["status"], json.dumps(job["params"]),
+                 job["progress"], job["created"]),
+            )
+            self._db.commit()
+
+    def update(self, job_id: str, **fields) -> None:
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def unfinished(self) -> List[Dict]:
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created")]
+        return [self.get(job_id) for job_id in ids]
+
+
+class JobManager:
+    """Priority queues, runner tasks and progress notification for jobs."""
+
+    def __init__(self, store: JobStore, results_dir: str, runners: int = 2, bulk_runners: int = 1):
+        self.store = store
+        self.results_dir = results_dir
+        self.runners = runners
+        self.bulk_runners = bulk_runners
+        self.handlers: Dict[str, Callable[..., Awaitable]] = {}
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled = set()
+        self._changed: Optional[asyncio.Condition] = None
+        self._seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_env(cls) -> "JobManager":
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs")
+        jobs_dir = os.getenv("JOBS_DIR", default_dir)
+        return cls(
+            JobStore(os.path.join(jobs_dir, "jobs.db")),
+            results_dir=jobs_dir,
+            runners=int(os.getenv("JOB_RUNNERS", "2")),
+            bulk_runners=int(os.getenv("JOB_BULK_RUNNERS", "1")),
+        )
+
+    def register(self, kind: str, handler: Callable[..., Awaitable]) -> None:
+        """
+        handler(job_id, params, progress) -> result. progress(fraction, message)
+        may be called from any thread and raises JobCancelled once the job is
+        cancelled. The result must be JSON-serializable.
+        """
+        self.handlers[kind] = handler
+
+    # ---- lifecycle ---------------------------------------------------------
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Condition()
+        self._queues = {"interactive": asyncio.PriorityQueue(), "bulk": asyncio.PriorityQueue()}
+        for lane, count in (("interactive", self.runners), ("bulk", self.bulk_runners)):
+            for _ in range(count):
+                self._tasks.append(asyncio.create_task(self._runner(lane)))
+        for job in self.store.unfinished():
+            # Interrupted by a restart: run again from the start
+            self.store.update(job["id"], status="queued", progress=0.0, started=None)
+            self._enqueue(job["id"], job["kind"], job["priority"])
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---- API ---------------------------------------------------------------
+    def submit(self, kind: str, params: Dict) -> Dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'. Use one of {sorted(self.handlers)}.")
+        job = {
+            "id": uuid.uuid4().hex, "kind": kind, "priority": PRIORITIES.get(kind, 5), "status": "queued",
+            "params": params, "progress": 0.0, "created": time.time(),
+        }
+        self.store.insert(job)
+        self._enqueue(job["id"], kind, job["priority"])
+        return self.describe(self.store.get(job["id"]))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        job = self.store.get(job_id)
+        return self.describe(job) if job else None
+
+    def result(self, job_id: str) -> Optional[Dict]:
+        job = self.store.get(job_id)
+        return job["result"] if job else None
+
+    def result_path(self, job_id: str, suffix: str) -> str:
+        """Where a handler writes a file result for a job."""
+        os.makedirs(self.results_dir, exist_ok=True)
+        return os.path.join(self.results_dir, f"{job_id}{suffix}")
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "queued":
+            # The runner skips it when it comes up
+            self._set(job_id, status="cancelled", finished=time.time())
+        elif job["status"] == "running":
+            self._cancelled.add(job_id)
+            task = self._running.get(job_id)
+            if task is not None and job["kind"] not in BULK_KINDS:
+                task.cancel()
+            # Bulk jobs run in a thread: they stop at their next progress() call
+        return self.get(job_id)
+
+    @staticmethod
+    def describe(job: Dict) -> Dict:
+        """Public view of a job (no params / result payloads)."""
+        return {
+            "id": job["id"], "kind": job["kind"], "priority": job["priority"], "status": job["status"],
+            "progress": round(job["progress"] or 0.0, 4), "message": job.get("message"),
+            "error": job.get("error"), "created": job["created"], "started": job.get("started"),
+            "finished": job.get("finished"),
+        }
+
+    async def wait_for_change(self, timeout: float) -> None:
+        """Return after any job changes, or after timeout seconds."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---- internals ---------------------------------------------------------
+    def _enqueue(self, job_id: str, kind: str, priority: int) -> None:
+        self._seq += 1
+        lane = "bulk" if kind in BULK_KINDS else "interactive"
+        self._queues[lane].put_nowait((priority, self._seq, job_id))
+
+    def _set(self, job_id: str, **fields) -> None:
+        """Update a job and wake subscribers. Event loop only."""
+        self.store.update(job_id, **fields)
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _progress_callback(self, job_id: str):
+        def progress(fraction: float, message: Optional[str] = None) -> None:
+            if job_id in self._cancelled:
+                raise JobCancelled(job_id)
+            self._loop.call_soon_threadsafe(self._set, job_id, progress=float(fraction), message=message)
+        return progress
+
+    async def _runner(self, lane: str) -> None:
+        queue = self._queues[lane]
+        while True:
+            _, _, job_id = await queue.get()
+            job = self.store.get(job_id)
+            if job is None or job["status"] != "queued":
+                continue
+            self._set(job_id, status="running", started=time.time())
+            task = asyncio.ensure_future(
+                self.handlers[job["kind"]](job_id, job["params"], self._progress_callback(job_id))
+            )
+            self._running[job_id] = task
+            try:
+                result = await task
+            except (asyncio.CancelledError, JobCancelled):
+                if job_id not in self._cancelled:
+                    raise  # the runner itself is being stopped
+                self._set(job_id, status="cancelled", finished=time.time())
+            except Exception as e:
+                logging.exception(f"Job {job_id} failed")
+                self._set(job_id, status="failed", error=str(e), finished=time.time())
+            else:
+                self._set(job_id, status="done", progress=1.0, result=result, finished=time.time())
+            finally:
+                self._running.pop(job_id, None)
+                self._cancelled.discard(job_id)
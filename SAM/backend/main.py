@@ -1,19 +1,82 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
 import uvicorn
 import os
+import asyncio
+import functools
+import json
+import time
+import logging
 import traceback
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from farm_segment_google_sam import segment_from_point
+from inference_worker import InferenceWorker, Overloaded
+from http_client import CircuitOpen
+from model_registry import resolve_model
+from imagery import ImagerySource, get_imagery_source
+from result_cache import ResultCache, result_key
+from farm_segment_google_sam import (
+    SIMPLIFY_TOLERANCE_M, ADAPTIVE_MOSAIC, MOSAIC_MAX_SPAN, MASK_POLICIES, MASK_POLICY, REFINE_NEGATIVES,
+    predictor_memory_bytes,
+)
+from tile_cache import get_tile_cache
+from embedding_cache import get_embedding_cache
+from metrics import REQUEST_SECONDS, register_gauges, render_latest, server_timing, tracing
+from jobs import JobManager, TERMINAL
+from result_log import ResultLog
+from farm_store import FarmStore
+from output_formats import (
+    MEDIA_TYPES, encode_mvt, iter_geojson_lines, negotiate, read_geojson_lines, tile_lonlat_bounds,
+)
+import output_formats
+import shapely.geometry as geom
 
 load_dotenv()
 
+# Configured once here; SAM_LOG_FILE keeps the old debug log file behaviour
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    filename=os.getenv("SAM_LOG_FILE") or None,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+timing_log = logging.getLogger("sam.timing")
+
+# Send this request header (any value) to get a Server-Timing breakdown back
+TRACE_HEADER = "X-SAM-Trace"
+
+worker = InferenceWorker.from_env()
+result_cache = ResultCache.from_env()
+jobs = JobManager.from_env()
+# Decimal places lat/lng are rounded to in result cache keys (6 = ~0.1 m)
+RESULT_CACHE_PRECISION = int(os.getenv("RESULT_CACHE_PRECISION", "6"))
+# Every segmented field, served as vector tiles (None when RESULTS_LOG=off)
+result_log = ResultLog.from_env()
+# Below this zoom /tiles returns empty tiles (one tile would cover too many fields)
+TILES_MIN_ZOOM = int(os.getenv("TILES_MIN_ZOOM", "12"))
+# Features added to the result log at a time when recording a region job's output
+RECORD_CHUNK = 1000
+# Accepted farm polygons; clicks inside one skip SAM (None when FARM_STORE=off)
+farm_store = FarmStore.from_env()
+# Store every polygon /segment computes as an accepted farm
+FARM_STORE_AUTO_ACCEPT = os.getenv("FARM_STORE_AUTO_ACCEPT", "0") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await worker.start()
+    await jobs.start()
+    yield
+    await jobs.stop()
+    await worker.stop()
+
 app = FastAPI(
     title="SAM Farm Segmentation API",
     description="Interactive farm boundary segmentation using Google Static Maps and Meta's Segment Anything Model",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
@@ -25,6 +88,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Per-request stage trace: request histogram, one JSON log line, optional Server-Timing header."""
+    t0 = time.perf_counter()
+    with tracing() as trace:
+        response = await call_next(request)
+    total = time.perf_counter() - t0
+
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    if REQUEST_SECONDS is not None and route != "/metrics":
+        REQUEST_SECONDS.labels(route, str(response.status_code)).observe(total)
+    stages = trace.as_ms()
+    if stages:
+        timing_log.info(json.dumps({"path": route, "status": response.status_code,
+                                    "total_ms": round(total * 1000, 2), "stages": stages}))
+    if TRACE_HEADER in request.headers:
+        response.headers["Server-Timing"] = server_timing(trace, total)
+    return response
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+def metrics_snapshot():
+    """Gauges computed at scrape time (see metrics.register_gauges)."""
+    tiles = get_tile_cache().stats()
+    embeddings = get_embedding_cache().stats()
+    results = result_cache.stats()
+    tile_hits = tiles["hits_memory"] + tiles["hits_disk"]
+    values = {
+        "sam_queue_depth": ("Tile jobs waiting for the inference thread", worker.queue_depth, {}),
+        "sam_requests_in_flight": ("Admitted segmentation requests", worker.pending, {}),
+        "sam_model_ready": ("1 once the model is loaded and warm", float(worker.status == "ready"), {}),
+        "sam_cache_hit_ratio{tile}": ("Cache hit ratio since start", _hit_ratio(tile_hits, tiles["misses"]),
+                                      {"cache": "tile"}),
+        "sam_cache_hit_ratio{embedding}": ("Cache hit ratio since start",
+                                           _hit_ratio(embeddings["hits"], embeddings["misses"]),
+                                           {"cache": "embedding"}),
+        "sam_cache_hit_ratio{result}": ("Cache hit ratio since start",
+                                        _hit_ratio(results["hits"] + results["coalesced"], results["misses"]),
+                                        {"cache": "result"}),
+        "sam_cache_bytes{tile}": ("Bytes held by a cache", tiles["disk_bytes"], {"cache": "tile"}),
+        "sam_cache_bytes{embedding}": ("Bytes held by a cache", embeddings["bytes"], {"cache": "embedding"}),
+        "sam_farms_known": ("Current farms in the farm store", len(farm_store) if farm_store else 0, {}),
+    }
+    for model, nbytes in predictor_memory_bytes().items():
+        values[f"sam_model_bytes{{{model}}}"] = ("Parameter and buffer bytes of a loaded model", nbytes,
+                                                 {"model": model})
+    return values
+
+register_gauges(metrics_snapshot)
+
 # Serve frontend static files
 frontend_path = os.path.join(os.path.dirname(__file__), "..", "frontend")
 if os.path.exists(frontend_path):
@@ -33,31 +147,526 @@ if os.path.exists(frontend_path):
 class PointRequest(BaseModel):
     lat: float
     lng: float
+    model: Optional[str] = None  # tier (fast/balanced/best) or model name, e.g. "vit_b-int8"
+    policy: Optional[str] = None  # mask selection: heuristic | refine (default SAM_MASK_POLICY)
+    lookup: bool = True          # answer from the farm store when the point is in a known farm
+
+class LatLng(BaseModel):
+    lat: float
+    lng: float
+
+class BatchPoint(BaseModel):
+    lat: float
+    lng: float
+    negative_points: List[LatLng] = []
+    box: Optional[List[float]] = None  # [min_lng, min_lat, max_lng, max_lat]
+
+class BatchRequest(BaseModel):
+    points: List[BatchPoint]
+    model: Optional[str] = None
+    policy: Optional[str] = None
+    lookup: bool = True
+
+class FarmFeature(BaseModel):
+    geometry: Dict[str, Any]                    # GeoJSON Polygon / MultiPolygon (EPSG:4326)
+    properties: Dict[str, Any] = {}
+    farm_id: Optional[str] = None               # new version of this farm; None = new farm
+
+class JobRequest(BaseModel):
+    kind: str                                   # point | batch | region
+    lat: Optional[float] = None                 # point
+    lng: Optional[float] = None
+    points: Optional[List[BatchPoint]] = None   # batch
+    bbox: Optional[List[float]] = None          # region: [min_lng, min_lat, max_lng, max_lat]
+    polygon: Optional[Dict[str, Any]] = None    # region: GeoJSON geometry, instead of bbox
+    points_per_side: int = 16                   # region: prompt grid density per tile
+    model: Optional[str] = None
+    policy: Optional[str] = None                # point, batch
 
 @app.get("/")
 def read_root():
     return {"message": "SAM Farm Segmentation API is running", "docs": "/docs"}
 
+def busy_response(e) -> HTTPException:
+    """503 with Retry-After for Overloaded / CircuitOpen."""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def check_model(model: Optional[str]) -> None:
+    try:
+        resolve_model(model)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def check_policy(policy: Optional[str]) -> str:
+    """The mask selection policy to use; 422 if unknown."""
+    policy = policy or MASK_POLICY
+    if policy not in MASK_POLICIES:
+        raise HTTPException(status_code=422, detail=f"policy must be one of {', '.join(MASK_POLICIES)}")
+    return policy
+
+def imagery_source() -> ImagerySource:
+    """The configured imagery source (IMAGERY_SOURCE); 500 if it is misconfigured."""
+    try:
+        return get_imagery_source(os.getenv("GOOGLE_MAPS_API_KEY"))
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def point_cache_key(source: ImagerySource, lat: float, lng: float, model: Optional[str], policy: str) -> str:
+    """Result cache key: quantized click plus every setting that changes the result."""
+    return result_key(
+        "point",
+        lat=round(lat, RESULT_CACHE_PRECISION), lng=round(lng, RESULT_CACHE_PRECISION),
+        model=resolve_model(model).name, imagery=source.name, zoom=worker.zoom, tile_px=worker.tile_px,
+        simplify_m=SIMPLIFY_TOLERANCE_M, mosaic=ADAPTIVE_MOSAIC and MOSAIC_MAX_SPAN,
+        policy=policy, negatives=REFINE_NEGATIVES if policy == "refine" else None,
+    )
+
+def batch_prompts(points: List[BatchPoint], policy: str) -> List[Dict]:
+    """Validate batch points and convert them to segment_points prompts."""
+    for point in points:
+        if point.box is not None and len(point.box) != 4:
+            raise HTTPException(status_code=422, detail="box must be [min_lng, min_lat, max_lng, max_lat]")
+    return [
+        {
+            "lat": p.lat,
+            "lng": p.lng,
+            "negative_points": [(n.lat, n.lng) for n in p.negative_points],
+            "box": p.box,
+            "policy": policy,
+        }
+        for p in points
+    ]
+
+def output_format(request: Request, fmt: Optional[str], precision: Optional[int],
+                  allowed=("geojson", "fgb", "parquet")) -> str:
+    """Negotiated output format (format query parameter, else Accept header); 422 if invalid."""
+    if precision is not None and not 0 <= precision <= 15:
+        raise HTTPException(status_code=422, detail="precision must be between 0 and 15")
+    try:
+        return negotiate(fmt, request.headers.get("accept"), allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def render(collection: Dict, fmt: str, precision: Optional[int]) -> Response:
+    """Encode a FeatureCollection (off the event loop) into a response."""
+    try:
+        body, media_type = await asyncio.get_running_loop().run_in_executor(
+            None, output_formats.encode, collection, fmt, precision,
+        )
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=f"{fmt} output needs an optional package: {e}")
+    return Response(content=body, media_type=media_type)
+
+def record(collection: Dict) -> Dict:
+    """Add segmented fields to the result log (for /tiles)."""
+    if result_log is not None:
+        result_log.add(collection["features"])
+    return collection
+
+def record_file(path: str) -> None:
+    """Add the fields of a GeoJSON-lines file to the result log, RECORD_CHUNK at a time."""
+    if result_log is None:
+        return
+    chunk = []
+    for feature in iter_geojson_lines(path):
+        chunk.append(feature)
+        if len(chunk) >= RECORD_CHUNK:
+            result_log.add(chunk)
+            chunk = []
+    if chunk:
+        result_log.add(chunk)
+
+def known_farm(lat: float, lng: float) -> Optional[Dict]:
+    """FeatureCollection with the stored farm containing lat/lng, or None."""
+    feature = farm_store.lookup(lat, lng) if farm_store is not None else None
+    if feature is None:
+        return None
+    return {"type": "FeatureCollection", "features": [feature]}
+
+def accept(collection: Dict, source: str) -> None:
+    """Store computed polygons as farms when FARM_STORE_AUTO_ACCEPT is on."""
+    if farm_store is None or not FARM_STORE_AUTO_ACCEPT:
+        return
+    for feature in collection["features"]:
+        if feature.get("geometry") is not None:
+            farm_store.put(feature["geometry"], feature["properties"], source=source)
+
+async def run_point(source: ImagerySource, request: PointRequest):
+    async with worker.admit():
+        collection = await worker.segment_point(source, request.lat, request.lng, request.model, request.policy)
+    accept(collection, "segment")
+    return collection
+
+async def run_batch(source: ImagerySource, prompts: List[Dict], model: Optional[str], lookup: bool) -> Dict:
+    """
+    segment_points, with points inside known farms answered from the farm
+    store; the response keeps one feature per point, in order.
+    """
+    hits = {}
+    if lookup:
+        for i, prompt in enumerate(prompts):
+            known = known_farm(prompt["lat"], prompt["lng"])
+            if known is not None:
+                hits[i] = known["features"][0]
+    misses = [i for i in range(len(prompts)) if i not in hits]
+    computed = await worker.segment_points(source, [prompts[i] for i in misses], model)
+    accept(computed, "segment")
+
+    features = [None] * len(prompts)
+    for i, feature in zip(misses, computed["features"]):
+        features[i] = dict(feature, id=str(i), properties=dict(feature["properties"], index=i))
+    for i, feature in hits.items():
+        features[i] = dict(feature, id=str(i), properties=dict(
+            feature["properties"], index=i, lat=prompts[i]["lat"], lng=prompts[i]["lng"],
+        ))
+    return {"type": "FeatureCollection", "features": features}
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving HTTP (the model may still be loading)."""
+    return {"status": "ok"}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics (requires prometheus_client)."""
+    rendered = render_latest()
+    if rendered is None:
+        raise HTTPException(status_code=501, detail="Install prometheus_client to enable /metrics")
+    body, content_type = rendered
+    return Response(content=body, media_type=content_type)
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the SAM model is loaded and warmed up. 503 until then."""
+    body = {"status": worker.status}
+    if worker.status == "ready":
+        body["startup_seconds"] = round(worker.startup_seconds, 2)
+        return body
+    if worker.error:
+        body["error"] = worker.error
+    return JSONResponse(status_code=503, content=body)
+
 @app.post("/segment")
-def segment(request: PointRequest):
+async def segment(request: PointRequest, http_request: Request, fmt: Optional[str] = Query(None, alias="format"),
+                  precision: Optional[int] = None):
     """
     Segment a farm boundary at the given coordinates.
     
     - **lat**: Latitude of the point to segment
     - **lng**: Longitude of the point to segment
+    - **model**: Optional quality tier (`fast`, `balanced`, `best`) or model name
+    - **policy**: Optional mask selection policy: `heuristic` (pick among SAM's
+      three masks) or `refine` (one more decoder pass seeded with the chosen
+      mask and automatic background points). The policy actually applied is
+      returned in the feature's `policy` property.
+    - **lookup**: If true (default), a point inside a farm in the farm store
+      returns that farm (with `farm_id` and `version`) without running SAM
+    - **format** (query): `geojson` (default), `fgb` (FlatGeobuf) or `parquet`
+      (GeoParquet); also chosen by the Accept header
+    - **precision** (query): Round GeoJSON coordinates to this many decimals
+      (6 = ~0.1 m)
     
-    Returns GeoJSON with the segmented polygon.
+    Returns GeoJSON with the segmented polygon. Repeated clicks on the same
+    spot are answered from the result cache; identical requests in flight at
+    the same time share one computation.
     """
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Google Maps API Key not configured. Set GOOGLE_MAPS_API_KEY in .env")
+    source = imagery_source()
     
+    check_model(request.model)
+    request.policy = check_policy(request.policy)
+    out = output_format(http_request, fmt, precision)
+    known = known_farm(request.lat, request.lng) if request.lookup else None
+    if known is not None:
+        return await render(known, out, precision)
     try:
-        geojson = segment_from_point(api_key, request.lat, request.lng)
-        return geojson
+        key = point_cache_key(source, request.lat, request.lng, request.model, request.policy)
+        collection = record(await result_cache.get_or_compute(key, lambda: run_point(source, request)))
+    except (Overloaded, CircuitOpen) as e:
+        raise busy_response(e)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    return await render(collection, out, precision)
+
+@app.post("/segment/batch")
+async def segment_batch(request: BatchRequest, http_request: Request,
+                        fmt: Optional[str] = Query(None, alias="format"), precision: Optional[int] = None):
+    """
+    Segment many farm boundaries in one call.
+    
+    - **points**: List of points, each with **lat**, **lng**, optional
+      **negative_points** (background clicks) and optional **box**
+      ([min_lng, min_lat, max_lng, max_lat])
+    - **model**: Optional quality tier or model name, as for /segment
+    - **policy**: Optional mask selection policy for all points, as for /segment
+    - **lookup**: Answer points inside known farms from the farm store (default true)
+    - **format**, **precision** (query): Output format, as for /segment
+    
+    Points are grouped by satellite tile, so each tile is downloaded and
+    encoded once. Returns a GeoJSON FeatureCollection with one feature per
+    input point, in input order (FlatGeobuf leaves out points without a
+    polygon; use the `index` property).
+    """
+    source = imagery_source()
+    
+    check_model(request.model)
+    prompts = batch_prompts(request.points, check_policy(request.policy))
+    out = output_format(http_request, fmt, precision)
+    try:
+        async with worker.admit():
+            collection = record(await run_batch(source, prompts, request.model, request.lookup))
+    except (Overloaded, CircuitOpen) as e:
+        raise busy_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    return await render(collection, out, precision)
+
+# ---- Jobs ------------------------------------------------------------------
+# Handlers run by the job runners (see jobs.py). They skip admission control:
+# the job queue already bounds the work, and jobs wait for the model instead
+# of failing with 503 while it loads.
+async def point_job(job_id: str, params: Dict, progress) -> Dict:
+    source = get_imagery_source(os.getenv("GOOGLE_MAPS_API_KEY"))
+    await worker.wait_ready()
+    known = known_farm(params["lat"], params["lng"])
+    if known is not None:
+        return known
+    policy = params.get("policy") or MASK_POLICY
+    key = point_cache_key(source, params["lat"], params["lng"], params.get("model"), policy)
+    return record(await result_cache.get_or_compute(
+        key, lambda: worker.segment_point(source, params["lat"], params["lng"], params.get("model"), policy),
+    ))
+
+async def batch_job(job_id: str, params: Dict, progress) -> Dict:
+    source = get_imagery_source(os.getenv("GOOGLE_MAPS_API_KEY"))
+    await worker.wait_ready()
+    return record(await run_batch(source, params["prompts"], params.get("model"), lookup=True))
+
+async def region_job(job_id: str, params: Dict, progress) -> Dict:
+    from region_pipeline import delineate_region, GeoJSONLinesWriter
+
+    source = get_imagery_source(os.getenv("GOOGLE_MAPS_API_KEY"))
+    region = geom.shape(params["polygon"]) if params.get("polygon") else geom.box(*params["bbox"])
+    path = jobs.result_path(job_id, ".geojsonl")
+    await worker.wait_ready()
+
+    def report(done: int, total: int, written: int) -> None:
+        progress(done / total if total else 1.0, f"{done}/{total} tiles, {written} fields")
+
+    def run() -> int:
+        writer = GeoJSONLinesWriter(path)
+        try:
+            fields = delineate_region(
+                source, region, writer, zoom=worker.zoom, tile_px=worker.tile_px,
+                points_per_side=params["points_per_side"], model=params.get("model"),
+                tile_runner=functools.partial(worker.run_region_tile, params.get("model")), progress=report,
+            )
+        finally:
+            writer.close()
+        record_file(path)
+        return fields
+
+    fields = await asyncio.get_running_loop().run_in_executor(None, run)
+    return {"fields": fields, "format": "geojsonl"}
+
+jobs.register("point", point_job)
+jobs.register("batch", batch_job)
+jobs.register("region", region_job)
+
+@app.post("/jobs", status_code=202)
+def create_job(request: JobRequest):
+    """
+    Queue a segmentation job and return its id immediately.
+
+    - **kind**: `point` (lat, lng), `batch` (points, as for /segment/batch) or
+      `region` (bbox or GeoJSON polygon; automatic delineation of every field)
+    - **model**: Optional quality tier or model name
+
+    Interactive jobs (point, batch) run ahead of region jobs. Follow progress
+    with GET /jobs/{id} or GET /jobs/{id}/events, then fetch GET /jobs/{id}/result.
+    """
+    imagery_source()
+    check_model(request.model)
+    policy = check_policy(request.policy)
+    params: Dict[str, Any] = {"model": request.model}
+    if request.kind == "point":
+        if request.lat is None or request.lng is None:
+            raise HTTPException(status_code=422, detail="point jobs need lat and lng")
+        params.update(lat=request.lat, lng=request.lng, policy=policy)
+    elif request.kind == "batch":
+        if not request.points:
+            raise HTTPException(status_code=422, detail="batch jobs need points")
+        params["prompts"] = batch_prompts(request.points, policy)
+    elif request.kind == "region":
+        if request.polygon is not None:
+            try:
+                geom.shape(request.polygon)
+            except Exception as e:
+                raise HTTPException(status_code=422, detail=f"Invalid polygon: {e}")
+            params["polygon"] = request.polygon
+        elif request.bbox is not None and len(request.bbox) == 4:
+            params["bbox"] = request.bbox
+        else:
+            raise HTTPException(status_code=422, detail="region jobs need bbox [min_lng, min_lat, max_lng, max_lat] or polygon")
+        params["points_per_side"] = request.points_per_side
+    else:
+        raise HTTPException(status_code=422, detail="kind must be point, batch or region")
+    return jobs.submit(request.kind, params)
+
+def get_job_or_404(job_id: str) -> Dict:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Job status and progress (0..1)."""
+    return get_job_or_404(job_id)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request, fmt: Optional[str] = Query(None, alias="format"),
+                         precision: Optional[int] = None):
+    """
+    Result of a finished job: GeoJSON, or FlatGeobuf / GeoParquet with
+    `format` (or the Accept header) as for /segment. Region jobs return one
+    GeoJSON feature per line unless another format is asked for.
+    """
+    job = get_job_or_404(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    out = output_format(request, fmt, precision)
+    if job["kind"] == "region":
+        path = jobs.result_path(job_id, ".geojsonl")
+        if out == "geojson" and fmt is None:
+            return FileResponse(path, media_type="application/x-ndjson")
+        collection = await asyncio.get_running_loop().run_in_executor(None, read_geojson_lines, path)
+    else:
+        collection = jobs.result(job_id)
+    return await render(collection, out, precision)
+
+@app.get("/tiles/{z}/{x}/{y}")
+async def vector_tile(z: int, x: int, y: int):
+    """
+    Mapbox Vector Tile for map clients (requires mapbox-vector-tile), with
+    layers `farms` (current farms in the farm store) and `fields` (every
+    field segmented so far). Empty below TILES_MIN_ZOOM.
+    """
+    sources = {name: store for name, store in (("farms", farm_store), ("fields", result_log)) if store is not None}
+    if not sources:
+        raise HTTPException(status_code=404, detail="Farm store and result log are both disabled")
+    if not (0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="No such tile")
+
+    def build() -> bytes:
+        bounds = tile_lonlat_bounds(z, x, y)
+        layers = {name: store.query(bounds) if z >= TILES_MIN_ZOOM else [] for name, store in sources.items()}
+        return encode_mvt(layers, z, x, y)
+
+    try:
+        body = await asyncio.get_running_loop().run_in_executor(None, build)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Install mapbox-vector-tile to enable /tiles")
+    return Response(content=body, media_type=MEDIA_TYPES["mvt"], headers={"Cache-Control": "max-age=60"})
+
+# ---- Farm store -------------------------------------------------------------
+def require_farm_store() -> FarmStore:
+    if farm_store is None:
+        raise HTTPException(status_code=404, detail="Farm store is disabled (FARM_STORE=off)")
+    return farm_store
+
+@app.post("/farms", status_code=201)
+def put_farm(farm: FarmFeature):
+    """
+    Accept a farm polygon. With **farm_id**, the polygon becomes a new version
+    of that farm (earlier versions stay in its history). Returns the stored feature.
+    """
+    store = require_farm_store()
+    try:
+        return store.put(farm.geometry, farm.properties, farm.farm_id, source="api")
+    except (ValueError, TypeError, KeyError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid farm geometry: {e}")
+
+@app.post("/farms/bulk")
+def bulk_load_farms(collection: Optional[Dict[str, Any]] = None, job: Optional[str] = None):
+    """
+    Bulk load farms from a GeoJSON FeatureCollection body, or from the result
+    of a finished region job (`?job=<id>`). Features with a `farm_id` property
+    become new versions of that farm.
+    """
+    store = require_farm_store()
+    if job is not None:
+        region = get_job_or_404(job)
+        if region["kind"] != "region" or region["status"] != "done":
+            raise HTTPException(status_code=409, detail="job must be a finished region job")
+        features = iter_geojson_lines(jobs.result_path(job, ".geojsonl"))  # streamed into one transaction
+        source = f"job:{job}"
+    elif collection is not None and collection.get("type") == "FeatureCollection":
+        features, source = collection.get("features") or [], "bulk"
+    else:
+        raise HTTPException(status_code=422, detail="Send a FeatureCollection or ?job=<region job id>")
+    try:
+        return {"loaded": store.bulk_load(features, source=source), "farms": len(store)}
+    except (ValueError, TypeError, KeyError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid farm geometry: {e}")
+
+@app.get("/farms/lookup")
+def lookup_farm(lat: float, lng: float):
+    """The farm containing lat/lng (404 if none)."""
+    feature = require_farm_store().lookup(lat, lng)
+    if feature is None:
+        raise HTTPException(status_code=404, detail="No known farm at this point")
+    return feature
+
+@app.get("/farms/{farm_id}")
+def get_farm(farm_id: str, version: Optional[int] = None):
+    """A farm's current version, or ?version=N."""
+    feature = require_farm_store().get(farm_id, version)
+    if feature is None:
+        raise HTTPException(status_code=404, detail="Farm not found")
+    return feature
+
+@app.get("/farms/{farm_id}/history")
+def farm_history(farm_id: str):
+    """Every version of a farm."""
+    versions = require_farm_store().history(farm_id)
+    if not versions:
+        raise HTTPException(status_code=404, detail="Farm not found")
+    return {"farm_id": farm_id, "versions": versions}
+
+@app.delete("/farms/{farm_id}")
+def retire_farm(farm_id: str):
+    """Retire a farm: it no longer answers lookups; its history is kept."""
+    if not require_farm_store().retire(farm_id):
+        raise HTTPException(status_code=404, detail="Farm not found")
+    return {"farm_id": farm_id, "retired": True}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: one `job` event per status/progress change, until the job ends."""
+    get_job_or_404(job_id)
+
+    async def stream():
+        last = None
+        while True:
+            job = jobs.get(job_id)
+            if job != last:
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                last = job
+            else:
+                yield ": keep-alive\n\n"
+            if job["status"] in TERMINAL:
+                return
+            await jobs.wait_for_change(timeout=15)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    get_job_or_404(job_id)
+    return jobs.cancel(job_id)
 
 if __name__ == "__main__":
     print("Starting SAM Segmentation Server...")
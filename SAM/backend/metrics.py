@@ -0,0 +1,157 @@
+"""
+metrics.py
+
+Per-stage latency instrumentation.
+
+Code wraps each pipeline stage in `with stage("name"):`. Every stage duration
+is observed into the Prometheus histogram sam_stage_seconds{stage=...} (when
+prometheus_client is installed) and, if a request trace is active in the
+current context, added to that trace. Traces travel with contextvars, so they
+follow a request into thread pools entered through bind_context(); work shared
+by several requests (a micro-batch) is timed under its own trace and merged
+into each request's trace afterwards.
+
+Stages: tile_fetch, queue_wait, set_image, predict, polygonize, serialize.
+"""
+
+import time
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Sub-millisecond decodes up to multi-second encodes / slow downloads
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "sam_stage_seconds", "Time spent per pipeline stage", ["stage"], buckets=_BUCKETS,
+    )
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        "sam_request_seconds", "End-to-end request latency", ["path", "status"], buckets=_BUCKETS,
+    )
+else:
+    STAGE_SECONDS = REQUEST_SECONDS = None
+
+
+class Trace:
+    """Accumulated stage durations of one request (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages: Dict[str, float]) -> None:
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    def as_ms(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("sam_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def observe(name: str, seconds: float, trace: Optional[Trace] = None) -> None:
+    """Record one stage duration in the histogram and in trace (default: the current one)."""
+    if STAGE_SECONDS is not None:
+        STAGE_SECONDS.labels(name).observe(seconds)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def record_stages(stages: Dict[str, float], traces) -> None:
+    """Observe stage totals timed elsewhere (e.g. in a worker process) and add them to traces."""
+    for name, seconds in stages.items():
+        if STAGE_SECONDS is not None:
+            STAGE_SECONDS.labels(name).observe(seconds)
+        for trace in traces:
+            if trace is not None:
+                trace.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0)
+
+
+@contextmanager
+def tracing(trace: Optional[Trace] = None) -> Iterator[Trace]:
+    """Make trace (default: a new one) the active trace for the enclosed code."""
+    trace = trace or Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def bind_context(fn: Callable, *args) -> Callable[[], object]:
+    """fn(*args) bound to the caller's context, for run_in_executor."""
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
+
+def server_timing(trace: Trace, total_seconds: float) -> str:
+    """Server-Timing header value for a trace."""
+    parts = [f"{name};dur={ms}" for name, ms in trace.as_ms().items()]
+    parts.append(f"total;dur={round(total_seconds * 1000, 2)}")
+    return ", ".join(parts)
+
+
+# ---- gauges read at scrape time -------------------------------------------
+class _CallbackCollector:
+    """Prometheus collector turning {name: (help, value, labels)} snapshots into gauges."""
+
+    def __init__(self, snapshot: Callable[[], Dict[str, tuple]]):
+        self.snapshot = snapshot
+
+    def describe(self):
+        # Don't let registration call snapshot() before the app is up
+        return []
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+        families: Dict[str, GaugeMetricFamily] = {}
+        for name, (help_text, value, labels) in self.snapshot().items():
+            metric = name.split("{")[0]
+            if metric not in families:
+                families[metric] = GaugeMetricFamily(metric, help_text, labels=list(labels))
+            families[metric].add_metric(list(labels.values()), value)
+        return list(families.values())
+
+
+def register_gauges(snapshot: Callable[[], Dict[str, tuple]]) -> None:
+    """
+    Expose values computed at scrape time. snapshot() returns
+    {"metric{label...}": (help, value, {label: value})}; the part before "{"
+    is the metric name.
+    """
+    if prometheus_client is not None:
+        prometheus_client.REGISTRY.register(_CallbackCollector(snapshot))
+
+
+def render_latest():
+    """(body, content type) for /metrics, or None when prometheus_client is missing."""
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
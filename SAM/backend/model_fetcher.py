@@ -0,0 +1,176 @@
+"""
+model_fetcher.py
+
+Safe download of large model checkpoints.
+
+- Downloads into "<dest>.part" with large buffered writes; the final path only
+  appears (atomic rename) once the file is complete and verified, so a crash
+  never leaves a truncated checkpoint behind.
+- An interrupted download is resumed with an HTTP Range request, both on the
+  next call and on connection errors during the current one.
+- SHA-256 (and optionally MD5) of the complete file is verified before the
+  rename; the computed SHA-256 is written to "<dest>.sha256" for pinning.
+- A lock file serializes concurrent callers (several workers starting at
+  once): the first downloads, the others wait and reuse the result.
+
+The URL is a plain argument, so a local HTTP server can stand in for the CDN.
+"""
+
+import os
+import sys
+import time
+import hashlib
+from typing import Optional
+
+import requests
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ChecksumMismatch(Exception):
+    """Downloaded file does not match the expected digest."""
+
+
+class FileLock:
+    """Exclusive inter-process lock on a lock file (fcntl on POSIX, msvcrt on Windows)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+            self._f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10s; keep waiting
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if os.name == "nt":
+            import msvcrt
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        self._f.close()
+        self._f = None
+
+
+def _hash_existing(path: str, hashers) -> int:
+    """Feed an existing partial file into the hashers; returns its size."""
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block:
+                break
+            for h in hashers:
+                h.update(block)
+            size += len(block)
+    return size
+
+
+def fetch_checkpoint(url: str, dest_path: str, sha256: Optional[str] = None, md5: Optional[str] = None,
+                     session: Optional[requests.Session] = None, timeout: float = 60,
+                     max_retries: int = 5) -> str:
+    """
+    Download url to dest_path unless it already exists. Returns dest_path.
+
+    Args:
+        url: Checkpoint URL (any HTTP server supporting Range for resume)
+        dest_path: Final location of the file
+        sha256: Expected SHA-256 hex digest (verified when given)
+        md5: Expected MD5 hex digest (verified when given)
+        session: requests.Session to use (default: a new one)
+        timeout: Connect/read timeout per request, in seconds
+        max_retries: Resume attempts after connection errors
+
+    Raises:
+        ChecksumMismatch: The complete file has the wrong digest (the partial
+            file is deleted so the next call starts over)
+        requests.RequestException: The download kept failing
+    """
+    if os.path.exists(dest_path):
+        return dest_path
+
+    dest_dir = os.path.dirname(os.path.abspath(dest_path))
+    os.makedirs(dest_dir, exist_ok=True)
+    part_path = dest_path + ".part"
+    session = session or requests.Session()
+
+    with FileLock(dest_path + ".lock"):
+        if os.path.exists(dest_path):
+            # Another process finished while we waited for the lock
+            return dest_path
+
+        attempt = 0
+        while True:
+            try:
+                digest_sha256, digest_md5 = _download(session, url, part_path, timeout)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                wait = min(2 ** attempt, 30)
+                print(f"Download interrupted ({e}); resuming in {wait}s...", file=sys.stderr)
+                time.sleep(wait)
+
+        for name, expected, actual in (("SHA-256", sha256, digest_sha256), ("MD5", md5, digest_md5)):
+            if expected and expected.lower() != actual:
+                os.remove(part_path)
+                raise ChecksumMismatch(f"{name} mismatch for {url}: expected {expected}, got {actual}")
+
+        with open(dest_path + ".sha256", "w", encoding="ascii") as f:
+            f.write(f"{digest_sha256}  {os.path.basename(dest_path)}\n")
+        os.replace(part_path, dest_path)
+    return dest_path
+
+
+def _download(session: requests.Session, url: str, part_path: str, timeout: float):
+    """Download (or resume) into part_path; returns (sha256, md5) of the complete file."""
+    sha, md = hashlib.sha256(), hashlib.md5()
+    offset = _hash_existing(part_path, (sha, md)) if os.path.exists(part_path) else 0
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, stream=True, timeout=timeout, headers=headers) as r:
+        if r.status_code == 416:
+            # Range not satisfiable: the partial file is already complete
+            return sha.hexdigest(), md.hexdigest()
+        r.raise_for_status()
+        if offset and r.status_code != 206:
+            # Server ignored the Range header; start over
+            print("Server does not support resume; restarting download", file=sys.stderr)
+            sha, md = hashlib.sha256(), hashlib.md5()
+            offset = 0
+
+        total = r.headers.get("Content-Length")
+        total = int(total) + offset if total else None
+        if offset:
+            print(f"Resuming download at {offset / 1e6:.0f} MB", file=sys.stderr)
+
+        done = offset
+        next_report = 0.0
+        with open(part_path, "ab" if offset else "wb", buffering=CHUNK_SIZE) as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                sha.update(chunk)
+                md.update(chunk)
+                done += len(chunk)
+                if total and done / total >= next_report:
+                    print(f"  {done / 1e6:.0f}/{total / 1e6:.0f} MB", file=sys.stderr)
+                    next_report += 0.1
+    return sha.hexdigest(), md.hexdigest()
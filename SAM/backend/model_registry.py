@@ -0,0 +1,171 @@
+"""
+model_registry.py
+
+Which SAM model a deployment (or a single request) runs.
+
+A model name is "<backbone>[-<runtime>]", e.g. "vit_h", "vit_b-int8",
+"vit_l-onnx". Backbones are the three published SAM checkpoints; runtimes are
+CPU inference variants of the image encoder (the expensive part):
+
+    fp32         plain PyTorch (default)
+    int8         dynamic int8 quantization of the encoder's Linear layers
+    torchscript  traced + frozen encoder
+    onnx         encoder exported once to ONNX and run with ONNX Runtime
+
+Quality tiers map to model names so clients don't need to know backbones:
+"fast", "balanced", "best". The deployment default is SAM_MODEL (a name or a
+tier, default "vit_h").
+"""
+
+import os
+from typing import Dict, NamedTuple, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# backbone -> (local filename, download URL, published MD5)
+CHECKPOINTS: Dict[str, tuple] = {
+    "vit_h": ("sam_vit_h.pth", "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
+              "4b8939a88964f0f4ff5f5b2642c598a6"),
+    "vit_l": ("sam_vit_l.pth", "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
+              "0b3195507c641ddb6910d2bb5adee89c"),
+    "vit_b": ("sam_vit_b.pth", "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
+              "01ec64d29a2fca3f0661936605ae66f8"),
+}
+
+RUNTIMES = ("fp32", "int8", "torchscript", "onnx")
+
+TIERS: Dict[str, str] = {
+    "fast": "vit_b-int8",
+    "balanced": "vit_l-int8",
+    "best": "vit_h",
+}
+
+
+class ModelSpec(NamedTuple):
+    name: str               # canonical "<backbone>-<runtime>"
+    model_type: str         # key into segment_anything.sam_model_registry
+    runtime: str
+    checkpoint_path: str
+    url: str
+
+    @property
+    def key(self) -> str:
+        """Identifies the model in cache keys (embeddings differ per model)."""
+        return f"{self.name}:{self.checkpoint_path}"
+
+
+def checkpoint_path_for(model_type: str) -> str:
+    """Checkpoint location: SAM_CHECKPOINT_DIR, else next to this file if present, else the CWD."""
+    filename = CHECKPOINTS[model_type][0]
+    checkpoint_dir = os.getenv("SAM_CHECKPOINT_DIR")
+    if checkpoint_dir:
+        return os.path.join(checkpoint_dir, filename)
+    path = os.path.join(BACKEND_DIR, filename)
+    if not os.path.exists(path):
+        path = filename
+    return path
+
+
+def checkpoint_digests(model_type: str) -> Dict[str, Optional[str]]:
+    """
+    Expected digests for a backbone's checkpoint: the published MD5, plus a
+    SHA-256 pinned through SAM_CHECKPOINT_SHA256_<BACKBONE> (e.g.
+    SAM_CHECKPOINT_SHA256_VIT_H) if set. The fetcher writes the SHA-256 it
+    computed next to the checkpoint, ready to be pinned.
+    """
+    return {
+        "md5": CHECKPOINTS[model_type][2],
+        "sha256": os.getenv(f"SAM_CHECKPOINT_SHA256_{model_type.upper()}") or None,
+    }
+
+
+def resolve_model(name: Optional[str] = None) -> ModelSpec:
+    """
+    Resolve a model name or tier (None = deployment default) to a ModelSpec.
+    Raises ValueError for unknown names.
+    """
+    name = name or os.getenv("SAM_MODEL", "vit_h")
+    name = TIERS.get(name, name)
+    model_type, _, runtime = name.partition("-")
+    runtime = runtime or "fp32"
+    if model_type not in CHECKPOINTS or runtime not in RUNTIMES:
+        raise ValueError(
+            f"Unknown SAM model '{name}'. Use <backbone>[-<runtime>] with backbone in "
+            f"{sorted(CHECKPOINTS)} and runtime in {list(RUNTIMES)}, or a tier in {sorted(TIERS)}."
+        )
+    return ModelSpec(
+        name=f"{model_type}-{runtime}",
+        model_type=model_type,
+        runtime=runtime,
+        checkpoint_path=checkpoint_path_for(model_type),
+        url=CHECKPOINTS[model_type][1],
+    )
+
+
+# ---- CPU runtime variants of the image encoder ----------------------------
+def _encoder_wrapper(inner, img_size: int):
+    """
+    SamPredictor and Sam.preprocess read image_encoder.img_size, which traced /
+    exported encoders don't carry; wrap them in a module that does.
+    """
+    import torch
+
+    class EncoderWrapper(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.inner = inner
+            self.img_size = img_size
+
+        def forward(self, x):
+            return self.inner(x)
+
+    return EncoderWrapper()
+
+
+class _OnnxEncoder:
+    """Callable running the exported encoder in ONNX Runtime, returning a torch tensor."""
+
+    def __init__(self, onnx_path: str):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        import torch
+        out = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+
+def optimize_image_encoder(sam, runtime: str, checkpoint_path: str):
+    """Swap sam.image_encoder for the requested CPU runtime variant (in place)."""
+    if runtime == "fp32":
+        return sam
+
+    import torch
+    encoder = sam.image_encoder.eval()
+    img_size = encoder.img_size
+    example = torch.zeros(1, 3, img_size, img_size)
+
+    if runtime == "int8":
+        sam.image_encoder = torch.ao.quantization.quantize_dynamic(
+            encoder, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif runtime == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(encoder, example))
+        sam.image_encoder = _encoder_wrapper(torch.jit.optimize_for_inference(traced), img_size)
+    elif runtime == "onnx":
+        onnx_path = os.path.splitext(checkpoint_path)[0] + ".encoder.onnx"
+        if not os.path.exists(onnx_path):
+            print(f"Exporting image encoder to {onnx_path} (one-time)...")
+            tmp_path = onnx_path + ".tmp"
+            with torch.no_grad():
+                torch.onnx.export(encoder, example, tmp_path, input_names=["image"],
+                                  output_names=["embeddings"], opset_version=17)
+            os.replace(tmp_path, onnx_path)
+        sam.image_encoder = _encoder_wrapper(_OnnxEncoder(onnx_path), img_size)
+    else:
+        raise ValueError(f"Unknown runtime '{runtime}'")
+    return sam
@@ -0,0 +1,224 @@
+"""
+output_formats.py
+
+Compact encodings of segmentation results (GeoJSON FeatureCollections).
+
+    geojson     GeoJSON; coordinates optionally rounded to `precision` decimals
+                (6 = ~0.1 m, 5 = ~1 m), which roughly halves the payload
+    fgb         FlatGeobuf (binary, streamable; requires fiona)
+    parquet     GeoParquet with WKB geometries (requires pyarrow), for bulk jobs
+    mvt         Mapbox Vector Tile of one z/x/y tile (requires mapbox-vector-tile)
+
+Endpoints pick a format from an explicit `format` query parameter or else from
+the Accept header (see negotiate). Features without a geometry are kept in
+GeoJSON and GeoParquet but left out of FlatGeobuf and vector tiles.
+"""
+
+import io
+import os
+import json
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import shapely.geometry as geom
+from shapely.ops import transform
+
+from imagery import latlon_to_world_px, world_px_to_latlon
+
+MEDIA_TYPES = {
+    "geojson": "application/geo+json",
+    "fgb": "application/flatgeobuf",
+    "parquet": "application/vnd.apache.parquet",
+    "mvt": "application/vnd.mapbox-vector-tile",
+}
+# Accept header values understood besides MEDIA_TYPES
+_ACCEPT_ALIASES = {
+    "application/json": "geojson",
+    "application/x-parquet": "parquet",
+    "application/x-protobuf": "mvt",
+}
+
+MVT_EXTENT = 4096
+# Geometry kept around a vector tile (in tile units) so outlines don't show seams
+MVT_BUFFER = 64
+
+
+def negotiate(format_param: Optional[str], accept: Optional[str], allowed=("geojson", "fgb", "parquet")) -> str:
+    """
+    Output format for a request: format_param if given (ValueError if not one
+    of allowed), else the first allowed media type in the Accept header, else
+    geojson.
+    """
+    if format_param:
+        if format_param not in allowed:
+            raise ValueError(f"format must be one of {', '.join(allowed)}")
+        return format_param
+    by_type = {MEDIA_TYPES[name]: name for name in allowed}
+    by_type.update({t: name for t, name in _ACCEPT_ALIASES.items() if name in allowed})
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in by_type:
+            return by_type[media_type]
+    return "geojson"
+
+
+# ---- GeoJSON ---------------------------------------------------------------
+def _round_coords(coords, precision: int):
+    if isinstance(coords[0], (int, float)):
+        return [round(c, precision) for c in coords]
+    return [_round_coords(c, precision) for c in coords]
+
+
+def quantize_geojson(collection: Dict, precision: int) -> Dict:
+    """Copy of a FeatureCollection with coordinates rounded to precision decimals."""
+    features = []
+    for feature in collection["features"]:
+        geometry = feature.get("geometry")
+        if geometry is not None:
+            geometry = dict(geometry, coordinates=_round_coords(geometry["coordinates"], precision))
+        features.append(dict(feature, geometry=geometry))
+    return dict(collection, features=features)
+
+
+def encode_geojson(collection: Dict, precision: Optional[int] = None) -> bytes:
+    if precision is not None:
+        collection = quantize_geojson(collection, precision)
+    return json.dumps(collection, separators=(",", ":")).encode("utf-8")
+
+
+# ---- FlatGeobuf ------------------------------------------------------------
+def _property_types(features: List[Dict]) -> Dict[str, type]:
+    """Column type per property (first non-null value wins; default str)."""
+    types: Dict[str, type] = {}
+    for feature in features:
+        for name, value in feature["properties"].items():
+            if value is not None and types.get(name) is None:
+                types[name] = type(value)
+            types.setdefault(name, None)
+    return {name: t or str for name, t in types.items()}
+
+
+def _column_value(value, column_type: type):
+    if value is None:
+        return None
+    if column_type in (dict, list):
+        return json.dumps(value)
+    if column_type is bool:
+        return int(value)
+    return value
+
+
+def encode_flatgeobuf(collection: Dict, layer: str = "fields") -> bytes:
+    """FlatGeobuf file of the features that have a geometry (requires fiona)."""
+    import fiona
+
+    features = [f for f in collection["features"] if f.get("geometry") is not None]
+    types = _property_types(features)
+    fiona_types = {int: "int", float: "float", bool: "int"}
+    schema = {
+        "geometry": "Unknown",
+        "properties": {name: fiona_types.get(t, "str") for name, t in types.items()},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{layer}.fgb")
+        with fiona.open(path, "w", driver="FlatGeobuf", crs="EPSG:4326", schema=schema) as dst:
+            dst.writerecords({
+                "geometry": f["geometry"],
+                "properties": {name: _column_value(f["properties"].get(name), t) for name, t in types.items()},
+            } for f in features)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+# ---- GeoParquet ------------------------------------------------------------
+def encode_geoparquet(collection: Dict) -> bytes:
+    """GeoParquet 1.0 (WKB geometry column, CRS84) of all features (requires pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    features = collection["features"]
+    types = _property_types(features)
+    columns = {
+        name: [_column_value(f["properties"].get(name), t) for f in features] for name, t in types.items()
+    }
+    shapes = [geom.shape(f["geometry"]) if f.get("geometry") else None for f in features]
+    columns["geometry"] = pa.array([s.wkb if s is not None else None for s in shapes], type=pa.binary())
+    table = pa.table(columns)
+
+    present = [s for s in shapes if s is not None]
+    column_meta = {"encoding": "WKB", "geometry_types": sorted({s.geom_type for s in present})}
+    if present:
+        column_meta["bbox"] = list(geom.GeometryCollection(present).bounds)
+    metadata = {"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column_meta}}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(metadata)})
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+# ---- Vector tiles ----------------------------------------------------------
+def tile_lonlat_bounds(z: int, x: int, y: int, buffer: float = 0.0) -> Tuple[float, float, float, float]:
+    """(min_lon, min_lat, max_lon, max_lat) of XYZ tile z/x/y, grown by buffer (fraction of a tile)."""
+    max_lat, min_lon = world_px_to_latlon((x - buffer) * 256.0, (y - buffer) * 256.0, z)
+    min_lat, max_lon = world_px_to_latlon((x + 1 + buffer) * 256.0, (y + 1 + buffer) * 256.0, z)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def encode_mvt(layers: Dict[str, List[Dict]], z: int, x: int, y: int) -> bytes:
+    """
+    Vector tile z/x/y with a layer per {name: GeoJSON features (lon/lat)},
+    clipped to the tile plus a small buffer (requires mapbox-vector-tile >= 2).
+    """
+    import mapbox_vector_tile
+
+    clip = geom.box(*tile_lonlat_bounds(z, x, y, MVT_BUFFER / MVT_EXTENT))
+    scale = MVT_EXTENT / 256.0
+
+    def to_tile(lons, lats, *_):
+        xs, ys = [], []
+        for lon, lat in zip(lons, lats):
+            wx, wy = latlon_to_world_px(lat, lon, z)
+            xs.append((wx - x * 256.0) * scale)
+            ys.append((wy - y * 256.0) * scale)
+        return xs, ys
+
+    tile_layers = []
+    for name, features in layers.items():
+        tile_features = []
+        for feature in features:
+            if feature.get("geometry") is None:
+                continue
+            shape = geom.shape(feature["geometry"]).intersection(clip)
+            if shape.is_empty:
+                continue
+            tile_features.append({
+                "geometry": transform(to_tile, shape).wkb,
+                "properties": {k: v for k, v in feature["properties"].items() if v is not None},
+            })
+        tile_layers.append({"name": name, "features": tile_features})
+    return mapbox_vector_tile.encode(
+        tile_layers, default_options={"extents": MVT_EXTENT, "y_coord_down": True},
+    )
+
+
+def iter_geojson_lines(path: str) -> Iterator[Dict]:
+    """Features of a GeoJSON-lines file (one Feature per line), read one at a time."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_geojson_lines(path: str) -> Dict:
+    """FeatureCollection of a GeoJSON-lines file (one Feature per line)."""
+    return {"type": "FeatureCollection", "features": list(iter_geojson_lines(path))}
+
+
+def encode(collection: Dict, fmt: str, precision: Optional[int] = None) -> Tuple[bytes, str]:
+    """(body, media type) of a FeatureCollection in format fmt (geojson, fgb or parquet)."""
+    if fmt == "fgb":
+        return encode_flatgeobuf(collection), MEDIA_TYPES["fgb"]
+    if fmt == "parquet":
+        return encode_geoparquet(collection), MEDIA_TYPES["parquet"]
+    return encode_geojson(collection, precision), MEDIA_TYPES["geojson"]
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+region_pipeline.py
+
+Automatic field delineation over a whole region (village / taluka bbox or polygon).
+
+The region is covered with overlapping zoom-19 tiles, processed row by row
+(north to south). Imagery comes from any imagery source (imagery.py): Google Static Maps, an
+XYZ tile server, or a local orthomosaic (GeoTIFF / COG / MBTiles), which is
+much faster and cheaper for bulk runs. Tiles are prefetched by a small thread pool while the main
+thread encodes each tile once and decodes a grid of point prompts on it.
+Fields found on neighbouring tiles are merged across seams, duplicates in the
+overlaps are dropped, and a field is written out as soon as no later tile can
+touch it, so memory stays flat however large the region is.
+
+Usage:
+    python region_pipeline.py --bbox 74.15 19.52 74.20 19.56 --out fields.geojsonl
+    python region_pipeline.py --polygon village.geojson --out fields.gpkg
+    python region_pipeline.py --bbox 74.15 19.52 74.20 19.56 --imagery cog:/data/ortho_2025.tif \
+        --out fields.geojsonl
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import shapely.geometry as geom
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+from farm_segment_google_sam import (
+    tile_bbox, meters_per_pixel, latlon_to_world_px, world_px_to_latlon,
+    load_tile, load_predictor, decode_prompts, mask_to_polygon,
+    polygons_to_geojson,
+)
+from model_registry import resolve_model
+from imagery import ImagerySource, get_imagery_source
+
+# Fields from different prompts / tiles overlapping by more than this fraction
+# of the smaller one are considered the same field.
+SAME_FIELD_OVERLAP = 0.5
+# Minimum SAM predicted IoU for a mask to count as a field (SAM's own default).
+MIN_PRED_IOU = 0.88
+# Masks outside this fraction of the tile are noise or background.
+MIN_AREA_RATIO = 0.002
+MAX_AREA_RATIO = 0.5
+# Fields opened since the last STRtree build before the tree is rebuilt
+REBUILD_AFTER = 256
+
+
+# ---- tiling ----------------------------------------------------------------
+def plan_tiles(bounds: Tuple[float, float, float, float], zoom: int, tile_px: int,
+               overlap_px: int) -> List[List[Tuple[float, float]]]:
+    """
+    Tile centers (lat, lon) covering bounds, as rows from north to south.
+    Neighbouring tiles overlap by overlap_px so fields on a seam are fully
+    visible in at least one of them.
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    x0, y0 = latlon_to_world_px(max_lat, min_lon, zoom)
+    x1, y1 = latlon_to_world_px(min_lat, max_lon, zoom)
+    step = tile_px - overlap_px
+    cols = max(1, math.ceil((x1 - x0 - overlap_px) / step))
+    rows = max(1, math.ceil((y1 - y0 - overlap_px) / step))
+
+    plan = []
+    for r in range(rows):
+        cy = y0 + tile_px / 2.0 + r * step
+        row = []
+        for c in range(cols):
+            cx = x0 + tile_px / 2.0 + c * step
+            lat, lon = world_px_to_latlon(cx, cy, zoom)
+            row.append((round(lat, 7), round(lon, 7)))
+        plan.append(row)
+    return plan
+
+
+# ---- per-tile automatic segmentation --------------------------------------
+def tile_fields(predictor, img_np: np.ndarray, bbox: Tuple[float, float, float, float],
+                points_per_side: int) -> List[Tuple[geom.Polygon, float]]:
+    """
+    Encode a tile and decode a regular grid of single-point prompts on it.
+    Returns (polygon, score) for every confident, field-sized mask.
+    """
+    predictor.set_image(img_np)
+    h, w = img_np.shape[:2]
+    offsets = (np.arange(points_per_side) + 0.5) / points_per_side
+    prompts = [
+        ([(int(ox * w), int(oy * h))], [1], None)
+        for oy in offsets for ox in offsets
+    ]
+
+    fields = []
+    total_pixels = h * w
+    for (points, _, _), (masks, scores, _) in zip(prompts, decode_prompts(predictor, prompts)):
+        best = int(np.argmax(scores))
+        mask, score = masks[best], float(scores[best])
+        area_ratio = mask.sum() / total_pixels
+        if score < MIN_PRED_IOU or not (MIN_AREA_RATIO <= area_ratio <= MAX_AREA_RATIO):
+            continue
+        polygon = mask_to_polygon(mask, bbox, points[0])
+        if polygon is not None and polygon.is_valid:
+            fields.append((polygon, score))
+    return fields
+
+
+# ---- cross-tile merging ----------------------------------------------------
+class FieldMerger:
+    """
+    Holds fields that may still be extended by tiles not yet processed.
+
+    Within a tile, overlapping masks are duplicates (several prompts hit the
+    same field): the higher-scoring one is kept. Across tiles, overlapping
+    fields are pieces of the same field cut by a tile edge: they are unioned.
+    Pieces are compared only inside the band where their tiles overlap (the
+    rest of each piece is outside the other tile), so a wide field cut by a
+    seam still matches. A piece that links several open fields joins them all.
+
+    Open fields are indexed with an STRtree; fields added since the tree was
+    built are checked linearly until the next rebuild.
+    """
+
+    def __init__(self):
+        self.open: Dict[int, Dict] = {}
+        self._next_id = 0
+        self._tile_boxes: Dict[int, geom.Polygon] = {}
+        self._tree: Optional[STRtree] = None
+        self._tree_ids: List[int] = []
+        self._pending: List[int] = []
+
+    def _rebuild(self) -> None:
+        self._tree_ids = list(self.open)
+        shapes = [self.open[i]["geometry"] for i in self._tree_ids]
+        self._tree = STRtree(shapes) if shapes else None
+        self._pending = []
+
+    def _candidates(self, polygon: geom.Polygon) -> List[int]:
+        ids = [self._tree_ids[i] for i in self._tree.query(polygon)] if self._tree is not None else []
+        ids += self._pending
+        return [i for i in dict.fromkeys(ids) if i in self.open]
+
+    def _open_field(self, geometry, score: float, tiles: set) -> None:
+        self.open[self._next_id] = {"geometry": geometry, "score": score, "tiles": tiles}
+        self._pending.append(self._next_id)
+        self._next_id += 1
+        if len(self._pending) > REBUILD_AFTER:
+            self._rebuild()
+
+    def _same_field(self, field: Dict, polygon: geom.Polygon, tile_id: int, tile_box: geom.Polygon) -> bool:
+        """Whether polygon and field overlap enough inside the tiles they share."""
+        if tile_id in field["tiles"]:
+            band = tile_box
+        else:
+            band = tile_box.intersection(unary_union([self._tile_boxes[t] for t in field["tiles"]]))
+        existing = field["geometry"].intersection(band)
+        piece = polygon.intersection(band)
+        if existing.is_empty or piece.is_empty:
+            return False
+        return existing.intersection(piece).area / min(existing.area, piece.area) >= SAME_FIELD_OVERLAP
+
+    def add(self, polygon: geom.Polygon, score: float, tile_id: int, tile_box: geom.Polygon) -> None:
+        """Add a field found on tile tile_id, whose extent (lon/lat box) is tile_box."""
+        self._tile_boxes[tile_id] = tile_box
+        matches = [
+            i for i in self._candidates(polygon)
+            if self.open[i]["geometry"].intersects(polygon)
+            and self._same_field(self.open[i], polygon, tile_id, tile_box)
+        ]
+        if not matches:
+            self._open_field(polygon, score, {tile_id})
+            return
+
+        if len(matches) == 1 and tile_id in self.open[matches[0]]["tiles"]:
+            # Duplicate from another prompt on this tile
+            field = self.open[matches[0]]
+            if field["tiles"] == {tile_id} and score > field["score"]:
+                del self.open[matches[0]]
+                self._open_field(polygon, score, {tile_id})
+            return
+
+        fields = [self.open.pop(i) for i in matches]
+        merged = unary_union([f["geometry"] for f in fields] + [polygon])
+        if merged.geom_type == "MultiPolygon":
+            merged = max(merged.geoms, key=lambda p: p.area)
+        tiles = set().union(*(f["tiles"] for f in fields)) | {tile_id}
+        self._open_field(merged, max([score] + [f["score"] for f in fields]), tiles)
+
+    def flush(self, south_of_lat: Optional[float] = None) -> List[Dict]:
+        """
+        Remove and return fields lying entirely north of south_of_lat (i.e. out
+        of reach of the remaining rows), or all fields when it is None.
+        """
+        if south_of_lat is None:
+            done, self.open = list(self.open.values()), {}
+        else:
+            done_ids = [i for i, f in self.open.items() if f["geometry"].bounds[1] > south_of_lat]
+            done = [self.open.pop(i) for i in done_ids]
+        in_use = set().union(*(f["tiles"] for f in self.open.values()))
+        self._tile_boxes = {t: box for t, box in self._tile_boxes.items() if t in in_use}
+        self._rebuild()
+        return done
+
+
+# ---- output writers --------------------------------------------------------
+class GeoJSONLinesWriter:
+    """One GeoJSON Feature per line; can be tailed while the job runs."""
+
+    def __init__(self, path: str):
+        self._f = open(path, "w", encoding="utf-8")
+
+    def write(self, feature: Dict) -> None:
+        self._f.write(json.dumps(feature) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class GeoPackageWriter:
+    """Streams features into a GeoPackage layer (requires fiona)."""
+
+    def __init__(self, path: str, layer: str = "fields"):
+        import fiona
+        schema = {
+            "geometry": "Polygon",
+            "properties": {"id": "int", "area_m2": "float", "score": "float", "tiles": "int"},
+        }
+        self._dst = fiona.open(path, "w", driver="GPKG", layer=layer, crs="EPSG:4326", schema=schema)
+
+    def write(self, feature: Dict) -> None:
+        self._dst.write({"geometry": feature["geometry"], "properties": feature["properties"]})
+
+    def close(self) -> None:
+        self._dst.close()
+
+
+def open_writer(path: str, fmt: Optional[str] = None):
+    fmt = fmt or ("gpkg" if path.lower().endswith(".gpkg") else "geojsonl")
+    if fmt == "gpkg":
+        return GeoPackageWriter(path)
+    return GeoJSONLinesWriter(path)
+
+
+# ---- pipeline --------------------------------------------------------------
+def delineate_region(source: ImagerySource, region: geom.base.BaseGeometry, writer, zoom: int = 19,
+                     tile_px: int = 640, overlap_px: int = 128, points_per_side: int = 16,
+                     prefetch: int = 4, model: Optional[str] = None,
+                     tile_runner: Optional[Callable] = None,
+                     progress: Optional[Callable[[int, int, int], None]] = None) -> int:
+    """
+    Run automatic field delineation over region (shapely geometry in EPSG:4326)
+    and stream every field to writer. Returns the number of fields written.
+
+    tile_runner(img_np, bbox, points_per_side) -> [(polygon, score)] replaces
+    the local predictor (the server passes one that runs on its inference
+    thread or worker processes). progress(done_tiles, total_tiles, written) is
+    called after every tile; raising from it aborts the run.
+    """
+    plan = plan_tiles(region.bounds, zoom, tile_px, overlap_px)
+    n_tiles = sum(len(row) for row in plan)
+    mpp = meters_per_pixel(region.centroid.y, zoom)
+    logging.info(f"Region: {len(plan)} rows x {len(plan[0])} cols = {n_tiles} tiles "
+                 f"({mpp:.2f} m/px, {tile_px * mpp:.0f} m per tile)")
+    n_active = sum(
+        1 for row in plan for lat, lon in row
+        if region.intersects(geom.box(*tile_bbox(lat, lon, zoom, tile_px, tile_px)))
+    )
+
+    if tile_runner is None:
+        predictor = load_predictor(resolve_model(model))
+
+        def tile_runner(img_np, bbox, pps):
+            return tile_fields(predictor, img_np, bbox, pps)
+    merger = FieldMerger()
+    written = 0
+
+    def tiles() -> Iterator[Tuple[int, int, float, float]]:
+        tile_id = 0
+        for r, row in enumerate(plan):
+            for center_lat, center_lon in row:
+                yield tile_id, r, center_lat, center_lon
+                tile_id += 1
+
+    def emit(fields: List[Dict]) -> None:
+        nonlocal written
+        fields = [f for f in fields if f["geometry"].intersects(region)]
+        if not fields:
+            return
+        collection = polygons_to_geojson(
+            [f["geometry"] for f in fields],
+            [{"score": round(f["score"], 4), "tiles": len(f["tiles"])} for f in fields],
+        )
+        for feature in collection["features"]:
+            feature["properties"]["id"] = written
+            writer.write(feature)
+            written += 1
+
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        # Bounded look-ahead: at most `prefetch` tiles downloaded ahead of the encoder
+        pending = deque()
+        tile_iter = tiles()
+        current_row = 0
+
+        def submit_next() -> None:
+            for tile_id, r, lat, lon in tile_iter:
+                bbox = tile_bbox(lat, lon, zoom, tile_px, tile_px)
+                if not region.intersects(geom.box(*bbox)):
+                    continue
+                future = pool.submit(load_tile, source, lat, lon, zoom, tile_px)
+                pending.append((tile_id, r, bbox, future))
+                return
+
+        for _ in range(prefetch):
+            submit_next()
+
+        done_tiles = 0
+        while pending:
+            tile_id, r, bbox, future = pending.popleft()
+            submit_next()
+
+            if r != current_row:
+                # Rows r and beyond start at this tile's north edge; anything
+                # entirely north of it is final.
+                emit(merger.flush(south_of_lat=bbox[3]))
+                current_row = r
+
+            try:
+                img_np = future.result()
+            except Exception as e:
+                logging.error(f"Tile {tile_id} failed: {e}")
+                img_np = None
+            if img_np is not None:
+                tile_box = geom.box(*bbox)
+                for polygon, score in tile_runner(img_np, bbox, points_per_side):
+                    merger.add(polygon, score, tile_id, tile_box)
+
+            done_tiles += 1
+            logging.info(f"Tile {done_tiles}/{n_active}: {len(merger.open)} open fields, {written} written")
+            if progress:
+                progress(done_tiles, n_active, written)
+
+    emit(merger.flush())
+    return written
+
+
+def _load_region(args) -> geom.base.BaseGeometry:
+    if args.bbox:
+        return geom.box(*args.bbox)
+    with open(args.polygon, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        return unary_union([geom.shape(feat["geometry"]) for feat in data["features"]])
+    if data.get("type") == "Feature":
+        return geom.shape(data["geometry"])
+    return geom.shape(data)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Delineate all fields in a region with SAM.")
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument("--bbox", type=float, nargs=4, metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"))
+    area.add_argument("--polygon", help="GeoJSON file with the region polygon(s)")
+    parser.add_argument("--out", required=True, help="Output .geojsonl or .gpkg")
+    parser.add_argument("--format", choices=["geojsonl", "gpkg"], help="Output format (default: from extension)")
+    parser.add_argument("--zoom", type=int, default=19)
+    parser.add_argument("--overlap", type=int, default=128, help="Tile overlap in pixels")
+    parser.add_argument("--points-per-side", type=int, default=16, help="Prompt grid density per tile")
+    parser.add_argument("--prefetch", type=int, default=4, help="Tiles downloaded ahead of the encoder")
+    parser.add_argument("--model", help="SAM model name or tier (default: SAM_MODEL)")
+    parser.add_argument("--imagery", help="Imagery source: google, xyz:<url template> or raster:<path> "
+                                          "(default: IMAGERY_SOURCE)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        source = get_imagery_source(os.getenv("GOOGLE_MAPS_API_KEY"), args.imagery)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    writer = open_writer(args.out, args.format)
+    try:
+        count = delineate_region(
+            source, _load_region(args), writer, zoom=args.zoom, overlap_px=args.overlap,
+            points_per_side=args.points_per_side, prefetch=args.prefetch, model=args.model,
+        )
+    finally:
+        writer.close()
+    print(f"Wrote {count} fields to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
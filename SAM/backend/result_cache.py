@@ -0,0 +1,217 @@
+"""
+result_cache.py
+
+Cache of finished segmentation responses, with single-flight coalescing.
+
+Claims are reviewed again and again, so the same click (to sub-metre
+precision) is segmented many times. Responses are cached under a key made of
+the quantized coordinates and everything else that changes the answer
+(model, imagery source, zoom, tile size, post-processing settings). While a
+result is being computed, identical requests wait for that computation
+instead of starting their own.
+
+Backends (RESULT_CACHE):
+    memory                  per-process LRU (default)
+    sqlite:<path>           file shared by all workers on a host
+    redis://host:port/db    shared across hosts (requires the redis package)
+    off                     no caching (coalescing still applies)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Bump when the response format or the segmentation pipeline changes meaningfully
+RESULT_VERSION = 2
+
+
+def result_key(kind: str, **params) -> str:
+    """Content address for a request; params must be JSON-serializable."""
+    raw = json.dumps({"kind": kind, "v": RESULT_VERSION, **params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ---- stores ----------------------------------------------------------------
+class MemoryResultStore:
+    """Thread-safe LRU with TTL."""
+    blocking = False
+
+    def __init__(self, max_items: int = 1024, ttl_seconds: float = 24 * 3600):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResultStore:
+    """Results in a SQLite file (WAL mode), shared by every process on the host."""
+    blocking = True
+
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created REAL, value TEXT)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM results WHERE key = ? AND created > ?", (key, time.time() - self.ttl_seconds)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: Dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, now, json.dumps(value)))
+            self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl_seconds,))
+            self._db.commit()
+
+
+class RedisResultStore:
+    """Results in Redis with a TTL per key."""
+    blocking = True
+
+    def __init__(self, url: str, ttl_seconds: float = 24 * 3600, prefix: str = "sam:result:"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl_seconds = int(ttl_seconds)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self._redis.get(self.prefix + key)
+        return json.loads(value) if value else None
+
+    def put(self, key: str, value: Dict) -> None:
+        self._redis.set(self.prefix + key, json.dumps(value), ex=self.ttl_seconds)
+
+
+# ---- cache with single-flight ---------------------------------------------
+class ResultCache:
+    """Async front end: cache lookup, then one computation per key at a time."""
+
+    def __init__(self, store=None):
+        self.store = store
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def _call(self, fn, *args):
+        if self.store.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        return fn(*args)
+
+    async def _lookup(self, key: str) -> Optional[Dict]:
+        if self.store is None:
+            return None
+        try:
+            return await self._call(self.store.get, key)
+        except Exception as e:
+            # A cache outage must not take segmentation down with it
+            logging.warning(f"Result cache read failed: {e}")
+            return None
+
+    async def _save(self, key: str, value: Dict) -> None:
+        if self.store is None:
+            return
+        try:
+            await self._call(self.store.put, key, value)
+        except Exception as e:
+            logging.warning(f"Result cache write failed: {e}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Cached result for key, else the result of compute(). Concurrent calls
+        with the same key share one compute(); its exception propagates to all
+        of them and nothing is cached.
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await self._join(key, inflight, compute)
+
+        cached = await self._lookup(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        # Another request may have started computing while we looked up the store
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await self._join(key, inflight, compute)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            # The leading request went away; waiters start over
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged as "never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            await self._save(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _join(self, key: str, inflight: asyncio.Future, compute) -> Dict:
+        self.coalesced += 1
+        try:
+            return await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if inflight.cancelled():
+                return await self.get_or_compute(key, compute)
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "inflight": len(self._inflight)}
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        spec = os.getenv("RESULT_CACHE", "memory")
+        ttl = float(os.getenv("RESULT_CACHE_TTL_HOURS", "24")) * 3600
+        if spec == "off":
+            return cls(None)
+        if spec == "memory":
+            return cls(MemoryResultStore(int(os.getenv("RESULT_CACHE_MAX_ITEMS", "1024")), ttl))
+        if spec.startswith("sqlite:"):
+            return cls(SQLiteResultStore(spec[len("sqlite:"):], ttl))
+        if spec.startswith(("redis://", "rediss://", "unix://")):
+            return cls(RedisResultStore(spec, ttl))
+        raise ValueError(f"Unknown RESULT_CACHE '{spec}'. Use memory, sqlite:<path>, redis://... or off.")
@@ -0,0 +1,89 @@
+"""
+result_log.py
+
+Every field segmented by the server, for map layers (GET /tiles/{z}/{x}/{y}).
+
+Features from /segment, /segment/batch and finished jobs are appended to a
+GeoJSON-lines file and kept in memory with an STRtree over their bounds, which
+is rebuilt lazily after new features arrive. The same outline (e.g. clicked
+twice) is stored once.
+
+RESULTS_LOG sets the file (default backend/results/results.geojsonl);
+"off" disables the log and the tile endpoint.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import shapely.geometry as geom
+from shapely.strtree import STRtree
+
+
+class ResultLog:
+    """Append-only store of segmented features with a spatial index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._features: List[Dict] = []
+        self._shapes: List[geom.base.BaseGeometry] = []
+        self._seen = set()
+        self._tree: Optional[STRtree] = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._remember(json.loads(line))
+            logging.info(f"Result log: {len(self._features)} fields from {path}")
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultLog"]:
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "results.geojsonl")
+        path = os.getenv("RESULTS_LOG", default)
+        return None if path == "off" else cls(path)
+
+    def _remember(self, feature: Dict) -> bool:
+        shape = geom.shape(feature["geometry"])
+        digest = hashlib.sha1(shape.wkb).hexdigest()
+        if digest in self._seen:
+            return False
+        self._seen.add(digest)
+        self._features.append(feature)
+        self._shapes.append(shape)
+        self._tree = None
+        return True
+
+    def add(self, features: Iterable[Dict]) -> int:
+        """Append features that have a geometry; returns how many were new."""
+        added = []
+        with self._lock:
+            for feature in features:
+                if feature.get("geometry") is None:
+                    continue
+                feature = {"type": "Feature", "properties": dict(feature.get("properties") or {}),
+                           "geometry": feature["geometry"]}
+                if self._remember(feature):
+                    added.append(feature)
+            if added:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(feature) + "\n" for feature in added)
+        return len(added)
+
+    def query(self, bounds: Tuple[float, float, float, float]) -> List[Dict]:
+        """Features whose geometry intersects bounds (min_lon, min_lat, max_lon, max_lat)."""
+        with self._lock:
+            if self._tree is None and self._shapes:
+                self._tree = STRtree(self._shapes)
+            if self._tree is None:
+                return []
+            tree, features, shapes = self._tree, self._features, self._shapes
+        area = geom.box(*bounds)
+        return [features[i] for i in tree.query(area) if shapes[i].intersects(area)]
+
+    def __len__(self) -> int:
+        return len(self._features)
@@ -0,0 +1,64 @@
+"""
+Shared fixtures. Run from SAM/backend:  python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubServer:
+    """
+    Local HTTP server for client tests. Each GET is answered by the next
+    function in `responses` (the last one repeats): respond(handler) writes
+    the response with the BaseHTTPRequestHandler API.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []  # (path, headers) of every request
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.requests.append((self.path, dict(self.headers)))
+                index = min(len(stub.requests), len(stub.responses)) - 1
+                stub.responses[index](self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def send(status: int = 200, body: bytes = b"", headers=None):
+    """A response function for StubServer.responses."""
+    def respond(handler: BaseHTTPRequestHandler):
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+    return respond
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
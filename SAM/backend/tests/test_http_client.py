@@ -0,0 +1,71 @@
+import time
+
+import pytest
+import requests
+
+from conftest import send
+from http_client import CircuitBreaker, CircuitOpen, ImageryClient
+
+
+def truncated(handler):
+    """Promises 100 bytes, sends 10 and hangs up (ChunkedEncodingError in requests)."""
+    handler.send_response(200)
+    handler.send_header("Content-Length", "100")
+    handler.send_header("Connection", "close")
+    handler.end_headers()
+    handler.wfile.write(b"0123456789")
+    handler.wfile.flush()
+    handler.close_connection = True
+
+
+def client(url, max_retries=0, failures=1, cooldown=0.2):
+    return ImageryClient(url, timeout=5, max_retries=max_retries, backoff_base=0.01,
+                         breaker=CircuitBreaker(failure_threshold=failures, cooldown_seconds=cooldown))
+
+
+def test_retries_transient_status_then_succeeds(stub_server):
+    stub_server.responses = [send(503), send(429, headers={"Retry-After": "0"}), send(200, b"tile")]
+    assert client(stub_server.url, max_retries=3, failures=5).get() == b"tile"
+    assert len(stub_server.requests) == 3
+
+
+def test_client_error_is_not_retried_and_keeps_breaker_closed(stub_server):
+    stub_server.responses = [send(403)]
+    imagery = client(stub_server.url, max_retries=3)
+    with pytest.raises(requests.HTTPError):
+        imagery.get()
+    assert len(stub_server.requests) == 1
+    assert imagery.breaker.state == "closed"
+
+
+def test_truncated_body_is_retried(stub_server):
+    stub_server.responses = [truncated, send(200, b"tile")]
+    assert client(stub_server.url, max_retries=1, failures=5).get() == b"tile"
+
+
+def test_breaker_opens_and_fails_fast(stub_server):
+    stub_server.responses = [send(500)]
+    imagery = client(stub_server.url, failures=2, cooldown=60)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            imagery.get()
+    with pytest.raises(CircuitOpen):
+        imagery.get()
+    assert len(stub_server.requests) == 2
+
+
+def test_failed_trial_with_truncated_body_does_not_wedge_breaker(stub_server):
+    stub_server.responses = [send(500), truncated, send(200, b"tile")]
+    imagery = client(stub_server.url, failures=1, cooldown=0.1)
+    with pytest.raises(requests.HTTPError):
+        imagery.get()
+    assert imagery.breaker.state == "open"
+
+    time.sleep(0.15)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        imagery.get()  # the half-open trial fails
+    assert imagery.breaker.state == "open"
+
+    time.sleep(0.15)
+    assert imagery.get() == b"tile"  # a new trial is let through and closes the breaker
+    assert imagery.breaker.state == "closed"
@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+import pytest
+import requests
+
+import model_fetcher
+from conftest import send
+from model_fetcher import ChecksumMismatch, fetch_checkpoint
+
+DATA = bytes(range(256)) * 400  # 100 KB checkpoint
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(model_fetcher.time, "sleep", lambda seconds: None)
+
+
+def ranged(handler):
+    """Serves DATA, honouring a "Range: bytes=N-" header with a 206."""
+    value = handler.headers.get("Range")
+    if value:
+        offset = int(value[len("bytes="):-1])
+        body = DATA[offset:]
+        handler.send_response(206)
+        handler.send_header("Content-Range", f"bytes {offset}-{len(DATA) - 1}/{len(DATA)}")
+    else:
+        body = DATA
+        handler.send_response(200)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def truncated(handler):
+    """Promises all of DATA, sends half of it and hangs up."""
+    handler.send_response(200)
+    handler.send_header("Content-Length", str(len(DATA)))
+    handler.send_header("Connection", "close")
+    handler.end_headers()
+    handler.wfile.write(DATA[:len(DATA) // 2])
+    handler.wfile.flush()
+    handler.close_connection = True
+
+
+def test_downloads_verifies_and_renames(stub_server, tmp_path):
+    stub_server.responses = [ranged]
+    dest = str(tmp_path / "sam.pth")
+    assert fetch_checkpoint(stub_server.url, dest, sha256=SHA256) == dest
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(dest + ".part")
+    with open(dest + ".sha256", encoding="ascii") as f:
+        assert f.read().split()[0] == SHA256
+
+
+def test_checksum_mismatch_leaves_no_file(stub_server, tmp_path):
+    stub_server.responses = [ranged]
+    dest = str(tmp_path / "sam.pth")
+    with pytest.raises(ChecksumMismatch):
+        fetch_checkpoint(stub_server.url, dest, sha256="0" * 64)
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + ".part")
+
+
+def test_resumes_partial_file_with_range(stub_server, tmp_path):
+    stub_server.responses = [ranged]
+    dest = str(tmp_path / "sam.pth")
+    with open(dest + ".part", "wb") as f:
+        f.write(DATA[:30000])
+    fetch_checkpoint(stub_server.url, dest, sha256=SHA256)
+    assert stub_server.requests[0][1]["Range"] == "bytes=30000-"
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_restarts_when_server_ignores_range(stub_server, tmp_path):
+    stub_server.responses = [send(200, DATA)]
+    dest = str(tmp_path / "sam.pth")
+    with open(dest + ".part", "wb") as f:
+        f.write(b"stale bytes")
+    fetch_checkpoint(stub_server.url, dest, sha256=SHA256)
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_retries_after_dropped_connection(stub_server, tmp_path):
+    stub_server.responses = [truncated, ranged]
+    dest = str(tmp_path / "sam.pth")
+    fetch_checkpoint(stub_server.url, dest, sha256=SHA256, max_retries=1)
+    assert len(stub_server.requests) == 2
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_failed_download_never_creates_the_checkpoint(stub_server, tmp_path):
+    stub_server.responses = [truncated]
+    dest = str(tmp_path / "sam.pth")
+    with pytest.raises(requests.RequestException):
+        fetch_checkpoint(stub_server.url, dest, sha256=SHA256, max_retries=1)
+    assert not os.path.exists(dest)
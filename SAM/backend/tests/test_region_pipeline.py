@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import shapely.geometry as geom
+
+from imagery import ImagerySource, latlon_to_world_px, world_px_to_latlon
+from region_pipeline import FieldMerger, delineate_region
+
+ZOOM = 19
+ORIGIN = latlon_to_world_px(19.56, 74.15, ZOOM)  # north-west corner of the test region
+
+
+def px_box(x0, y0, x1, y1) -> geom.Polygon:
+    """lon/lat box of a world-pixel rectangle relative to ORIGIN."""
+    max_lat, min_lon = world_px_to_latlon(ORIGIN[0] + x0, ORIGIN[1] + y0, ZOOM)
+    min_lat, max_lon = world_px_to_latlon(ORIGIN[0] + x1, ORIGIN[1] + y1, ZOOM)
+    return geom.box(min_lon, min_lat, max_lon, max_lat)
+
+
+class BlankSource(ImagerySource):
+    def read(self, center_lat, center_lon, zoom, tile_px):
+        return np.full((tile_px, tile_px, 3), 128, dtype=np.uint8)
+
+
+class ListWriter:
+    def __init__(self):
+        self.features = []
+
+    def write(self, feature):
+        self.features.append(feature)
+
+
+def delineate(fields):
+    """
+    Run the pipeline over a 1000 x 1000 px region (2 x 2 tiles of 640 px,
+    seams at 512-640 px) with a perfect segmenter that returns the part of
+    each field visible in the tile.
+    """
+    def tile_runner(img_np, bbox, points_per_side):
+        tile = geom.box(*bbox)
+        return [(field.intersection(tile), 0.95) for field in fields if field.intersects(tile)]
+
+    writer = ListWriter()
+    delineate_region(BlankSource(), px_box(0, 0, 1000, 1000), writer, zoom=ZOOM, prefetch=1,
+                     tile_runner=tile_runner)
+    return writer.features
+
+
+@pytest.mark.parametrize("width_px", [200, 340, 520])  # ~56 m, ~96 m, ~146 m
+def test_field_across_vertical_seam_is_one_feature(width_px):
+    field = px_box(576 - width_px / 2, 100, 576 + width_px / 2, 300)
+    features = delineate([field])
+    assert len(features) == 1
+    assert geom.shape(features[0]["geometry"]).symmetric_difference(field).area < 0.01 * field.area
+
+
+def test_field_across_four_tiles_is_one_feature():
+    field = px_box(300, 300, 850, 850)
+    features = delineate([field])
+    assert len(features) == 1
+    assert features[0]["properties"]["tiles"] == 4
+    assert geom.shape(features[0]["geometry"]).symmetric_difference(field).area < 0.01 * field.area
+
+
+def test_neighbouring_fields_across_seam_stay_apart():
+    west, east = px_box(300, 100, 574, 300), px_box(578, 100, 900, 300)
+    assert len(delineate([west, east])) == 2
+
+
+def test_piece_joins_every_field_it_matches():
+    tile_0, tile_1, tile_2 = px_box(0, 0, 640, 640), px_box(512, 0, 1152, 640), px_box(1024, 0, 1664, 640)
+    merger = FieldMerger()
+    merger.add(px_box(400, 100, 640, 300), 0.9, 0, tile_0)
+    merger.add(px_box(1024, 100, 1300, 300), 0.9, 2, tile_2)
+    # Tile 1 sees the field in the middle that links both pieces
+    merger.add(px_box(512, 100, 1152, 300), 0.9, 1, tile_1)
+    fields = merger.flush()
+    assert len(fields) == 1
+    assert fields[0]["tiles"] == {0, 1, 2}
+
+
+def test_duplicate_in_same_tile_keeps_higher_score():
+    tile = px_box(0, 0, 640, 640)
+    merger = FieldMerger()
+    merger.add(px_box(100, 100, 300, 300), 0.90, 0, tile)
+    merger.add(px_box(110, 100, 300, 300), 0.95, 0, tile)
+    fields = merger.flush()
+    assert len(fields) == 1
+    assert fields[0]["score"] == 0.95
+    assert fields[0]["geometry"].equals(px_box(110, 100, 300, 300))
@@ -0,0 +1,42 @@
+import os
+import time
+
+from tile_cache import STALE_TMP_SECONDS, TileCache
+
+# Two TileCache instances on one directory stand in for two worker processes
+
+
+def key(i: int) -> str:
+    return TileCache.make_key(19.5 + i * 0.001, 74.1, 19, 640, "satellite")
+
+
+def test_reads_tiles_written_by_another_process(tmp_path):
+    writer, reader = TileCache(str(tmp_path)), TileCache(str(tmp_path))
+    writer.put(key(0), b"tile-0")
+    assert reader.get(key(0)) == b"tile-0"
+    assert reader.stats()["hits_disk"] == 1
+
+
+def test_size_bound_covers_all_processes(tmp_path):
+    tile = b"x" * 1000
+    first = TileCache(str(tmp_path), max_disk_bytes=5000, rescan_seconds=0)
+    second = TileCache(str(tmp_path), max_disk_bytes=5000, rescan_seconds=0)
+    for i in range(4):
+        first.put(key(i), tile)
+    for i in range(4, 8):
+        second.put(key(i), tile)
+    on_disk = sum(f.stat().st_size for f in tmp_path.rglob("*.tile"))
+    assert on_disk <= 5000
+
+
+def test_scan_removes_only_stale_tmp_files(tmp_path):
+    sub = tmp_path / "ab"
+    sub.mkdir()
+    fresh, stale = sub / "ab12.tile.1.1.tmp", sub / "ab34.tile.2.2.tmp"
+    fresh.write_bytes(b"in progress")
+    stale.write_bytes(b"crashed")
+    old = time.time() - STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    TileCache(str(tmp_path))
+    assert fresh.exists()
+    assert not stale.exists()
@@ -0,0 +1,236 @@
+"""
+tile_cache.py
+
+Two-tier cache for satellite tiles: a small in-memory LRU in front of a
+size-bounded on-disk store with TTL expiry. Entries are content-addressed by
+a hash of the tile request (snapped center, zoom, size, maptype), so any
+process pointed at the same directory shares the same tiles. Each process
+rescans the directory every rescan_seconds, so the size bound covers the files
+written by every process, not only its own.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# A .tmp file older than this is left over from a crashed write; younger ones
+# may be another process's write in progress.
+STALE_TMP_SECONDS = 600
+
+
+class TileCache:
+    """Memory LRU + disk cache for raw tile bytes (PNG/JPEG as downloaded)."""
+
+    def __init__(self, cache_dir: Optional[str], max_disk_bytes: int = 512 * 1024 * 1024,
+                 ttl_seconds: float = 72 * 3600, max_memory_items: int = 64, rescan_seconds: float = 60):
+        """
+        Args:
+            cache_dir: Directory for the disk tier (None or max_disk_bytes=0 disables it)
+            max_disk_bytes: Upper bound on the total size of cached files
+            ttl_seconds: Entries older than this are treated as missing
+            max_memory_items: Number of tiles kept in the in-memory LRU
+            rescan_seconds: How often the disk index is rebuilt to pick up
+                other processes' writes and evictions
+        """
+        self.cache_dir = cache_dir if cache_dir and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_items = max_memory_items
+        self.rescan_seconds = rescan_seconds
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        # key -> (size, created, last_access)
+        self._disk_index: Dict[str, Tuple[int, float, float]] = {}
+        self._disk_bytes = 0
+        self._scanned = 0.0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._scan_disk()
+            self._evict_disk()
+
+    @staticmethod
+    def make_key(center_lat: float, center_lon: float, zoom: int, size: int, maptype: str) -> str:
+        """Content address for a tile request. Centers must already be snapped to the grid."""
+        raw = f"{center_lat:.7f},{center_lon:.7f}|z{zoom}|{size}px|{maptype}"
+        return hashlib.sha256(raw.encode("ascii")).hexdigest()
+
+    # ---- public API --------------------------------------------------------
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                data, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return data
+                del self._memory[key]
+
+            data = self._read_disk(key, now)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._remember(key, data, self._disk_index[key][1])
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, data, now)
+            if self.cache_dir:
+                if time.monotonic() - self._scanned > self.rescan_seconds:
+                    self._scan_disk()
+                self._write_disk(key, data, now)
+                self._evict_disk()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._disk_index):
+                self._drop_disk(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "disk_items": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+            }
+
+    # ---- memory tier -------------------------------------------------------
+    def _remember(self, key: str, data: bytes, created: float) -> None:
+        self._memory[key] = (data, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    # ---- disk tier ---------------------------------------------------------
+    # File mtime records when the tile was downloaded (for TTL), atime is
+    # bumped explicitly on every hit (for LRU eviction), so neither depends on
+    # the filesystem's noatime/relatime settings.
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".tile")
+
+    def _scan_disk(self) -> None:
+        """Rebuild the disk index from the directory, which other processes share."""
+        now = time.time()
+        index: Dict[str, Tuple[int, float, float]] = {}
+        total = 0
+        for sub in os.listdir(self.cache_dir):
+            sub_path = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                path = os.path.join(sub_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # removed by another process meanwhile
+                if name.endswith(".tmp"):
+                    if now - st.st_mtime > STALE_TMP_SECONDS:
+                        # Leftover from an interrupted write
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                if not name.endswith(".tile"):
+                    continue
+                index[name[:-5]] = (st.st_size, st.st_mtime, st.st_atime)
+                total += st.st_size
+        self._disk_index, self._disk_bytes = index, total
+        self._scanned = time.monotonic()
+
+    def _read_disk(self, key: str, now: float) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if key not in self._disk_index:
+            # Possibly written by another process since the last scan
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            self._disk_index[key] = (st.st_size, st.st_mtime, st.st_atime)
+            self._disk_bytes += st.st_size
+        size, created, _ = self._disk_index[key]
+        if now - created > self.ttl_seconds:
+            self._drop_disk(key)
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (now, created))
+        except OSError:
+            self._drop_disk(key)
+            return None
+        self._disk_index[key] = (size, created, now)
+        return data
+
+    def _write_disk(self, key: str, data: bytes, now: float) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        if key in self._disk_index:
+            self._disk_bytes -= self._disk_index[key][0]
+        self._disk_index[key] = (len(data), now, now)
+        self._disk_bytes += len(data)
+
+    def _drop_disk(self, key: str) -> None:
+        size, _, _ = self._disk_index.pop(key)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_disk(self) -> None:
+        now = time.time()
+        for key, (_, created, _) in list(self._disk_index.items()):
+            if now - created > self.ttl_seconds:
+                self._drop_disk(key)
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        # Least recently used first
+        for key in sorted(self._disk_index, key=lambda k: self._disk_index[k][2]):
+            self._drop_disk(key)
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+
+
+_tile_cache: Optional[TileCache] = None
+
+
+def get_tile_cache() -> TileCache:
+    """Process-wide tile cache configured from the environment."""
+    global _tile_cache
+    if _tile_cache is None:
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tile_cache")
+        _tile_cache = TileCache(
+            cache_dir=os.getenv("TILE_CACHE_DIR", default_dir),
+            max_disk_bytes=int(float(os.getenv("TILE_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            ttl_seconds=float(os.getenv("TILE_CACHE_TTL_HOURS", "72")) * 3600,
+            max_memory_items=int(os.getenv("TILE_CACHE_MEMORY_TILES", "64")),
+        )
+    return _tile_cache
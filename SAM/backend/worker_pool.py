@@ -0,0 +1,133 @@
+"""
+worker_pool.py
+
+Multi-process SAM inference with one copy of the model weights.
+
+The model is loaded in the parent before the workers are forked, so every
+worker sees the same weight pages copy-on-write (inference never writes to
+them). With SAM_WEIGHTS_MMAP=1 the weights are additionally memory-mapped from
+the checkpoint, which keeps them shared through the page cache even across
+separately started servers. Each worker is pinned to its own slice of cores
+and runs torch with a matching thread count, so N workers scale across a large
+CPU node instead of fighting over the same cores.
+
+Linux only (fork start method, sched_setaffinity).
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from farm_segment_google_sam import (
+    PromptResult, Tile, load_predictor, segment_tile_prompts, warmup_predictor,
+)
+from model_registry import resolve_model
+from metrics import tracing
+
+# Set in each worker by _init_worker
+_worker_index: Optional[int] = None
+
+
+def _init_worker(counter, torch_threads: int, pin_cpus: bool) -> None:
+    global _worker_index
+    import torch
+
+    with counter.get_lock():
+        _worker_index = counter.value
+        counter.value += 1
+
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (_worker_index * torch_threads) % len(cpus)
+        mine = [cpus[(start + i) % len(cpus)] for i in range(torch_threads)]
+        os.sched_setaffinity(0, mine)
+    torch.set_num_threads(torch_threads)
+    torch.set_grad_enabled(False)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _warmup_worker(models: List[str], tile_px: int) -> int:
+    for name in models:
+        warmup_predictor(load_predictor(resolve_model(name)), tile_px)
+    return os.getpid()
+
+
+def run_tile_job(tile: Tile, model: str, prompts: List[Dict]) -> Tuple[List[PromptResult], Dict[str, float]]:
+    """
+    Executed in a worker: segment all prompts of one tile (or mosaic) with the
+    inherited predictor. Models not loaded before the fork are loaded privately
+    by each worker on first use. Returns the results and the stage timings,
+    which the parent records (metrics in the workers are not scraped).
+    """
+    spec = resolve_model(model)
+    with tracing() as trace:
+        results = segment_tile_prompts(load_predictor(spec), spec.key, tile, prompts)
+    return results, trace.stages
+
+
+def run_region_tile(model: str, img_np: np.ndarray, bbox: Tuple[float, float, float, float],
+                    points_per_side: int) -> List[Tuple]:
+    """Automatic segmentation of one region tile (see region_pipeline.tile_fields)."""
+    from region_pipeline import tile_fields
+    return tile_fields(load_predictor(resolve_model(model)), img_np, bbox, points_per_side)
+
+
+class SamProcessPool:
+    """Pre-forked pool of SAM inference processes sharing the parent's model weights."""
+
+    def __init__(self, workers: int, torch_threads: Optional[int] = None, pin_cpus: bool = True):
+        """
+        Args:
+            workers: Number of inference processes
+            torch_threads: Intra-op threads per worker (default: available cores / workers)
+            pin_cpus: Pin each worker to its own set of cores
+        """
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        self.workers = workers
+        self.torch_threads = torch_threads or max(1, cpus // workers)
+        self.pin_cpus = pin_cpus
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["SamProcessPool"]:
+        """Pool configured by SAM_WORKER_PROCESSES, or None when it is unset/0."""
+        workers = int(os.getenv("SAM_WORKER_PROCESSES", "0"))
+        if workers <= 0:
+            return None
+        threads = int(os.getenv("SAM_TORCH_THREADS", "0")) or None
+        return cls(workers, threads, pin_cpus=os.getenv("SAM_CPU_AFFINITY", "1") == "1")
+
+    def start(self, models: List[str]) -> None:
+        """
+        Load the models in this process, then fork the workers. Call this before
+        the parent runs any inference (torch's intra-op thread pool does not
+        survive fork) and before requests are admitted.
+        """
+        for name in models:
+            load_predictor(resolve_model(name))
+
+        ctx = multiprocessing.get_context("fork")
+        counter = ctx.Value("i", 0)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx,
+            initializer=_init_worker, initargs=(counter, self.torch_threads, self.pin_cpus),
+        )
+        # Fork all workers now, while the parent has no other threads running jobs
+        pids = {f.result() for f in [self.executor.submit(_ping) for _ in range(self.workers)]}
+        print(f"Started {len(pids)} SAM worker processes, {self.torch_threads} torch threads each")
+
+    def warmup(self, models: List[str], tile_px: int = 640) -> None:
+        """Run a warmup inference in the workers (one task per worker, best effort)."""
+        for f in [self.executor.submit(_warmup_worker, models, tile_px) for _ in range(self.workers)]:
+            f.result()
+
+    def shutdown(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,300 @@
+"""
+PMFBY Bulk Prediction
+=====================
+Runs predictions for a list of farms from the command line.
+
+Farms are streamed from a CSV, JSON Lines or Parquet file (one farm per row:
+latitude, longitude, crop, season, area and optionally year, district,
+threshold and an id column), sent to the API concurrently, and each result is
+appended to a JSON Lines output file as soon as it arrives. Memory use does
+not depend on the size of the input.
+
+A checkpoint file next to the output records which rows are finished. After
+a crash or Ctrl+C, run the same command again and it continues where it
+stopped. Rows finished just before a crash may appear twice in the output;
+use the `row` field to de-duplicate.
+
+Usage:
+    python pmfby_bulk.py farms.csv results.jsonl --api-url http://192.168.1.100:5000
+    python pmfby_bulk.py farms.parquet results.jsonl --concurrency 16 --rate-limit 4
+    python pmfby_bulk.py farms.jsonl results.jsonl --cache pmfby_cache.db
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from pmfby_client import PMFBYClient, RateLimiter, Resilience, ResponseCache, SQLiteCache
+
+REQUIRED = ('latitude', 'longitude', 'crop', 'season', 'area')
+CONVERTERS = {
+    'latitude': float,
+    'longitude': float,
+    'crop': str,
+    'season': str,
+    'area': float,
+    'year': int,
+    'district': str,
+    'threshold': float,
+}
+
+
+# ============================================================================
+# INPUT
+# ============================================================================
+
+def read_csv(path: str) -> Iterator[Dict]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_parquet(path: str, batch_size: int = 1024) -> Iterator[Dict]:
+    """Rows of a Parquet file, read a batch at a time (requires pyarrow)."""
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_farms(path: str, fmt: Optional[str] = None) -> Iterator[Dict]:
+    """Farm records of a file; the format comes from fmt or the file extension."""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    readers = {'csv': read_csv, 'jsonl': read_jsonl, 'ndjson': read_jsonl,
+               'parquet': read_parquet, 'pq': read_parquet}
+    if fmt not in readers:
+        raise ValueError(f"Unknown input format '{fmt}'. Use csv, jsonl or parquet.")
+    return readers[fmt](path)
+
+
+def farm_arguments(record: Dict) -> Dict:
+    """predict() arguments of a farm record; raises ValueError if it is incomplete."""
+    missing = [name for name in REQUIRED if record.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return {
+        name: convert(record[name])
+        for name, convert in CONVERTERS.items()
+        if record.get(name) not in (None, '')
+    }
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+class Checkpoint:
+    """
+    Finished rows, stored in constant space: every row below `next_row` is
+    finished, plus the few rows above it that finished out of order.
+    """
+
+    def __init__(self, path: str, save_every: float = 5.0):
+        self.path = path
+        self.save_every = save_every
+        self.next_row = 0
+        self.done_after: Set[int] = set()
+        self._saved = time.monotonic()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.next_row = state['next_row']
+            self.done_after = set(state['done_after'])
+
+    def is_done(self, row: int) -> bool:
+        return row < self.next_row or row in self.done_after
+
+    def mark(self, row: int):
+        self.done_after.add(row)
+        while self.next_row in self.done_after:
+            self.done_after.remove(self.next_row)
+            self.next_row += 1
+        if time.monotonic() - self._saved > self.save_every:
+            self.save()
+
+    def save(self):
+        """Write atomically, so a crash never leaves a torn checkpoint."""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'next_row': self.next_row, 'done_after': sorted(self.done_after)}, f)
+        os.replace(tmp, self.path)
+        self._saved = time.monotonic()
+
+
+# ============================================================================
+# RUN
+# ============================================================================
+
+def run(
+    client: PMFBYClient,
+    farms: Iterator[Dict],
+    output_path: str,
+    checkpoint: Checkpoint,
+    concurrency: int = 8,
+    rate_limit: Optional[float] = None,
+    id_column: str = 'id',
+    max_consecutive_failures: int = 50
+) -> Tuple[int, int]:
+    """
+    Predict every farm not finished yet and append results to output_path.
+
+    At most 2 x concurrency farms are read ahead of the API. A failed
+    prediction is written with its error, except when max_consecutive_failures
+    predictions in a row fail (the API is probably down): the run then stops
+    and those farms are retried next time.
+
+    Returns:
+        tuple: (succeeded, failed) counts for this run
+    """
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    succeeded = failed = 0
+    failure_streak = []  # failed rows not written yet: (row, line)
+    started = time.monotonic()
+    last_report = started
+
+    def predict(record: Dict) -> Dict:
+        try:
+            arguments = farm_arguments(record)
+        except (ValueError, TypeError) as e:
+            return {'success': False, 'error': f'invalid farm record: {e}', 'invalid': True}
+        if limiter:
+            limiter.acquire()
+        return client.predict(**arguments)
+
+    def emit(row: int, line: str):
+        out.write(line)
+        out.flush()
+        checkpoint.mark(row)
+
+    def finish(future, row: int, record: Dict):
+        nonlocal succeeded, failed, last_report
+        result = future.result()
+        line = json.dumps({'row': row, 'id': record.get(id_column, row), 'result': result}, default=str) + '\n'
+        if result.get('success') or result.get('invalid'):
+            # A success means the API is up: the failures before it were real
+            for failed_row, failed_line in failure_streak:
+                emit(failed_row, failed_line)
+            failure_streak.clear()
+            emit(row, line)
+        else:
+            failure_streak.append((row, line))
+            if len(failure_streak) >= max_consecutive_failures:
+                raise RuntimeError(
+                    f'{len(failure_streak)} predictions in a row failed '
+                    f"(last error: {result.get('error')}); stopping, rerun to resume"
+                )
+        if result.get('success'):
+            succeeded += 1
+        else:
+            failed += 1
+
+        now = time.monotonic()
+        if now - last_report > 10:
+            rate = (succeeded + failed) / (now - started)
+            print(f'  {succeeded + failed} done this run ({failed} failed), {rate:.2f} farms/s, '
+                  f'next row {checkpoint.next_row}', file=sys.stderr)
+            last_report = now
+
+    in_flight = {}
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    with open(output_path, 'a', encoding='utf-8') as out:
+        try:
+            for row, record in enumerate(farms):
+                if checkpoint.is_done(row):
+                    continue
+                while len(in_flight) >= 2 * concurrency:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future, *in_flight.pop(future))
+                in_flight[pool.submit(predict, record)] = (row, record)
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish(future, *in_flight.pop(future))
+            # End of input: remaining failures are real failures
+            for failed_row, failed_line in failure_streak:
+                emit(failed_row, failed_line)
+        except KeyboardInterrupt:
+            # Keep the predictions that already came back; the rest are redone on resume
+            try:
+                for future in [f for f in in_flight if f.done() and not f.cancelled()]:
+                    finish(future, *in_flight.pop(future))
+            except RuntimeError:
+                pass
+            raise
+        finally:
+            # Don't wait for requests still running (up to timeout x attempts each)
+            pool.shutdown(wait=False, cancel_futures=True)
+            checkpoint.save()
+    return succeeded, failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run PMFBY predictions for a file of farms.')
+    parser.add_argument('input', help='Farms: .csv, .jsonl or .parquet')
+    parser.add_argument('output', help='Results (JSON Lines, appended)')
+    parser.add_argument('--api-url', default=os.getenv('PMFBY_API_URL', 'http://localhost:5000'))
+    parser.add_argument('--api-key', default=os.getenv('PMFBY_API_KEY'))
+    parser.add_argument('--replica', action='append', default=[], metavar='URL',
+                        help='Another server running the API, for hedging and failover (repeatable)')
+    parser.add_argument('--attempts', type=int, default=3, help='Tries per prediction (default: 3)')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], help='Input format (default: from extension)')
+    parser.add_argument('--id-column', default='id', help='Column copied to the output as id (default: id)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Predictions in flight (default: 8)')
+    parser.add_argument('--rate-limit', type=float, help='Maximum requests started per second')
+    parser.add_argument('--timeout', type=int, default=120, help='Prediction timeout in seconds (default: 120)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: <output>.checkpoint)')
+    parser.add_argument('--cache', help='SQLite response cache shared with other runs')
+    parser.add_argument('--max-consecutive-failures', type=int, default=50,
+                        help='Stop when this many predictions in a row fail (default: 50)')
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(SQLiteCache(args.cache)) if args.cache else None
+    client = PMFBYClient(args.api_url, args.api_key, timeout=args.timeout,
+                         pool_size=args.concurrency, cache=cache, replicas=args.replica,
+                         resilience=Resilience(attempts=args.attempts))
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.checkpoint')
+    if checkpoint.next_row:
+        print(f'Resuming at row {checkpoint.next_row}', file=sys.stderr)
+
+    try:
+        farms = read_farms(args.input, args.format)
+        succeeded, failed = run(
+            client, farms, args.output, checkpoint,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            id_column=args.id_column,
+            max_consecutive_failures=args.max_consecutive_failures,
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print(f'\nInterrupted; rerun the same command to resume at row {checkpoint.next_row}', file=sys.stderr)
+        return 130
+
+    print(f'Done: {succeeded} succeeded, {failed} failed -> {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    code = main()
+    if code:
+        # Interrupted or stopped on failures: exit without joining worker threads
+        # still waiting on the API (up to timeout x attempts each)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+    sys.exit(code)
@@ -8,16 +8,500 @@ Usage:
     
     client = PMFBYClient('http://192.168.1.100:5000')
     result = client.predict(19.54841, 74.188663, 'Rice', 'Kharif', 10)
+    
+    # Many farms, 8 at a time, at most 2 requests/second
+    results = client.batch_predict(farms, max_workers=8, rate_limit=2)
+    
+    # From async code (pip install httpx)
+    async with AsyncPMFBYClient('http://192.168.1.100:5000') as client:
+        result = await client.predict(19.54841, 74.188663, 'Rice', 'Kharif', 10)
+    
+    # Reuse thresholds and predictions across reopened claims and processes
+    cache = ResponseCache(SQLiteCache('pmfby_cache.db'))
+    client = PMFBYClient('http://192.168.1.100:5000', cache=cache)
+    
+    # Hedge slow requests to a second server; retries and circuit breaking are on by default
+    client = PMFBYClient('http://192.168.1.100:5000', replicas=['http://192.168.1.101:5000'])
 """
 
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
 import requests
-from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # only needed by AsyncPMFBYClient
+except ImportError:
+    httpx = None
+
+
+class RateLimiter:
+    """Token bucket shared by threads: at most `rate` calls per second, bursts up to `burst`."""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with a TTL per entry."""
+    
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: str, value: Dict, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """
+    Persistent cache in a SQLite file, shared by every process that opens it.
+    Least recently used entries beyond max_items are evicted.
+    """
+    
+    def __init__(self, path: str, max_items: int = 100000):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, expires REAL, used REAL, value TEXT)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+        self._db.commit()
+        self._writes = 0
+    
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE cache SET used = ? WHERE key = ?', (now, key))
+            self._db.commit()
+        return json.loads(row[0])
+    
+    def set(self, key: str, value: Dict, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                (key, now + ttl, now, json.dumps(value))
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:  # trim now and then, not on every write
+                self._db.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+                self._db.execute(
+                    'DELETE FROM cache WHERE key IN '
+                    '(SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_items,)
+                )
+            self._db.commit()
+
+
+class ResponseCache:
+    """
+    Memoizes successful get_threshold and predict responses.
+    
+    Keys:
+        threshold   (district, crop, season) when by_district is set and the
+                    district is known -- passed in, or learned from earlier
+                    responses for the same grid cell -- else the coordinates
+                    snapped to a grid_degrees grid
+        predict     snapped coordinates, crop, season, area, year, district
+                    and threshold override
+    
+    Usage:
+        cache = ResponseCache(SQLiteCache('pmfby_cache.db'), grid_degrees=0.001)
+        client = PMFBYClient('http://192.168.1.100:5000', cache=cache)
+    """
+    
+    def __init__(
+        self,
+        backend=None,
+        grid_degrees: float = 0.001,
+        by_district: bool = True,
+        threshold_ttl: float = 30 * 86400,
+        predict_ttl: float = 86400
+    ):
+        """
+        Args:
+            backend: MemoryCache (default) or SQLiteCache
+            grid_degrees: Grid coordinates are snapped to (default 0.001, ~110 m)
+            by_district: Key thresholds by district instead of location
+            threshold_ttl: Seconds a threshold is reused (default: 30 days)
+            predict_ttl: Seconds a prediction is reused (default: 1 day)
+        """
+        self.backend = backend if backend is not None else MemoryCache()
+        self.grid_degrees = grid_degrees
+        self.by_district = by_district
+        self.threshold_ttl = threshold_ttl
+        self.predict_ttl = predict_ttl
+        self.hits = 0
+        self.misses = 0
+    
+    def _cell(self, latitude: float, longitude: float) -> str:
+        g = self.grid_degrees
+        return f'{round(latitude / g) * g:.6f},{round(longitude / g) * g:.6f}'
+    
+    def _get(self, key: str) -> Optional[Dict]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(value, cached=True)
+    
+    def _learn_district(self, latitude: float, longitude: float, district: Optional[str]):
+        if district:
+            self.backend.set(f'district|{self._cell(latitude, longitude)}', {'district': district}, self.threshold_ttl)
+    
+    def threshold_key(self, latitude: float, longitude: float, crop: str, season: str,
+                      district: Optional[str] = None) -> str:
+        if self.by_district and not district:
+            known = self.backend.get(f'district|{self._cell(latitude, longitude)}')
+            district = known['district'] if known else None
+        if self.by_district and district:
+            return f'threshold|{district.lower()}|{crop.lower()}|{season.lower()}'
+        return f'threshold|{self._cell(latitude, longitude)}|{crop.lower()}|{season.lower()}'
+    
+    def predict_key(self, latitude: float, longitude: float, crop: str, season: str, area: float,
+                    year: Optional[int] = None, district: Optional[str] = None,
+                    threshold: Optional[float] = None) -> str:
+        return '|'.join(str(part) for part in (
+            'predict', self._cell(latitude, longitude), crop.lower(), season.lower(), area, year,
+            district.lower() if district else None, threshold
+        ))
+    
+    def get_threshold(self, key: str) -> Optional[Dict]:
+        return self._get(key)
+    
+    def get_prediction(self, key: str) -> Optional[Dict]:
+        return self._get(key)
+    
+    def save_threshold(self, key: str, latitude: float, longitude: float, crop: str, season: str, result: Dict):
+        if result.get('success'):
+            self.backend.set(key, result, self.threshold_ttl)
+            district = result.get('district')
+            self._learn_district(latitude, longitude, district)
+            if self.by_district and district:
+                # Later lookups in this cell (or district) use the district key
+                self.backend.set(self.threshold_key(latitude, longitude, crop, season, district), result,
+                                 self.threshold_ttl)
+    
+    def save_prediction(self, key: str, latitude: float, longitude: float, result: Dict):
+        if result.get('success'):
+            self.backend.set(key, result, self.predict_ttl)
+            location = (result.get('data') or {}).get('location') or {}
+            self._learn_district(latitude, longitude, location.get('district'))
+    
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an API replica is down.
+    
+    After failure_threshold failures in a row the circuit opens and calls
+    are refused for reset_after seconds; then one probe request is let
+    through, and its outcome closes the circuit or opens it again.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self._opened: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        if self._opened is None:
+            return 'closed'
+        return 'half-open' if self._probing or self.retry_in() == 0 else 'open'
+    
+    def retry_in(self) -> float:
+        """Seconds until a probe is allowed (0 when closed)."""
+        if self._opened is None:
+            return 0.0
+        return max(0.0, self._opened + self.reset_after - time.monotonic())
+    
+    def claim(self) -> Optional[bool]:
+        """
+        Ask to send a request now: None when refused, otherwise whether this
+        request claimed the half-open probe (its outcome or release() is
+        then owed back).
+        """
+        with self._lock:
+            if self._opened is None:
+                return False
+            if self._probing or self.retry_in() > 0:
+                return None
+            self._probing = True
+            return True
+    
+    def record(self, ok: bool, probe: bool = False):
+        """Outcome of a request; probe says whether it held the half-open probe."""
+        with self._lock:
+            if probe:
+                self._probing = False
+            if ok:
+                self.failures = 0
+                self._opened = None
+                return
+            self.failures += 1
+            if self._opened is not None or self.failures >= self.failure_threshold:
+                self._opened = time.monotonic()
+    
+    def release(self):
+        """Give back a claimed probe abandoned without an outcome (e.g. a cancelled hedge)."""
+        with self._lock:
+            self._probing = False
+
+
+class LatencyTracker:
+    """Recent response times per endpoint, for adaptive timeouts and hedging."""
+    
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(path, deque(maxlen=self.window)).append(seconds)
+    
+    def percentile(self, path: str, q: float) -> Optional[float]:
+        """q-th percentile (0-100) of recent latencies, or None until min_samples are seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(path, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class Resilience:
+    """
+    Retry, timeout, hedging and circuit breaker policy shared by PMFBYClient
+    and AsyncPMFBYClient.
+    
+    The threshold and predict endpoints only compute, so a request can be
+    repeated safely:
+        retries     connection errors, timeouts, 429 and 5xx responses are
+                    retried up to `attempts` times in total, after a jittered
+                    exponential backoff (or the server's Retry-After)
+        timeouts    once enough responses are seen, a request's timeout is
+                    timeout_multiplier x the endpoint's p99 latency, between
+                    min_timeout and the configured timeout
+        hedging     with API replicas, a request still pending after the
+                    endpoint's p95 latency (half the timeout until known) is
+                    also sent to the next replica; the first response wins
+        breaker     a replica failing failure_threshold times in a row is
+                    skipped for reset_after seconds; with every replica
+                    skipped, calls fail at once with an error result
+    
+    Usage:
+        resilience = Resilience(attempts=4, failure_threshold=10)
+        client = PMFBYClient('http://10.0.0.1:5000', replicas=['http://10.0.0.2:5000'],
+                             resilience=resilience)
+    """
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10,
+        adaptive_timeouts: bool = True,
+        timeout_multiplier: float = 2.0,
+        min_timeout: float = 5,
+        hedge: bool = True,
+        failure_threshold: int = 5,
+        reset_after: float = 30
+    ):
+        """
+        Args:
+            attempts: Tries per request, including the first (1 = no retries)
+            backoff: Base delay before the first retry in seconds
+            max_backoff: Longest delay between tries in seconds
+            adaptive_timeouts: Shrink timeouts to the observed latency
+            timeout_multiplier: Adaptive timeout as a multiple of p99 latency
+            min_timeout: Shortest adaptive timeout in seconds
+            hedge: Send slow requests to a replica too (needs replicas)
+            failure_threshold: Failures in a row that open a replica's circuit
+            reset_after: Seconds an open circuit refuses calls
+        """
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.adaptive_timeouts = adaptive_timeouts
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.latency = LatencyTracker()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+    
+    def breaker(self, url: str) -> CircuitBreaker:
+        with self._lock:
+            if url not in self._breakers:
+                self._breakers[url] = CircuitBreaker(self.failure_threshold, self.reset_after)
+            return self._breakers[url]
+    
+    def unavailable(self, urls: List[str]) -> Dict:
+        wait = min(self.breaker(url).retry_in() for url in urls)
+        return {'success': False, 'error': f'circuit open: PMFBY API unavailable, retry in {wait:.1f}s',
+                'circuit_open': True}
+    
+    def timeout(self, path: str, configured: float) -> float:
+        if not self.adaptive_timeouts:
+            return configured
+        p99 = self.latency.percentile(path, 99)
+        if p99 is None:
+            return configured
+        return min(configured, max(self.min_timeout, self.timeout_multiplier * p99))
+    
+    def hedge_delay(self, path: str, timeout: float) -> float:
+        p95 = self.latency.percentile(path, 95)
+        return min(p95, timeout) if p95 is not None else timeout / 2
+    
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number attempt (1-based): full jitter backoff."""
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+    
+    def record(self, url: str, path: str, ok: bool, seconds: Optional[float] = None, probe: bool = False):
+        """
+        Outcome of one request to a replica; seconds is a latency sample and
+        probe whether the request held the replica's half-open probe.
+        Timeouts are recorded with the timeout as their latency, so adaptive
+        timeouts grow again when the API slows down.
+        """
+        if seconds is not None:
+            self.latency.record(path, seconds)
+        self.breaker(url).record(ok, probe)
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After header in seconds (date values are ignored)."""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def threshold_payload(
+    latitude: float,
+    longitude: float,
+    crop: str,
+    season: str,
+    district: Optional[str] = None
+) -> Dict:
+    """Request body of /api/threshold."""
+    data = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'crop': crop,
+        'season': season
+    }
+    
+    if district:
+        data['district'] = district
+    return data
+
+
+def predict_payload(
+    latitude: float,
+    longitude: float,
+    crop: str,
+    season: str,
+    area: float,
+    year: Optional[int] = None,
+    district: Optional[str] = None,
+    threshold: Optional[float] = None
+) -> Dict:
+    """Request body of /api/predict."""
+    data = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'crop': crop,
+        'season': season,
+        'area': area
+    }
+    
+    if year:
+        data['year'] = year
+    if district:
+        data['district'] = district
+    if threshold:
+        data['threshold'] = threshold
+    return data
 
 
 class PMFBYClient:
     """Client for PMFBY Yield Prediction API"""
     
-    def __init__(self, api_url: str, api_key: Optional[str] = None, timeout: int = 60):
+    def __init__(
+        self,
+        api_url: str,
+        api_key: Optional[str] = None,
+        timeout: int = 60,
+        pool_size: int = 10,
+        cache: Optional[ResponseCache] = None,
+        replicas: Optional[List[str]] = None,
+        resilience: Optional[Resilience] = None
+    ):
         """
         Initialize PMFBY API client.
         
@@ -25,26 +509,148 @@ class PMFBYClient:
             api_url: Base URL of API (e.g., 'http://192.168.1.100:5000')
             api_key: Optional API key for authentication
             timeout: Request timeout in seconds (default: 60)
+            pool_size: Keep-alive connections kept to the API (default: 10);
+                batch_predict grows it to its max_workers
+            cache: Optional ResponseCache for thresholds and predictions
+            replicas: Optional base URLs of more servers running the same API,
+                used for hedging and failover
+            resilience: Retry / timeout / hedging / circuit breaker policy
+                (default: Resilience())
         """
         self.api_url = api_url.rstrip('/')
+        self.urls = [self.api_url] + [url.rstrip('/') for url in replicas or []]
         self.api_key = api_key
         self.timeout = timeout
+        self.cache = cache
+        self.resilience = resilience or Resilience()
         self.session = requests.Session()
+        self.pool_size = 0
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._hedge_lock = threading.Lock()
+        self._mount(pool_size)
         
         if api_key:
             self.session.headers.update({'X-API-Key': api_key})
     
-    def health_check(self) -> Dict:
+    def _mount(self, pool_size: int):
+        """Connection pool (and hedge threads) with room for pool_size concurrent requests."""
+        if pool_size > self.pool_size:
+            adapter = HTTPAdapter(pool_connections=len(self.urls), pool_maxsize=pool_size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            with self._hedge_lock:
+                self.pool_size = pool_size
+                # Rebuilt at the new size on next use; the old executor's threads
+                # exit once the requests still using it are done
+                self._hedge_pool = None
+    
+    def _send(self, url: str, path: str, data: Dict, timeout: float,
+              probe: bool = False) -> Tuple[Dict, bool, Optional[float]]:
+        """One request to one replica: (result, retryable, retry_after). probe: see CircuitBreaker.claim."""
+        start = time.monotonic()
+        try:
+            response = self.session.post(f'{url}{path}', json=data, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.Timeout as e:
+            self.resilience.record(url, path, ok=False, seconds=timeout, probe=probe)
+            return {'success': False, 'error': str(e)}, True, None
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            self.resilience.record(url, path, ok=status < 500, probe=probe)  # 4xx: the API is up
+            retry_after = retry_after_seconds(e.response.headers.get('Retry-After'))
+            return {'success': False, 'error': str(e)}, status in Resilience.RETRY_STATUSES, retry_after
+        except requests.exceptions.RequestException as e:  # connection refused / reset
+            self.resilience.record(url, path, ok=False, probe=probe)
+            return {'success': False, 'error': str(e)}, True, None
+        except BaseException:  # e.g. KeyboardInterrupt: no outcome to record
+            if probe:
+                self.resilience.breaker(url).release()
+            raise
+        
+        self.resilience.record(url, path, ok=True, seconds=time.monotonic() - start, probe=probe)
+        try:
+            return response.json(), False, None
+        except ValueError as e:
+            return {'success': False, 'error': f'Invalid JSON response: {e}'}, False, None
+    
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if self._hedge_pool is None:
+                # Threads start on demand; room for every request of a batch on every replica
+                self._hedge_pool = ThreadPoolExecutor(max_workers=max(self.pool_size, 8) * len(self.urls))
+            return self._hedge_pool
+    
+    def _attempt(self, path: str, data: Dict, timeout: float, attempt: int) -> Tuple[Dict, bool, Optional[float]]:
+        """
+        One try: send to the first replica whose circuit allows it (rotating
+        with each retry), and with hedging also to the next replica whenever
+        no answer has come within the hedge delay or a replica failed.
+        """
+        start = attempt % len(self.urls)
+        candidates = iter(self.urls[start:] + self.urls[:start])
+        if not (self.resilience.hedge and len(self.urls) > 1):
+            for url in candidates:
+                probe = self.resilience.breaker(url).claim()
+                if probe is not None:
+                    return self._send(url, path, data, timeout, probe)
+            return self.resilience.unavailable(self.urls), False, None
+        
+        pool = self._hedge_executor()
+        pending = {}
+        
+        def launch() -> bool:
+            for url in candidates:
+                probe = self.resilience.breaker(url).claim()
+                if probe is not None:
+                    pending[pool.submit(self._send, url, path, data, timeout, probe)] = url
+                    return True
+            return False
+        
+        if not launch():
+            return self.resilience.unavailable(self.urls), False, None
+        delay = self.resilience.hedge_delay(path, timeout)
+        more = True
+        outcome = None
+        while pending:
+            done, _ = wait(pending, timeout=delay if more else None, return_when=FIRST_COMPLETED)
+            if not done:
+                more = launch()
+                continue
+            for future in done:
+                del pending[future]
+                outcome = future.result()
+                if not outcome[1]:
+                    return outcome  # requests still running elsewhere finish in the background
+            if more:
+                more = launch()
+        return outcome
+    
+    def _post(self, path: str, data: Dict, timeout: float) -> Dict:
+        """POST with retries, adaptive timeout, hedging and circuit breaking."""
+        timeout = self.resilience.timeout(path, timeout)
+        retry_after = None
+        for attempt in range(self.resilience.attempts):
+            if attempt:
+                time.sleep(self.resilience.delay(attempt, retry_after))
+            result, retryable, retry_after = self._attempt(path, data, timeout, attempt)
+            if not retryable:
+                break
+        return result
+    
+    def health_check(self, timeout: float = 10) -> Dict:
         """
         Check if API is running.
         
+        Args:
+            timeout: Seconds to wait (default: 10)
+        
         Returns:
             dict: {'status': 'ok', 'model': 'v1 (81.8% accuracy)', ...}
         """
         url = f'{self.api_url}/api/health'
         
         try:
-            response = self.session.get(url, timeout=10)
+            response = self.session.get(url, timeout=timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -77,24 +683,19 @@ class PMFBYClient:
                 'unit': 'kg/ha'
             }
         """
-        url = f'{self.api_url}/api/threshold'
+        data = threshold_payload(latitude, longitude, crop, season, district)
         
-        data = {
-            'latitude': latitude,
-            'longitude': longitude,
-            'crop': crop,
-            'season': season
-        }
+        if self.cache:
+            key = self.cache.threshold_key(latitude, longitude, crop, season, district)
+            cached = self.cache.get_threshold(key)
+            if cached is not None:
+                return cached
         
-        if district:
-            data['district'] = district
+        result = self._post('/api/threshold', data, 30)
         
-        try:
-            response = self.session.post(url, json=data, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+        if self.cache:
+            self.cache.save_threshold(key, latitude, longitude, crop, season, result)
+        return result
     
     def predict(
         self,
@@ -144,49 +745,380 @@ class PMFBYClient:
                 }
             }
         """
-        url = f'{self.api_url}/api/predict'
+        data = predict_payload(latitude, longitude, crop, season, area, year, district, threshold)
         
-        data = {
-            'latitude': latitude,
-            'longitude': longitude,
-            'crop': crop,
-            'season': season,
-            'area': area
-        }
+        if self.cache:
+            key = self.cache.predict_key(latitude, longitude, crop, season, area, year, district, threshold)
+            cached = self.cache.get_prediction(key)
+            if cached is not None:
+                return cached
         
-        if year:
-            data['year'] = year
-        if district:
-            data['district'] = district
-        if threshold:
-            data['threshold'] = threshold
+        result = self._post('/api/predict', data, self.timeout)
         
-        try:
-            response = self.session.post(url, json=data, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+        if self.cache:
+            self.cache.save_prediction(key, latitude, longitude, result)
+        return result
     
-    def batch_predict(self, farms: list) -> list:
+    def batch_predict(
+        self,
+        farms: list,
+        max_workers: int = 8,
+        rate_limit: Optional[float] = None,
+        progress: Optional[Callable[[int, int, Dict], None]] = None
+    ) -> List[Dict]:
         """
-        Predict for multiple farms.
+        Predict for multiple farms, several at a time.
+        
+        Each prediction takes 30-60 s on the server (weather fetching), so farms
+        are sent concurrently over the session's connection pool. A farm that
+        fails gets {'success': False, 'error': ...} in its slot; the others are
+        unaffected.
         
         Args:
-            farms: List of dicts with farm details
+            farms: List of dicts with farm details (predict() arguments)
                 [
                     {'latitude': 19.54, 'longitude': 74.18, 'crop': 'Rice', ...},
                     ...
                 ]
+            max_workers: Predictions in flight at once (default: 8)
+            rate_limit: Optional maximum requests started per second
+            progress: Optional callback progress(done, total, result), called
+                as each farm finishes (in completion order)
+        
+        Returns:
+            list: Prediction results in the same order as farms. If interrupted
+                (Ctrl+C), farms not finished yet are returned with
+                {'success': False, 'error': 'cancelled'}
+        """
+        farms = list(farms)
+        total = len(farms)
+        results: List[Optional[Dict]] = [None] * total
+        if not farms:
+            return []
+        
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._mount(max_workers)
+        
+        def run(farm: Dict) -> Dict:
+            if limiter:
+                limiter.acquire()
+            try:
+                return self.predict(**farm)
+            except Exception as e:  # bad farm record (e.g. missing field)
+                return {'success': False, 'error': f'{type(e).__name__}: {e}'}
+        
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {executor.submit(run, farm): i for i, farm in enumerate(farms)}
+        done = 0
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                done += 1
+                if progress:
+                    progress(done, total, results[i])
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        return [r if r is not None else {'success': False, 'error': 'cancelled'} for r in results]
+
+
+class AsyncRateLimiter:
+    """asyncio counterpart of RateLimiter."""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a call is allowed."""
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1.0
+                self._last = time.monotonic()
+            self._tokens -= 1
+
+
+class AsyncPMFBYClient:
+    """
+    asyncio client for PMFBY Yield Prediction API (requires httpx).
+    
+    Same methods and results as PMFBYClient, as coroutines. One pooled HTTP
+    connection pool multiplexes any number of in-flight predictions on the
+    event loop, without a thread per request. Cancelling a call (or the task
+    awaiting it) aborts its request.
+    
+    Usage:
+        async with AsyncPMFBYClient('http://192.168.1.100:5000') as client:
+            results = await client.batch_predict(farms, max_concurrency=50)
+    """
+    
+    def __init__(
+        self,
+        api_url: str,
+        api_key: Optional[str] = None,
+        timeout: float = 60,
+        pool_size: int = 100,
+        cache: Optional[ResponseCache] = None,
+        replicas: Optional[List[str]] = None,
+        resilience: Optional[Resilience] = None
+    ):
+        """
+        Initialize async PMFBY API client.
+        
+        Args:
+            api_url: Base URL of API (e.g., 'http://192.168.1.100:5000')
+            api_key: Optional API key for authentication
+            timeout: Default prediction timeout in seconds (default: 60)
+            pool_size: Maximum open connections to the API (default: 100)
+            cache: Optional ResponseCache (a MemoryCache backend keeps the
+                event loop from waiting on SQLite)
+            replicas: Optional base URLs of more servers running the same API,
+                used for hedging and failover
+            resilience: Retry / timeout / hedging / circuit breaker policy
+                (default: Resilience())
+        """
+        if httpx is None:
+            raise ImportError("AsyncPMFBYClient requires httpx: pip install httpx")
+        self.api_url = api_url.rstrip('/')
+        self.urls = [self.api_url] + [url.rstrip('/') for url in replicas or []]
+        self.api_key = api_key
+        self.timeout = timeout
+        self.cache = cache
+        self.resilience = resilience or Resilience()
+        self.client = httpx.AsyncClient(
+            headers={'X-API-Key': api_key} if api_key else None,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+    
+    async def __aenter__(self) -> 'AsyncPMFBYClient':
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.aclose()
+    
+    async def aclose(self):
+        """Close pooled connections."""
+        await self.client.aclose()
+    
+    async def _send(self, url: str, path: str, data: Dict, timeout: float,
+                    probe: bool = False) -> Tuple[Dict, bool, Optional[float]]:
+        """One request to one replica: (result, retryable, retry_after). probe: see CircuitBreaker.claim."""
+        start = time.monotonic()
+        try:
+            response = await self.client.post(f'{url}{path}', json=data, timeout=timeout)
+            response.raise_for_status()
+        except httpx.TimeoutException as e:
+            self.resilience.record(url, path, ok=False, seconds=timeout, probe=probe)
+            return {'success': False, 'error': str(e) or type(e).__name__}, True, None
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            self.resilience.record(url, path, ok=status < 500, probe=probe)  # 4xx: the API is up
+            retry_after = retry_after_seconds(e.response.headers.get('Retry-After'))
+            return {'success': False, 'error': str(e)}, status in Resilience.RETRY_STATUSES, retry_after
+        except httpx.HTTPError as e:  # connection refused / reset
+            self.resilience.record(url, path, ok=False, probe=probe)
+            return {'success': False, 'error': str(e) or type(e).__name__}, True, None
+        except asyncio.CancelledError:
+            if probe:
+                self.resilience.breaker(url).release()
+            raise
+        
+        self.resilience.record(url, path, ok=True, seconds=time.monotonic() - start, probe=probe)
+        try:
+            return response.json(), False, None
+        except ValueError as e:
+            return {'success': False, 'error': f'Invalid JSON response: {e}'}, False, None
+    
+    async def _attempt(self, path: str, data: Dict, timeout: float, attempt: int) -> Tuple[Dict, bool, Optional[float]]:
+        """One try over the replicas. See PMFBYClient._attempt; losing hedges are cancelled."""
+        start = attempt % len(self.urls)
+        candidates = iter(self.urls[start:] + self.urls[:start])
+        if not (self.resilience.hedge and len(self.urls) > 1):
+            for url in candidates:
+                probe = self.resilience.breaker(url).claim()
+                if probe is not None:
+                    return await self._send(url, path, data, timeout, probe)
+            return self.resilience.unavailable(self.urls), False, None
+        
+        pending = {}
+        started = set()
+        
+        async def send(url: str, probe: bool) -> Tuple[Dict, bool, Optional[float]]:
+            started.add(url)  # from here on _send gives a cancelled probe back itself
+            return await self._send(url, path, data, timeout, probe)
+        
+        def launch() -> bool:
+            for url in candidates:
+                probe = self.resilience.breaker(url).claim()
+                if probe is not None:
+                    pending[asyncio.ensure_future(send(url, probe))] = (url, probe)
+                    return True
+            return False
+        
+        if not launch():
+            return self.resilience.unavailable(self.urls), False, None
+        delay = self.resilience.hedge_delay(path, timeout)
+        more = True
+        outcome = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=delay if more else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    more = launch()
+                    continue
+                for task in done:
+                    del pending[task]
+                    outcome = task.result()
+                    if not outcome[1]:
+                        return outcome
+                if more:
+                    more = launch()
+            return outcome
+        finally:
+            for task, (url, probe) in pending.items():
+                task.cancel()
+                if probe and url not in started:
+                    self.resilience.breaker(url).release()  # cancelled before it ran
+    
+    async def _post(self, path: str, data: Dict, timeout: float) -> Dict:
+        """POST with retries, adaptive timeout, hedging and circuit breaking."""
+        timeout = self.resilience.timeout(path, timeout)
+        retry_after = None
+        for attempt in range(self.resilience.attempts):
+            if attempt:
+                await asyncio.sleep(self.resilience.delay(attempt, retry_after))
+            result, retryable, retry_after = await self._attempt(path, data, timeout, attempt)
+            if not retryable:
+                break
+        return result
+    
+    async def health_check(self, timeout: float = 10) -> Dict:
+        """
+        Check if API is running.
+        
+        Args:
+            timeout: Seconds to wait (default: 10)
+        
+        Returns:
+            dict: {'status': 'ok', 'model': 'v1 (81.8% accuracy)', ...}
+        """
+        try:
+            response = await self.client.get(f'{self.api_url}/api/health', timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            return {'status': 'error', 'message': str(e) or type(e).__name__}
+    
+    async def get_threshold(
+        self,
+        latitude: float,
+        longitude: float,
+        crop: str,
+        season: str,
+        district: Optional[str] = None,
+        timeout: float = 30
+    ) -> Dict:
+        """
+        Calculate PMFBY threshold only. See PMFBYClient.get_threshold.
+        
+        Args:
+            timeout: Seconds to wait (default: 30)
+        """
+        data = threshold_payload(latitude, longitude, crop, season, district)
+        if not self.cache:
+            return await self._post('/api/threshold', data, timeout)
+        
+        key = self.cache.threshold_key(latitude, longitude, crop, season, district)
+        cached = self.cache.get_threshold(key)
+        if cached is not None:
+            return cached
+        result = await self._post('/api/threshold', data, timeout)
+        self.cache.save_threshold(key, latitude, longitude, crop, season, result)
+        return result
+    
+    async def predict(
+        self,
+        latitude: float,
+        longitude: float,
+        crop: str,
+        season: str,
+        area: float,
+        year: Optional[int] = None,
+        district: Optional[str] = None,
+        threshold: Optional[float] = None,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """
+        Get full yield prediction with PMFBY assessment. See PMFBYClient.predict.
+        
+        Args:
+            timeout: Seconds to wait (default: the client's timeout)
+        """
+        data = predict_payload(latitude, longitude, crop, season, area, year, district, threshold)
+        if not self.cache:
+            return await self._post('/api/predict', data, timeout or self.timeout)
+        
+        key = self.cache.predict_key(latitude, longitude, crop, season, area, year, district, threshold)
+        cached = self.cache.get_prediction(key)
+        if cached is not None:
+            return cached
+        result = await self._post('/api/predict', data, timeout or self.timeout)
+        self.cache.save_prediction(key, latitude, longitude, result)
+        return result
+    
+    async def batch_predict(
+        self,
+        farms: list,
+        max_concurrency: int = 8,
+        rate_limit: Optional[float] = None,
+        progress: Optional[Callable[[int, int, Dict], None]] = None
+    ) -> List[Dict]:
+        """
+        Predict for multiple farms concurrently. See PMFBYClient.batch_predict.
+        
+        Args:
+            farms: List of dicts with farm details (predict() arguments)
+            max_concurrency: Predictions in flight at once (default: 8)
+            rate_limit: Optional maximum requests started per second
+            progress: Optional callback progress(done, total, result)
         
         Returns:
-            list: List of prediction results
+            list: Prediction results in the same order as farms. Cancelling
+                the call cancels every outstanding request.
         """
-        results = []
-        for farm in farms:
-            result = self.predict(**farm)
-            results.append(result)
-        return results
+        farms = list(farms)
+        total = len(farms)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        limiter = AsyncRateLimiter(rate_limit) if rate_limit else None
+        done = 0
+        
+        async def run(farm: Dict) -> Dict:
+            nonlocal done
+            async with semaphore:
+                if limiter:
+                    await limiter.acquire()
+                try:
+                    result = await self.predict(**farm)
+                except Exception as e:  # bad farm record (e.g. missing field)
+                    result = {'success': False, 'error': f'{type(e).__name__}: {e}'}
+            done += 1
+            if progress:
+                progress(done, total, result)
+            return result
+        
+        return list(await asyncio.gather(*(run(farm) for farm in farms)))
 
 
 # Example usage
@@ -0,0 +1,83 @@
+"""
+Shared fixtures. Run from pmfby_integration:  python -m pytest tests
+"""
+
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubServer:
+    """
+    Local HTTP server standing in for the PMFBY API. Each request is answered
+    by the next function in `responses` (the last one repeats):
+    respond(handler) writes the response with the BaseHTTPRequestHandler API.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []  # (method, path) of every request
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def answer(self):
+                with stub._lock:
+                    stub.requests.append((self.command, self.path))
+                    index = min(len(stub.requests), len(stub.responses)) - 1
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    stub.responses[index](self)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on a slow response
+
+            do_GET = do_POST = answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def send(status: int = 200, body: bytes = b'{"success": true}', headers=None, delay: float = 0):
+    """A response function for StubServer.responses, written after delay seconds."""
+    def respond(handler: BaseHTTPRequestHandler):
+        if delay:
+            time.sleep(delay)
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+    return respond
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def replica_server():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('httpx')
+
+from conftest import send
+from pmfby_client import AsyncPMFBYClient, Resilience
+
+FARM = {'latitude': 19.5, 'longitude': 74.1, 'crop': 'Rice', 'season': 'Kharif', 'area': 1.0}
+
+
+def test_cancelled_hedge_keeps_a_single_probe(stub_server, replica_server):
+    stub_server.responses = [send(delay=0.5)]
+    replica_server.responses = [send(delay=1.0)]
+    resilience = Resilience(attempts=1, failure_threshold=1, reset_after=0)
+    for _ in range(20):
+        resilience.latency.record('/api/predict', 0.05)  # hedge after 50 ms
+    breaker = resilience.breaker(replica_server.url)
+    breaker.record(False)  # replica half-open: the hedge sent to it is the probe
+
+    async def scenario():
+        async with AsyncPMFBYClient(stub_server.url, replicas=[replica_server.url],
+                                    resilience=resilience) as client:
+            result = await client.predict(**FARM)
+            # The losing hedge is cancelled; whoever asks afterwards may get the probe, once
+            probes = [breaker.claim()]
+            for _ in range(2):
+                await asyncio.sleep(0.1)
+                probes.append(breaker.claim())
+        return result, probes
+
+    result, probes = asyncio.run(scenario())
+    assert result == {'success': True}
+    assert len(replica_server.requests) == 1
+    assert probes.count(True) == 1
@@ -0,0 +1,129 @@
+import threading
+
+from conftest import send
+from pmfby_client import CircuitBreaker, PMFBYClient, Resilience
+
+FARM = {'latitude': 19.5, 'longitude': 74.1, 'crop': 'Rice', 'season': 'Kharif', 'area': 1.0}
+
+
+def recorded_delays(resilience: Resilience) -> list:
+    """Record the backoff delays resilience picks, without sleeping."""
+    delays = []
+    pick = resilience.delay
+
+    def delay(attempt, retry_after=None):
+        delays.append(pick(attempt, retry_after))
+        return 0
+
+    resilience.delay = delay
+    return delays
+
+
+def hedge_after(resilience: Resilience, seconds: float):
+    """Latency history that makes the hedge delay `seconds`."""
+    for _ in range(resilience.latency.min_samples):
+        resilience.latency.record('/api/predict', seconds)
+
+
+def test_retries_server_errors_then_succeeds(stub_server):
+    stub_server.responses = [send(503), send(502), send()]
+    resilience = Resilience(attempts=3)
+    delays = recorded_delays(resilience)
+    assert PMFBYClient(stub_server.url, resilience=resilience).predict(**FARM) == {'success': True}
+    assert len(stub_server.requests) == 3
+    assert len(delays) == 2
+
+
+def test_retry_after_sets_the_delay(stub_server):
+    stub_server.responses = [send(429, headers={'Retry-After': '2'}), send()]
+    resilience = Resilience(attempts=2)
+    delays = recorded_delays(resilience)
+    assert PMFBYClient(stub_server.url, resilience=resilience).predict(**FARM) == {'success': True}
+    assert delays == [2.0]
+
+
+def test_client_error_is_not_retried_and_keeps_circuit_closed(stub_server):
+    stub_server.responses = [send(400, b'{"success": false, "error": "bad crop"}')]
+    resilience = Resilience(attempts=3, failure_threshold=1)
+    result = PMFBYClient(stub_server.url, resilience=resilience).predict(**FARM)
+    assert result['success'] is False
+    assert len(stub_server.requests) == 1
+    assert resilience.breaker(stub_server.url).state == 'closed'
+
+
+def test_slow_request_is_hedged_to_replica(stub_server, replica_server):
+    stub_server.responses = [send(delay=2)]
+    replica_server.responses = [send(body=b'{"success": true, "replica": true}')]
+    resilience = Resilience(attempts=1)
+    hedge_after(resilience, 0.05)
+    client = PMFBYClient(stub_server.url, replicas=[replica_server.url], resilience=resilience)
+    assert client.predict(**FARM) == {'success': True, 'replica': True}
+    assert len(stub_server.requests) == 1
+    assert len(replica_server.requests) == 1
+
+
+def test_open_circuit_fails_over_then_fails_fast(stub_server, replica_server):
+    stub_server.responses = [send(503)]
+    replica_server.responses = [send(503)]
+    resilience = Resilience(attempts=2, hedge=False, failure_threshold=1, reset_after=60)
+    recorded_delays(resilience)
+    client = PMFBYClient(stub_server.url, replicas=[replica_server.url], resilience=resilience)
+    assert client.predict(**FARM)['success'] is False
+    # The retry went to the replica; both circuits are now open
+    assert len(stub_server.requests) == len(replica_server.requests) == 1
+    result = client.predict(**FARM)
+    assert result['circuit_open'] is True
+    assert len(stub_server.requests) == len(replica_server.requests) == 1
+
+
+def test_breaker_hands_out_one_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_after=0)
+    assert breaker.claim() is False
+    breaker.record(False)
+    assert breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.claim() is True  # half-open: this caller holds the probe
+    assert breaker.claim() is None
+    breaker.record(False)  # a request from before the circuit opened
+    assert breaker.claim() is None
+    breaker.release()
+    assert breaker.claim() is True
+    breaker.record(True, probe=True)
+    assert breaker.state == 'closed'
+    assert breaker.claim() is False
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=60)
+    breaker.record(False)
+    assert breaker.claim() is None
+    breaker.reset_after = 0
+    assert breaker.claim() is True
+    breaker.reset_after = 60
+    breaker.record(False, probe=True)
+    assert breaker.state == 'open'
+    assert breaker.claim() is None
+
+
+def test_batch_grows_the_hedge_threads(stub_server, replica_server):
+    in_flight, peak, lock = [0], [0], threading.Lock()
+    slow = send(delay=0.5)
+
+    def respond(handler):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            slow(handler)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    stub_server.responses = [respond]
+    client = PMFBYClient(stub_server.url, pool_size=1, replicas=[replica_server.url],
+                         resilience=Resilience(attempts=1))
+    client.predict(**FARM)  # hedge threads sized for pool_size=1
+    results = client.batch_predict([FARM] * 32, max_workers=32)
+    assert all(r['success'] for r in results)
+    assert peak[0] == 32
+    assert len(replica_server.requests) == 0